@@ -0,0 +1,419 @@
+"""
+Inter-annotator agreement and bootstrap confidence intervals
+Ratings are collected once into a rater x item matrix. Gwet's AC1/AC2, Cohen's
+and Fleiss' kappa and Krippendorff's alpha all reduce to sums of per-item
+terms, so a bootstrap replicate is a vector of item draw counts and a whole
+batch of replicates is one matrix product instead of resampled DataFrames.
+Coefficients follow irrCAC (Gwet's definitions, missing ratings allowed).
+"""
+
+import os
+import json
+import argparse
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from sentence_labels import MISSING, iter_sentence_records
+
+
+COEFFICIENTS = ["percent_agreement", "gwet_ac", "cohen_kappa", "fleiss_kappa", "krippendorff_alpha"]
+
+WEIGHTS = ("identity", "linear", "quadratic")
+
+# 4-point scale of plausibility and persona ratings (expert and LLM labelers)
+RATING_CATEGORIES = [1, 2, 3, 4]
+
+# Persona fidelity scores in llm_dialogue.jsonl / expert_dialogue.jsonl and the
+# matching key of the LLM judge's `llm_result`
+PERSONA_SCORES = {
+    "personality": "Personality",
+    "cefr": "CEFR",
+    "recall": "Recall_level",
+    "confused": "Dazed_level",
+    "realism": "Realism",
+}
+
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+class RatingMatrix:
+    """Ratings as category codes in a raters x items array (-1 = not rated)"""
+
+    def __init__(self, codes: np.ndarray, raters: List[str], items: List[str], categories: List):
+        self.codes = codes
+        self.raters = raters
+        self.items = items
+        self.categories = categories
+
+    @classmethod
+    def from_records(cls,
+                     records: Iterable[Dict],
+                     item_key: str,
+                     rater_key: str,
+                     value_key: str,
+                     categories: Optional[List] = None) -> 'RatingMatrix':
+        """
+        Build the matrix from long-format records
+
+        Args:
+            records: One dict per rating
+            item_key: Field identifying the rated item
+            rater_key: Field identifying the rater
+            value_key: Field holding the rating (None/NaN = not rated)
+            categories: All possible ratings (default: the observed ones, sorted)
+        """
+        ratings = {}
+        for record in records:
+            value = record.get(value_key)
+            if not _is_missing(value):
+                ratings[(str(record[rater_key]), str(record[item_key]))] = value
+
+        if categories is None:
+            categories = sorted({value for value in ratings.values()})
+        position = {value: code for code, value in enumerate(categories)}
+        raters = sorted({rater for rater, _ in ratings})
+        items = sorted({item for _, item in ratings})
+        rater_index = {rater: i for i, rater in enumerate(raters)}
+        item_index = {item: i for i, item in enumerate(items)}
+
+        codes = np.full((len(raters), len(items)), -1, dtype=np.int16)
+        for (rater, item), value in ratings.items():
+            if value not in position:
+                raise ValueError(f"Rating {value!r} of {rater} is not one of the categories {categories}")
+            codes[rater_index[rater], item_index[item]] = position[value]
+        return cls(codes, raters, items, list(categories))
+
+    def one_hot(self) -> np.ndarray:
+        """(raters, items, categories) indicator array; unrated cells are all zero"""
+        q = len(self.categories)
+        return (self.codes[..., None] == np.arange(q)).astype(float)
+
+
+def weight_matrix(categories: List, kind: str = 'identity') -> np.ndarray:
+    """
+    Agreement weights between categories (irrCAC definitions)
+
+    Non-numeric categories are placed at 1..q for linear and quadratic weights.
+    """
+    if kind not in WEIGHTS:
+        raise ValueError(f"Unknown weights: {kind} (use one of {', '.join(WEIGHTS)})")
+    q = len(categories)
+    if kind == 'identity':
+        return np.eye(q)
+    numeric = all(isinstance(c, (int, float)) for c in categories)
+    values = np.array(categories if numeric else range(1, q + 1), dtype=float)
+    span = values.max() - values.min()
+    distance = np.abs(values[:, None] - values[None, :]) / (span if span else 1.0)
+    return 1 - distance if kind == 'linear' else 1 - distance ** 2
+
+
+def _item_features(counts: np.ndarray,
+                   weights: np.ndarray,
+                   first: Optional[np.ndarray] = None,
+                   second: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Per-item columns whose (weighted) sums determine every coefficient
+
+    Args:
+        counts: (items, q) ratings per category
+        weights: (q, q) agreement weights
+        first, second: (items, q) one-hot ratings of a rater pair (for Cohen's kappa)
+    """
+    raters = counts.sum(1)
+    weighted = counts @ weights.T
+    agreeing = (counts * (weighted - 1)).sum(1)
+    rated = raters >= 1
+    paired = raters >= 2
+    pairs = np.where(paired, raters * (raters - 1), 1)
+
+    columns = [
+        paired,                                                        # items rated at least twice
+        np.where(paired, agreeing / pairs, 0),                         # observed agreement per item
+        rated,                                                         # items rated at all
+        counts / np.where(rated, raters, 1)[:, None],                  # category shares (Gwet, Fleiss)
+        np.where(paired, raters, 0),                                   # ratings on paired items (Krippendorff)
+        np.where(paired, agreeing / np.where(paired, raters - 1, 1), 0),
+        counts * paired[:, None],                                      # category counts (Krippendorff)
+    ]
+    if first is not None:
+        columns += [first, second]
+    return np.column_stack([np.asarray(c, dtype=float).reshape(len(counts), -1) for c in columns])
+
+
+def _coefficients(sums: np.ndarray, weights: np.ndarray, pairwise: bool) -> Dict[str, np.ndarray]:
+    """Coefficients from summed item features, one value per row of `sums`"""
+    q = len(weights)
+    paired, observed, rated = sums[:, 0], sums[:, 1], sums[:, 2]
+    shares = sums[:, 3:3 + q]
+    k_ratings, k_observed, k_counts = sums[:, 3 + q], sums[:, 4 + q], sums[:, 5 + q:5 + 2 * q]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pa = observed / paired
+        pi = shares / rated[:, None]
+        gwet_pe = weights.sum() * (pi * (1 - pi)).sum(1) / (q * (q - 1)) if q >= 2 else np.ones_like(pa)
+        fleiss_pe = np.einsum('kl,bk,bl->b', weights, pi, pi)
+
+        # Krippendorff adds a small-sample correction to observed agreement
+        epsilon = 1 / k_ratings
+        k_pa = (1 - epsilon) * k_observed / k_ratings + epsilon
+        k_pi = k_counts / k_ratings[:, None]
+        k_pe = np.einsum('kl,bk,bl->b', weights, k_pi, k_pi)
+
+        result = {
+            "percent_agreement": pa,
+            "gwet_ac": (pa - gwet_pe) / (1 - gwet_pe),
+            "fleiss_kappa": (pa - fleiss_pe) / (1 - fleiss_pe),
+            "krippendorff_alpha": (k_pa - k_pe) / (1 - k_pe),
+        }
+        if pairwise:
+            first = sums[:, 5 + 2 * q:5 + 3 * q] / paired[:, None]
+            second = sums[:, 5 + 3 * q:5 + 4 * q] / paired[:, None]
+            cohen_pe = np.einsum('kl,bk,bl->b', weights, first, second)
+            result["cohen_kappa"] = (pa - cohen_pe) / (1 - cohen_pe)
+        else:
+            result["cohen_kappa"] = np.full_like(pa, np.nan)
+    return result
+
+
+def _bootstrap_counts(rng: np.random.Generator, size: int, n_bootstrap: int) -> np.ndarray:
+    """(n_bootstrap, size) draw counts of resampling `size` items with replacement"""
+    return rng.multinomial(size, np.full(size, 1.0 / size), size=n_bootstrap).astype(float)
+
+
+def _summarize(label: str,
+               features: np.ndarray,
+               weights: np.ndarray,
+               rng: np.random.Generator,
+               n_bootstrap: int,
+               ci: float,
+               pairwise: bool) -> List[Dict]:
+    point = _coefficients(features.sum(0, keepdims=True), weights, pairwise)
+    replicates = _coefficients(_bootstrap_counts(rng, len(features), n_bootstrap) @ features, weights, pairwise)
+
+    rows = []
+    for name in COEFFICIENTS:
+        if not pairwise and name == "cohen_kappa":
+            continue
+        scores = replicates[name][~np.isnan(replicates[name])]
+        lower, upper = (np.percentile(scores, [(100 - ci) / 2, 100 - (100 - ci) / 2])
+                        if len(scores) else (np.nan, np.nan))
+        rows.append({
+            "rater_pair": label,
+            "coefficient": name,
+            "agreement": float(point[name][0]),
+            "mean": float(scores.mean()) if len(scores) else np.nan,
+            f"ci_lower_{ci:g}%": float(lower),
+            f"ci_upper_{ci:g}%": float(upper),
+            "num_items": len(features),
+            "num_sample": len(scores),
+        })
+    return rows
+
+
+def pairwise_agreement(matrix: RatingMatrix,
+                       weights: str = 'identity',
+                       n_bootstrap: int = 1000,
+                       ci: float = 95,
+                       seed: int = 42,
+                       overall: bool = True) -> pd.DataFrame:
+    """
+    Agreement coefficients with bootstrap CIs for every rater pair
+
+    Each pair is scored on the items both raters rated; its bootstrap
+    resamples those items. With `overall`, an extra "all" row scores every
+    rater together (multi-rater Gwet, Fleiss and Krippendorff; no Cohen).
+    With non-identity weights, Gwet's AC1 becomes AC2 and the kappas and
+    alpha become their weighted versions.
+
+    Args:
+        matrix: Ratings
+        weights: identity, linear or quadratic
+        n_bootstrap: Bootstrap replicates per pair
+        ci: Confidence level in percent
+        seed: Resampling seed
+
+    Returns:
+        Long-format DataFrame: one row per (rater_pair, coefficient)
+    """
+    agreement_weights = weight_matrix(matrix.categories, weights)
+    one_hot = matrix.one_hot()
+    rated = matrix.codes >= 0
+    rng = np.random.default_rng(seed)
+
+    rows = []
+    for a, b in combinations(range(len(matrix.raters)), 2):
+        shared = np.flatnonzero(rated[a] & rated[b])
+        if not len(shared):
+            continue
+        first, second = one_hot[a, shared], one_hot[b, shared]
+        features = _item_features(first + second, agreement_weights, first, second)
+        rows += _summarize(f"{matrix.raters[a]}-{matrix.raters[b]}", features, agreement_weights,
+                           rng, n_bootstrap, ci, pairwise=True)
+
+    if overall and len(matrix.raters) > 2:
+        items = np.flatnonzero(rated.any(0))
+        features = _item_features(one_hot[:, items].sum(0), agreement_weights)
+        rows += _summarize("all", features, agreement_weights, rng, n_bootstrap, ci, pairwise=False)
+    return pd.DataFrame(rows)
+
+
+def bootstrap_means(frame: pd.DataFrame,
+                    group_col: str,
+                    value_cols: List[str],
+                    n_bootstrap: int = 1000,
+                    ci: float = 95,
+                    seed: int = 42) -> pd.DataFrame:
+    """
+    Group means with percentile bootstrap CIs (e.g. persona scores per patient model)
+
+    Missing values are dropped per column; each (group, column) is resampled
+    with all `n_bootstrap` replicates drawn in one batch.
+
+    Returns:
+        One row per (group, column): mean, CI bounds, number of values
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for group, sub in frame.groupby(group_col, sort=True):
+        for column in value_cols:
+            values = pd.to_numeric(sub[column], errors='coerce').dropna().to_numpy(dtype=float)
+            if not len(values):
+                continue
+            means = _bootstrap_counts(rng, len(values), n_bootstrap) @ values / len(values)
+            lower, upper = np.percentile(means, [(100 - ci) / 2, 100 - (100 - ci) / 2])
+            rows.append({
+                group_col: group,
+                "score": column,
+                "mean": values.mean(),
+                f"ci_lower_{ci:g}%": lower,
+                f"ci_upper_{ci:g}%": upper,
+                "num_values": len(values),
+            })
+    return pd.DataFrame(rows)
+
+
+def read_jsonl(path: str) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def plausibility_matrix(paths: List[str]) -> RatingMatrix:
+    """Utterance plausibility ratings from expert/LLM label JSONL files"""
+    records = [record for path in paths for record in read_jsonl(path)]
+    return RatingMatrix.from_records(records, "utterance_id", "labeler_name", "score",
+                                     categories=RATING_CATEGORIES)
+
+
+def persona_matrix(path: str, score: str) -> RatingMatrix:
+    """
+    Expert vs LLM-judge ratings of one persona score from expert_dialogue.jsonl
+
+    Each dialogue is rated by one expert, so experts are pooled into a
+    single "expert" rater and compared with the judge's `llm_result`.
+    """
+    records = []
+    for record in read_jsonl(path):
+        records.append({"item": record["hadm_id"], "rater": "expert", "value": record.get(score)})
+        records.append({"item": record["hadm_id"], "rater": "llm",
+                        "value": (record.get("llm_result") or {}).get(PERSONA_SCORES[score])})
+    return RatingMatrix.from_records(records, "item", "rater", "value", categories=RATING_CATEGORIES)
+
+
+def sentence_matrix(label_files: Dict[str, str], field: str = 'step0') -> RatingMatrix:
+    """
+    Sentence labels of several labelers (manual and model label files)
+
+    Args:
+        label_files: Rater name -> sentence_label_*.json
+        field: 'step0' (information vs non-information) or 'unsupported' (informative sentences only)
+    """
+    records = []
+    for rater, path in label_files.items():
+        for record in iter_sentence_records(path):
+            if field == 'step0':
+                value = "information" if record["step0"] == "information" else "non-information"
+            else:
+                value = None if record["unsupported"] == MISSING else record["unsupported"]
+            item = f"{record['hadm_id']}|{record['utterance']}|{record['sentence']}"
+            records.append({"item": item, "rater": rater, "value": value})
+    return RatingMatrix.from_records(records, "item", "rater", "value")
+
+
+def persona_scores(root: str) -> pd.DataFrame:
+    """Persona scores of every backbone's llm_dialogue.jsonl under `root`"""
+    frames = []
+    for backbone in sorted(os.listdir(root)):
+        path = os.path.join(root, backbone, "llm_dialogue.jsonl")
+        if os.path.exists(path):
+            frames.append(pd.DataFrame(read_jsonl(path)))
+    if not frames:
+        raise FileNotFoundError(f"No llm_dialogue.jsonl found under {root}")
+    return pd.concat(frames, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inter-annotator agreement and bootstrap confidence intervals')
+    parser.add_argument('task', choices=['plausibility', 'persona', 'sentence', 'scores'],
+                        help='plausibility: utterance ratings; persona: expert vs LLM judge; '
+                             'sentence: manual vs model sentence labels; scores: per-model persona score CIs')
+    parser.add_argument('--labels', nargs='*',
+                        default=[os.path.join('info_test', 'expert_plausibility_label.jsonl'),
+                                 os.path.join('info_test', 'llm_plausibility_label.jsonl')],
+                        help='plausibility: label JSONL files')
+    parser.add_argument('--expert-dialogues', default=os.path.join('persona_test', 'expert_dialogue.jsonl'),
+                        help='persona: expert persona ratings')
+    parser.add_argument('--sentence-labels', nargs='*',
+                        default=[f"manual={os.path.join('sentence_cls_valid', 'sentence_label_manual.json')}",
+                                 f"gemini={os.path.join('sentence_cls_valid', 'sentence_label_gemini-2.5-flash-preview-04-17.json')}",
+                                 f"gpt-4o={os.path.join('sentence_cls_valid', 'sentence_label_gpt-4o.json')}"],
+                        help='sentence: name=path label files')
+    parser.add_argument('--sentence-field', choices=['step0', 'unsupported'], default='step0')
+    parser.add_argument('--root', default=os.path.join('persona_test', 'llm_simulation'),
+                        help='scores: directory with one sub-directory per patient backbone')
+    parser.add_argument('--weights', choices=WEIGHTS, default='identity',
+                        help='Agreement weights (non-identity gives Gwet AC2 and weighted kappa/alpha)')
+    parser.add_argument('--coefficients', default=','.join(COEFFICIENTS), help='Comma-separated coefficients to show')
+    parser.add_argument('--bootstrap', type=int, default=1000, help='Bootstrap replicates')
+    parser.add_argument('--ci', type=float, default=95, help='Confidence level in percent')
+    parser.add_argument('--seed', type=int, default=42, help='Resampling seed')
+    parser.add_argument('--out', help='Write the result table to this CSV')
+    args = parser.parse_args()
+
+    if args.task == 'scores':
+        result = bootstrap_means(persona_scores(args.root), "patient_engine_name", list(PERSONA_SCORES),
+                                 args.bootstrap, args.ci, args.seed)
+    else:
+        if args.task == 'plausibility':
+            matrices = {"plausibility": plausibility_matrix(args.labels)}
+        elif args.task == 'persona':
+            matrices = {score: persona_matrix(args.expert_dialogues, score) for score in PERSONA_SCORES}
+        else:
+            label_files = dict(spec.split('=', 1) for spec in args.sentence_labels)
+            matrices = {args.sentence_field: sentence_matrix(label_files, args.sentence_field)}
+
+        coefficients = [name.strip() for name in args.coefficients.split(',')]
+        frames = []
+        for name, matrix in matrices.items():
+            if not matrix.raters:
+                continue
+            print(f"{name}: {len(matrix.raters)} raters, {len(matrix.items)} items, "
+                  f"categories {matrix.categories}")
+            frame = pairwise_agreement(matrix, args.weights, args.bootstrap, args.ci, args.seed)
+            frames.append(frame[frame['coefficient'].isin(coefficients)].assign(ratings=name))
+        result = pd.concat(frames, ignore_index=True)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_rows', None):
+        print(result.round(3).to_string(index=False))
+
+    if args.out:
+        result.to_csv(args.out, index=False)
+        print(f"Saved {args.task} results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Micro-batching for local inference servers - groups concurrent requests to one model
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+
+class BatchItemError(Exception):
+    """One request inside a batch failed; carries the HTTP status the server gave it"""
+
+    def __init__(self, status_code: int, message: str = ''):
+        super().__init__(message or f"Batch item failed with status {status_code}")
+        self.status_code = status_code
+
+
+class MicroBatcher:
+    """
+    Collects requests for one model over a short window and dispatches them together
+
+    A batch is flushed when it holds `max_batch` requests or `flush_interval`
+    seconds after its first request arrived. With `send_batch` the batch goes
+    out as a single call; otherwise each request is sent with `send_one`.
+    At most `parallel` sends are in flight, matching the server's decode slots
+    so they stay full without requests queueing behind them.
+
+    Must only be used from one event loop (the LLMClient's).
+    """
+
+    def __init__(self,
+                 send_one: Callable[[Any], Awaitable[Any]],
+                 send_batch: Optional[Callable[[List[Any]], Awaitable[List[Any]]]] = None,
+                 max_batch: int = 4,
+                 flush_interval: float = 0.01,
+                 parallel: int = 4):
+        """
+        Args:
+            send_one: Coroutine function sending one request and returning its result
+            send_batch: Optional coroutine function sending a list of requests and
+                returning one result (or exception instance) per request
+            max_batch: Requests per batch
+            flush_interval: Seconds to wait for a batch to fill
+            parallel: Sends in flight at once
+        """
+        self.send_one = send_one
+        self.send_batch = send_batch
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = flush_interval
+        self.parallel = max(1, parallel)
+        self.batches = 0
+        self.requests = 0
+        self._pending = []
+        self._timer = None
+        # Created on first use so it binds to the client's loop
+        self._slots = None
+
+    async def submit(self, request: Any) -> Any:
+        """Queue one request and wait for its result"""
+        loop = asyncio.get_running_loop()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.parallel)
+
+        future = loop.create_future()
+        self._pending.append((request, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._flush)
+        return await future
+
+    def stats(self) -> dict:
+        """Batches dispatched and their mean size"""
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else None
+        }
+
+    def _flush(self):
+        """Dispatch everything pending, in batches of at most `max_batch`"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            self._pending = self._pending[self.max_batch:]
+            # Callers that gave up while waiting are dropped before sending
+            batch = [(request, future) for request, future in batch if not future.done()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            asyncio.ensure_future(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List):
+        if self.send_batch is None:
+            await asyncio.gather(*(self._send(request, future) for request, future in batch))
+            return
+
+        async with self._slots:
+            try:
+                results = await self.send_batch([request for request, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+        if len(results) != len(batch):
+            error = RuntimeError(f"Batch of {len(batch)} requests returned {len(results)} results")
+            results = [error] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _send(self, request: Any, future: asyncio.Future):
+        async with self._slots:
+            if future.done():
+                return
+            try:
+                result = await self.send_one(request)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            if not future.done():
+                future.set_result(result)
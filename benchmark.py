@@ -0,0 +1,309 @@
+"""
+Offline throughput benchmark for the dialogue runner
+Runs DialogueGenerator against the mock LLM backend at several concurrency levels
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import yaml
+
+from generate_dialogues import DialogueGenerator
+from metrics import percentile
+from patient_agent import PatientAgent
+from persona_templates import clear_caches
+from profile_store import ProfileStore
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def build_config(base_config: Dict, backend: str, mock_settings: Dict, max_turns: int,
+                 output_dir: str, server_url: str = None, batching: Dict = None) -> Dict:
+    """Copy of the base config with mock doctor/patient models"""
+    config = dict(base_config)
+    config['simulation'] = dict(base_config['simulation'], max_turns=max_turns, output_dir=output_dir)
+    config['cache'] = {'enabled': False}
+
+    if backend == 'inproc':
+        spec = {'provider': 'mock', 'model_name': 'mock', 'mock': mock_settings}
+    elif backend == 'ollama-http':
+        spec = {'provider': 'ollama', 'model_name': 'mock', 'base_url': server_url}
+    else:
+        os.environ.setdefault('MOCK_API_KEY', 'mock')
+        spec = {'provider': 'openai_compatible', 'model_name': 'mock',
+                'base_url': f"{server_url}/v1", 'api_key_env': 'MOCK_API_KEY'}
+
+    spec.update({'temperature': 0.7, 'max_tokens': 2048, 'pool_size': 1024})
+    if batching:
+        spec['batching'] = batching
+    config['models'] = {'bench-doctor': dict(spec), 'bench-patient': dict(spec)}
+    return config
+
+
+def run_level(config_path: str, split: str, dialogues: int, concurrency: int) -> Dict:
+    """
+    Generate `dialogues` dialogues at one concurrency level and collect stats
+
+    Meant to run in a fresh process (see `run_level_isolated`): peak RSS is
+    a per-process high-water mark, so it only describes this level there.
+    """
+    generator = DialogueGenerator(config_path=config_path)
+
+    start = time.perf_counter()
+    results = generator.generate_for_split(
+        split=split,
+        doctor_model='bench-doctor',
+        patient_model='bench-patient',
+        limit=dialogues,
+        concurrency=concurrency
+    )
+    elapsed = time.perf_counter() - start
+
+    metrics = generator.llm_client.metrics
+    latencies = metrics.latencies('bench-doctor') + metrics.latencies('bench-patient')
+    batches = generator.llm_client.batch_stats().get('bench-patient', {})
+    generator.llm_client.close()
+
+    return {
+        "concurrency": concurrency,
+        "dialogues": len(results),
+        "seconds": round(elapsed, 3),
+        "dialogues_per_sec": round(len(results) / elapsed, 3) if elapsed else None,
+        "turns": len(latencies),
+        "turn_p50_ms": round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        "turn_p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "mean_batch_size": batches.get('mean_batch_size')
+    }
+
+
+def run_level_isolated(config_path: str, split: str, dialogues: int, concurrency: int) -> Dict:
+    """`run_level` in its own child process, so its peak RSS excludes earlier levels"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_level, config_path, split, dialogues, concurrency).result()
+
+
+def bench_agent_construction(profiles: List[Dict], models: int, rounds: int) -> Dict:
+    """
+    Patient agent construction cost (no LLM calls)
+
+    "cold" clears the compiled templates and vocabulary tables before every
+    agent, as if each dialogue assembled its prompt from scratch. "warm"
+    builds `models` agents per profile with shared caches, as in a sweep.
+    """
+    def timed(cold: bool) -> float:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for profile in profiles:
+                for model in range(models):
+                    if cold:
+                        clear_caches()
+                    PatientAgent(profile, f"model-{model}", None, seed=model)
+        return (time.perf_counter() - start) / (rounds * len(profiles) * models)
+
+    clear_caches()
+    cold = timed(cold=True)
+    warm = timed(cold=False)
+    return {"agents": rounds * len(profiles) * models,
+            "cold_us": round(cold * 1e6, 1),
+            "warm_us": round(warm * 1e6, 1)}
+
+
+def _dialogue_ids(split_dir: Path, pattern: str) -> List[str]:
+    """hadm_ids of every record in the split directory's files matching `pattern`"""
+    ids = []
+    for path in sorted(split_dir.glob(pattern)):
+        with open(path, 'r', encoding='utf-8') as f:
+            ids.extend(str(json.loads(line)['hadm_id']) for line in f if line.strip())
+    return ids
+
+
+def check_workers(config: Dict, tmp: str, shard_split: str, queue_split: str, dialogues: int,
+                  shards: int, queue_workers: int, queue_lease: float, concurrency: int) -> Dict:
+    """
+    Multi-process check of sharded and work-queue runs sharing one tree
+
+    Starts `shards` --shard workers on `shard_split` and `queue_workers`
+    --queue-dir workers on `queue_split` at the same time, all on an empty
+    profile cache, then merges. Every worker must exit cleanly and every
+    profile must be generated exactly once. A `queue_lease` shorter than a
+    dialogue checks that running claims are kept alive and not taken over.
+    """
+    config = dict(config, profile_cache_dir=os.path.join(tmp, 'profile_cache'))
+    config_path = os.path.join(tmp, 'workers_config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generate_dialogues.py')
+    common = [sys.executable, script, '--config', config_path, '--doctor-model', 'bench-doctor',
+              '--patient-model', 'bench-patient', '--limit', str(dialogues)]
+    commands = [common + ['run', '--splits', shard_split, '--shard', f"{index}/{shards}",
+                          '--concurrency', str(concurrency)]
+                for index in range(shards)]
+    commands += [common + ['run', '--splits', queue_split, '--queue-dir', os.path.join(tmp, 'queue'),
+                           '--queue-lease', str(queue_lease), '--concurrency', str(concurrency)]
+                 for _ in range(queue_workers)]
+
+    start = time.perf_counter()
+    workers = [subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+               for command in commands]
+    failures = []
+    for command, worker in zip(commands, workers):
+        _, stderr = worker.communicate()
+        if worker.returncode != 0:
+            failures.append({"worker": ' '.join(command[command.index('run') + 1:]),
+                             "returncode": worker.returncode,
+                             "error": stderr.strip().splitlines()[-1] if stderr.strip() else ''})
+    elapsed = time.perf_counter() - start
+
+    merge = subprocess.run(common + ['merge', '--splits', f"{shard_split},{queue_split}"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if merge.returncode != 0:
+        failures.append({"worker": 'merge', "returncode": merge.returncode,
+                         "error": merge.stderr.strip().splitlines()[-1] if merge.stderr.strip() else ''})
+
+    splits = {}
+    for split in (shard_split, queue_split):
+        split_dir = Path(config['simulation']['output_dir']) / f"{split}_test" / "llm_simulation" / 'bench-patient'
+        generated = Counter(_dialogue_ids(split_dir, 'llm_dialogue.shard-*.jsonl'))
+        merged = _dialogue_ids(split_dir, 'llm_dialogue.jsonl')
+        splits[split] = {
+            "generated": sum(generated.values()),
+            "generated_twice": sorted(hadm_id for hadm_id, count in generated.items() if count > 1),
+            "merged": len(merged),
+            "merged_unique": len(set(merged))
+        }
+
+    ok = not failures and all(
+        not s["generated_twice"] and s["merged"] == s["merged_unique"] == dialogues for s in splits.values()
+    )
+    return {"ok": ok, "workers": len(commands), "seconds": round(elapsed, 3),
+            "failures": failures, "splits": splits}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dialogue generation against a mock LLM')
+
+    parser.add_argument('--config', default='config.yaml', help='Base config file path')
+    parser.add_argument('--backend', default='inproc', choices=['inproc', 'ollama-http', 'openai-http'],
+                        help='In-process mock, or the local HTTP stand-in via the Ollama/OpenAI client paths')
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma-separated concurrency levels')
+    parser.add_argument('--dialogues', type=int, default=16, help='Dialogues per level')
+    parser.add_argument('--split', default='persona', help='Profile split to draw from')
+    parser.add_argument('--max-turns', type=int, default=6, help='Turns per dialogue')
+    parser.add_argument('--ttft-ms', type=float, default=50, help='Mock time to first token')
+    parser.add_argument('--tokens-per-second', type=float, default=400, help='Mock generation rate')
+    parser.add_argument('--completion-tokens', type=int, default=40, help='Mock mean reply length')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Mock error injection rate')
+    parser.add_argument('--batching', action='store_true',
+                        help='Enable micro-batching (inproc and ollama-http backends)')
+    parser.add_argument('--num-parallel', type=int, default=4, help='Decode slots when batching')
+    parser.add_argument('--batch-endpoint', action='store_true',
+                        help='Send each batch as one /api/batch call instead of parallel requests')
+    parser.add_argument('--agent-construction', action='store_true',
+                        help='Only time PatientAgent construction (cold vs warm prompt caches)')
+    parser.add_argument('--workers', action='store_true',
+                        help='Instead of timing, check parallel --shard and --queue-dir worker processes on one tree')
+    parser.add_argument('--shards', type=int, default=3, help='--shard workers for --workers')
+    parser.add_argument('--queue-workers', type=int, default=2, help='--queue-dir workers for --workers')
+    parser.add_argument('--queue-split', default='info', help='Split the --queue-dir workers draw from')
+    parser.add_argument('--queue-lease', type=float, default=1.0,
+                        help='Claim lease for --workers (shorter than a dialogue, to exercise the heartbeat)')
+    parser.add_argument('--json', help='Also write results to this JSON file')
+
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        base_config = yaml.safe_load(f)
+
+    if args.agent_construction:
+        store = ProfileStore(base_config['patient_profile_path'], base_config.get('profile_cache_dir'))
+        result = bench_agent_construction(list(store), models=4, rounds=5)
+        print(f"PatientAgent construction over {result['agents']} agents: "
+              f"cold {result['cold_us']} us, warm {result['warm_us']} us per agent")
+        return
+
+    mock_settings = {
+        'ttft_ms': args.ttft_ms,
+        'tokens_per_second': args.tokens_per_second,
+        'completion_tokens': args.completion_tokens,
+        'error_rate': args.error_rate
+    }
+
+    server = None
+    server_url = None
+    if args.backend != 'inproc':
+        from mock_llm import start_server
+        server = start_server(settings=mock_settings)
+        server_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    batching = None
+    if args.batching:
+        batching = {'enabled': True, 'num_parallel': args.num_parallel, 'batch_endpoint': args.batch_endpoint}
+
+    results: List[Dict] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        config = build_config(base_config, args.backend, mock_settings, args.max_turns, tmp,
+                              server_url, batching)
+
+        if args.workers:
+            concurrency = int(args.concurrency.split(',')[-1])
+            result = check_workers(config, tmp, args.split, args.queue_split, args.dialogues,
+                                   args.shards, args.queue_workers, args.queue_lease, concurrency)
+            if server is not None:
+                server.shutdown()
+            print(f"\n{result['workers']} workers on an empty profile cache finished in {result['seconds']} s")
+            for failure in result['failures']:
+                print(f"  FAILED {failure['worker']} (exit {failure['returncode']}): {failure['error']}")
+            for split, stats in result['splits'].items():
+                print(f"  {split}: {stats['generated']} generated, {len(stats['generated_twice'])} generated twice, "
+                      f"{stats['merged_unique']}/{args.dialogues} merged")
+            print("OK" if result['ok'] else "FAILED")
+            if args.json:
+                with open(args.json, 'w') as f:
+                    json.dump(result, f, indent=2)
+            sys.exit(0 if result['ok'] else 1)
+        config_path = os.path.join(tmp, 'bench_config.yaml')
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(config, f)
+
+        for level in [int(c) for c in args.concurrency.split(',')]:
+            results.append(run_level_isolated(config_path, args.split, args.dialogues, level))
+
+    if server is not None:
+        server.shutdown()
+
+    print(f"\n{'='*78}")
+    print(f"Backend: {args.backend}, {args.dialogues} dialogues x {args.max_turns} turns per level")
+    print(f"{'='*78}")
+    print(f"{'conc':>5} {'dialogues':>10} {'seconds':>9} {'dlg/s':>8} {'turn p50 ms':>12} "
+          f"{'turn p95 ms':>12} {'peak RSS MB':>12} {'batch size':>11}")
+    for r in results:
+        print(f"{r['concurrency']:>5} {r['dialogues']:>10} {r['seconds']:>9} {r['dialogues_per_sec']:>8} "
+              f"{r['turn_p50_ms']:>12} {r['turn_p95_ms']:>12} {r['peak_rss_mb']:>12} "
+              f"{str(r['mean_batch_size'] or '-'):>11}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"backend": args.backend, "results": results}, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
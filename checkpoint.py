@@ -0,0 +1,157 @@
+"""
+Checkpointing helpers - incremental JSONL output and resume support
+"""
+
+import os
+import json
+import time
+from pathlib import Path
+from typing import Dict, Set, Tuple
+
+
+def dialogue_key(dialogue: Dict) -> Tuple[str, str, str]:
+    """Identity of a finished dialogue: (hadm_id, patient_model, doctor_model)"""
+    return (
+        str(dialogue.get('hadm_id')),
+        dialogue.get('patient_engine_name'),
+        dialogue.get('doctor_engine_name')
+    )
+
+
+def load_completed_keys(path: Path) -> Set[Tuple[str, str, str]]:
+    """
+    Read an existing dialogue JSONL and return the keys already finished
+
+    A truncated last line (from a crash mid-write) is ignored.
+    """
+    keys = set()
+    if not Path(path).exists():
+        return keys
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                keys.add(dialogue_key(json.loads(line)))
+            except json.JSONDecodeError:
+                continue
+
+    return keys
+
+
+def drop_dialogues(path: Path, hadm_ids: Set[str]) -> int:
+    """
+    Remove records for `hadm_ids` from a dialogue JSONL (atomic rewrite)
+
+    Returns:
+        Number of records removed
+    """
+    path = Path(path)
+    if not hadm_ids or not path.exists():
+        return 0
+
+    removed = 0
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as dst:
+        for line in src:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if str(record.get('hadm_id')) in hadm_ids:
+                removed += 1
+                continue
+            dst.write(line if line.endswith('\n') else line + '\n')
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    os.replace(tmp_path, path)
+    return removed
+
+
+class DialogueWriter:
+    """Append-only JSONL writer that fsyncs in batches"""
+
+    def __init__(self,
+                 path: Path,
+                 append: bool = False,
+                 fsync_every: int = 10,
+                 fsync_interval: float = 5.0):
+        """
+        Open the output file
+
+        Args:
+            path: Output JSONL path (parent directories are created)
+            append: Keep existing records instead of truncating the file
+            fsync_every: fsync after this many records
+            fsync_interval: ... or after this many seconds, whichever comes first
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.count = 0
+
+        if append:
+            self._drop_partial_line()
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _drop_partial_line(self):
+        """Truncate a trailing line left incomplete by a crash, so appends stay valid JSONL"""
+        if not self.path.exists():
+            return
+
+        with open(self.path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+
+            # Scan backwards for the last complete line
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                newline = f.read(step).rfind(b'\n')
+                if newline != -1:
+                    f.truncate(pos + newline + 1)
+                    return
+            f.truncate(0)
+
+    def write(self, dialogue: Dict):
+        """Append one dialogue and flush it to the OS"""
+        self._file.write(json.dumps(dialogue, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self.count += 1
+        self._pending += 1
+
+        if (self._pending >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        """Force buffered records to stable storage"""
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """fsync remaining records and close the file"""
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
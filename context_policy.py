@@ -0,0 +1,151 @@
+"""
+Conversation context policies - decide which history is sent with each turn
+"""
+
+from typing import Callable, Dict, List, Optional
+
+from token_utils import estimate_message_tokens
+
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a medical interview between a doctor and a patient. "
+    "Merge the new exchanges into the existing summary. Keep every concrete fact the patient "
+    "has stated (symptoms, timing, history, medications) and what the doctor has already asked. "
+    "Write plain prose, no more than a short paragraph."
+)
+
+
+class ContextPolicy:
+    """
+    Builds the message list for one agent turn
+
+    Modes:
+        full: system prompt plus the entire conversation history (original behaviour)
+        window: pinned system prompt plus the most recent `window_turns` exchanges,
+            trimmed from the oldest until the estimated prompt fits `token_budget`.
+            With `summarize`, turns that drop out of the window are folded into a
+            rolling summary sent right after the system prompt.
+
+    A policy keeps the rolling summary for one conversation, so each agent needs
+    its own instance.
+    """
+
+    def __init__(self,
+                 mode: str = 'full',
+                 window_turns: Optional[int] = None,
+                 token_budget: Optional[int] = None,
+                 summarize: bool = False,
+                 summary_max_tokens: int = 256):
+        if mode not in ('full', 'window'):
+            raise ValueError(f"Unknown context policy: {mode}")
+
+        self.mode = mode
+        self.window_turns = window_turns
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_max_tokens = summary_max_tokens
+
+        self.summary = ""
+        self._summarized = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'ContextPolicy':
+        """Build a policy from the `context:` section of config.yaml"""
+        config = config or {}
+        return cls(
+            mode=config.get('policy', 'full'),
+            window_turns=config.get('window_turns'),
+            token_budget=config.get('token_budget'),
+            summarize=config.get('summarize', False),
+            summary_max_tokens=config.get('summary_max_tokens', 256)
+        )
+
+    def describe(self) -> Dict:
+        """Policy settings for output metadata"""
+        if self.mode == 'full':
+            return {"policy": "full"}
+        return {
+            "policy": self.mode,
+            "window_turns": self.window_turns,
+            "token_budget": self.token_budget,
+            "summarize": self.summarize
+        }
+
+    def reset(self):
+        """Forget the rolling summary"""
+        self.summary = ""
+        self._summarized = 0
+
+    def build_messages(self,
+                       system_prompt: str,
+                       history: List[Dict[str, str]],
+                       summarizer: Optional[Callable[[str, List[Dict[str, str]]], str]] = None) -> List[Dict[str, str]]:
+        """
+        Assemble the messages for the next LLM call
+
+        Args:
+            system_prompt: Agent system prompt (always kept)
+            history: Full conversation history in chat format
+            summarizer: Called as summarizer(previous_summary, evicted_messages) to
+                update the rolling summary; required when `summarize` is on
+
+        Returns:
+            Message list to send
+        """
+        system = [{"role": "system", "content": system_prompt}]
+        if self.mode == 'full':
+            return system + history
+
+        start = 0
+        if self.window_turns is not None:
+            # One turn = one message from each side
+            start = max(0, len(history) - 2 * self.window_turns)
+
+        summarizing = self.summarize and summarizer is not None
+
+        # Drop the oldest remaining messages until the prompt fits the budget,
+        # always keeping the latest message. Room is reserved for the summary.
+        if self.token_budget is not None:
+            budget = self.token_budget - (self.summary_max_tokens if summarizing else 0)
+            while start < len(history) - 1 and estimate_message_tokens(system + history[start:]) > budget:
+                start += 1
+
+        if summarizing and start > self._summarized:
+            self.summary = summarizer(self.summary, history[self._summarized:start])
+            self._summarized = start
+
+        return self._assemble(system, history[start:])
+
+    def _assemble(self, system: List[Dict[str, str]], recent: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        if not self.summary:
+            return system + recent
+        summary = {"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"}
+        return system + [summary] + recent
+
+
+def summary_messages(previous_summary: str,
+                     evicted: List[Dict[str, str]],
+                     speaker: str) -> List[Dict[str, str]]:
+    """
+    Messages asking a model to fold evicted turns into the running summary
+
+    Args:
+        previous_summary: Current summary ('' if none yet)
+        evicted: History messages leaving the window
+        speaker: Label for the agent's own ('assistant') messages, e.g. 'Doctor'
+    """
+    lines = []
+    for message in evicted:
+        # 'user' messages already carry a "Doctor:"/"Patient:" prefix
+        if message['role'] == 'assistant':
+            lines.append(f"{speaker}: {message['content']}")
+        else:
+            lines.append(message['content'])
+
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": (
+            f"Existing summary:\n{previous_summary or '(none)'}\n\n"
+            f"New exchanges:\n" + "\n".join(lines)
+        )}
+    ]
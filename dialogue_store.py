@@ -0,0 +1,249 @@
+"""
+Columnar dialogue store - Parquet tables for dialogue metadata and turns
+Dialogues live in two hive-partitioned datasets under one root:
+
+    <root>/dialogues/split=<split>/patient_engine_name=<model>/part-0.parquet
+    <root>/turns/split=<split>/patient_engine_name=<model>/part-0.parquet
+
+Turns reference their dialogue by `dialogue_id`, so persona metadata is stored
+once per dialogue instead of once per JSONL row, and readers load only the
+columns and partitions they ask for.
+"""
+
+import json
+import argparse
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from checkpoint import dialogue_key
+
+
+# Partition keys, shared by both tables
+PARTITION_COLUMNS = ["split", "patient_engine_name"]
+
+# Dialogue metadata columns and their types; keys not listed here are kept in `extra` as JSON
+DIALOGUE_COLUMNS = [
+    ("dialogue_id", "string"),
+    ("hadm_id", "string"),
+    ("doctor_engine_name", "string"),
+    ("age", "int64"),
+    ("gender", "string"),
+    ("diagnosis", "string"),
+    ("cefr_type", "string"),
+    ("personality_type", "string"),
+    ("recall_level_type", "string"),
+    ("dazed_level_type", "string"),
+    ("prompt_layout", "string"),
+    ("seed", "int64"),
+    ("prompt_hash", "string"),
+    ("num_messages", "int32"),
+    ("num_turns", "int32"),
+    ("termination_reason", "string"),
+    ("extra", "string"),
+]
+
+TURN_COLUMNS = ["dialogue_id", "turn_idx", "role", "text"]
+
+# Role values; stored dictionary-encoded
+ROLES = ["Doctor", "Patient"]
+
+TABLES = ("dialogues", "turns")
+
+
+def dialogue_id(dialogue: Dict) -> str:
+    """Stable id of a dialogue: hadm_id|patient_model|doctor_model"""
+    return "|".join(str(part) for part in dialogue_key(dialogue))
+
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def split_dialogue(dialogue: Dict, split: str):
+    """
+    Break one dialogue record into a metadata row and its turn rows
+
+    Returns:
+        (metadata row, list of turn rows)
+    """
+    key = dialogue_id(dialogue)
+    history = dialogue.get('dialog_history', [])
+    known = {name for name, _ in DIALOGUE_COLUMNS} | set(PARTITION_COLUMNS) | {'dialog_history'}
+    extra = {k: v for k, v in dialogue.items() if k not in known}
+
+    row = {name: dialogue.get(name) for name, _ in DIALOGUE_COLUMNS}
+    row.update({
+        "dialogue_id": key,
+        "hadm_id": str(dialogue.get('hadm_id')),
+        "age": _int_or_none(dialogue.get('age')),
+        "seed": _int_or_none(dialogue.get('seed')),
+        "num_messages": len(history),
+        "num_turns": _int_or_none(dialogue.get('num_turns')),
+        "extra": json.dumps(extra, ensure_ascii=False) if extra else None,
+        "split": split,
+        "patient_engine_name": dialogue.get('patient_engine_name'),
+    })
+
+    turns = [{
+        "dialogue_id": key,
+        "turn_idx": index,
+        "role": turn.get('role'),
+        "text": turn.get('content', ''),
+        "split": split,
+        "patient_engine_name": row["patient_engine_name"],
+    } for index, turn in enumerate(history)]
+    return row, turns
+
+
+def _schemas():
+    import pyarrow as pa
+
+    types = {"string": pa.string(), "int64": pa.int64(), "int32": pa.int32()}
+    partition_fields = [(name, pa.string()) for name in PARTITION_COLUMNS]
+    dialogues = pa.schema([(name, types[kind]) for name, kind in DIALOGUE_COLUMNS] + partition_fields)
+    turns = pa.schema([
+        ("dialogue_id", pa.string()),
+        ("turn_idx", pa.int32()),
+        ("role", pa.dictionary(pa.int8(), pa.string())),
+        ("text", pa.string()),
+    ] + partition_fields)
+    return dialogues, turns
+
+
+def write_dialogue_dataset(dialogues: Iterable[Dict], root: Path, split: str) -> int:
+    """
+    Write dialogues of one split into the columnar store
+
+    Partitions being written are replaced, so re-exporting a (split, model)
+    after a resumed run does not duplicate rows.
+
+    Args:
+        dialogues: Dialogue records as produced by DialogueGenerator
+        root: Store root directory
+        split: Split name the dialogues belong to
+
+    Returns:
+        Number of dialogues written
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dialogue_schema, turn_schema = _schemas()
+    rows, turns = [], []
+    for dialogue in dialogues:
+        row, turn_rows = split_dialogue(dialogue, split)
+        rows.append(row)
+        turns.extend(turn_rows)
+    if not rows:
+        return 0
+
+    # int8 codes into a fixed role vocabulary, so every partition shares the same dictionary
+    role_names = ROLES + sorted({t["role"] for t in turns if t["role"] not in ROLES})
+    role_codes = {name: code for code, name in enumerate(role_names)}
+    roles = pa.DictionaryArray.from_arrays(
+        pa.array([role_codes.get(t["role"]) for t in turns], type=pa.int8()),
+        pa.array(role_names, type=pa.string())
+    )
+    turn_table = pa.table({
+        name: roles if name == "role" else pa.array([t[name] for t in turns], type=turn_schema.field(name).type)
+        for name in turn_schema.names
+    }, schema=turn_schema)
+    dialogue_table = pa.Table.from_pylist(rows, schema=dialogue_schema)
+
+    root = Path(root)
+    for name, table in (("dialogues", dialogue_table), ("turns", turn_table)):
+        ds.write_dataset(
+            table,
+            root / name,
+            format="parquet",
+            partitioning=PARTITION_COLUMNS,
+            partitioning_flavor="hive",
+            existing_data_behavior="delete_matching",
+            basename_template="part-{i}.parquet"
+        )
+    return len(rows)
+
+
+def read_jsonl(path: Path) -> Iterable[Dict]:
+    """Dialogue records from an llm_dialogue.jsonl (a truncated last line is skipped)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def export_jsonl(jsonl_path: Path, root: Path, split: str) -> int:
+    """Copy one llm_dialogue.jsonl into the columnar store; returns dialogues written"""
+    return write_dialogue_dataset(read_jsonl(jsonl_path), root, split)
+
+
+def read_table(root: Path,
+               table: str,
+               columns: Optional[List[str]] = None,
+               splits: Optional[List[str]] = None,
+               models: Optional[List[str]] = None):
+    """
+    Load one table of the store as a pyarrow Table
+
+    Only the requested columns are read, and partitions outside `splits` /
+    `models` are skipped without opening their files.
+
+    Args:
+        root: Store root directory
+        table: 'dialogues' or 'turns'
+        columns: Columns to load (default: all, including the partition keys)
+        splits: Only these splits
+        models: Only these patient models
+    """
+    import pyarrow.dataset as ds
+
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table} (use one of {', '.join(TABLES)})")
+
+    dataset = ds.dataset(Path(root) / table, format="parquet", partitioning="hive")
+    condition = None
+    for field, values in (("split", splits), ("patient_engine_name", models)):
+        if values:
+            clause = ds.field(field).isin(list(values))
+            condition = clause if condition is None else condition & clause
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def load_dialogues(root: Path,
+                   columns: Optional[List[str]] = None,
+                   splits: Optional[List[str]] = None,
+                   models: Optional[List[str]] = None):
+    """Dialogue metadata as a pandas DataFrame (see `read_table`)"""
+    return read_table(root, "dialogues", columns, splits, models).to_pandas()
+
+
+def load_turns(root: Path,
+               columns: Optional[List[str]] = None,
+               splits: Optional[List[str]] = None,
+               models: Optional[List[str]] = None):
+    """Turns as a pandas DataFrame; `role` comes back as a categorical (see `read_table`)"""
+    return read_table(root, "turns", columns, splits, models).to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert llm_dialogue.jsonl files into the columnar dialogue store')
+    parser.add_argument('jsonl_files', nargs='+', help='llm_dialogue.jsonl files')
+    parser.add_argument('--split', required=True, help='Split the files belong to (persona, info, ...)')
+    parser.add_argument('--root', required=True, help='Store root directory')
+    args = parser.parse_args()
+
+    for path in args.jsonl_files:
+        count = export_jsonl(Path(path), Path(args.root), args.split)
+        print(f"{path}: {count} dialogues")
+
+
+if __name__ == "__main__":
+    main()
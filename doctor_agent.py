@@ -2,14 +2,24 @@
 Doctor Agent - Conducts medical interviews with patients
 """
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 from llm_client import LLMClient
+from metrics import UsageTotals
+from context_policy import ContextPolicy, summary_messages
+from termination import SIGNAL_INSTRUCTION, TerminationPolicy, strip_signal
 
 
 class DoctorAgent:
     """Simulates a doctor conducting a medical interview"""
 
-    def __init__(self, model_id: str, llm_client: LLMClient, patient_chief_complaint: str):
+    def __init__(self,
+                 model_id: str,
+                 llm_client: LLMClient,
+                 patient_chief_complaint: str,
+                 context_policy: Optional[ContextPolicy] = None,
+                 prompt_layout: str = 'legacy',
+                 seed: Optional[int] = None,
+                 termination: Optional[TerminationPolicy] = None):
         """
         Initialize doctor agent
 
@@ -17,11 +27,26 @@ class DoctorAgent:
             model_id: LLM model to use (e.g., 'gpt-4.1-api')
             llm_client: Initialized LLMClient instance
             patient_chief_complaint: Patient's chief complaint to guide interview
+            context_policy: History policy for each turn (defaults to full history)
+            prompt_layout: 'legacy', or 'cache_friendly' to keep the system prompt
+                prefix identical across patients and turns
+            seed: Per-dialogue seed passed to providers that support it (None = unseeded)
+            termination: When to end the interview (defaults to running all turns)
         """
         self.model_id = model_id
         self.client = llm_client
         self.chief_complaint = patient_chief_complaint
         self.conversation_history = []
+        self.usage = UsageTotals()
+        # Hedge record of the last reply's LLM call (None if it was not hedged)
+        self.last_hedge = None
+        self.context_policy = context_policy or ContextPolicy()
+        self.prompt_layout = prompt_layout
+        self.seed = seed
+        self.termination = termination or TerminationPolicy()
+        # Set when the doctor's last message carried the completion signal
+        self.interview_complete = False
+        self.termination_reason = None
 
         # Build system prompt
         self.system_prompt = self._build_system_prompt()
@@ -29,12 +54,12 @@ class DoctorAgent:
     def _build_system_prompt(self) -> str:
         """Build doctor system prompt"""
 
-        prompt = f"""You are an experienced emergency department physician conducting a patient interview. Your goal is to gather comprehensive medical information to make an accurate diagnosis.
+        intro = "You are an experienced emergency department physician conducting a patient interview. Your goal is to gather comprehensive medical information to make an accurate diagnosis."
 
-## CHIEF COMPLAINT
-The patient presents with: {self.chief_complaint}
+        complaint_block = f"""## CHIEF COMPLAINT
+The patient presents with: {self.chief_complaint}"""
 
-## YOUR RESPONSIBILITIES
+        instructions = """## YOUR RESPONSIBILITIES
 
 1. **Conduct a thorough history:**
    - History of Present Illness (HPI): Onset, location, duration, characteristics, aggravating/relieving factors, radiation, timing, severity
@@ -94,7 +119,14 @@ Start with:
 Respond ONLY with what the doctor would say. Keep responses concise and focused.
 """
 
-        return prompt
+        if self.termination.completion_signal:
+            instructions += f"\n{SIGNAL_INSTRUCTION}\n"
+
+        if self.prompt_layout == 'cache_friendly':
+            # Chief complaint last so the instruction prefix is shared by every patient
+            return f"{intro}\n\n{instructions}\n{complaint_block}\n"
+
+        return f"{intro}\n\n{complaint_block}\n\n{instructions}"
 
     def start_interview(self) -> str:
         """
@@ -108,10 +140,15 @@ Respond ONLY with what the doctor would say. Keep responses concise and focused.
             {"role": "user", "content": f"Begin the interview. The patient has come to the ED with: {self.chief_complaint}"}
         ]
 
-        response = self.client.generate(
+        completion = self.client.complete(
             model_id=self.model_id,
-            messages=messages
+            messages=messages,
+            role='doctor',
+            seed=self.seed
         )
+        self.usage.add(completion)
+        self.last_hedge = completion.hedge
+        response = self._read_signal(completion.text)
 
         # Add to history
         self.conversation_history.append({
@@ -141,20 +178,36 @@ Respond ONLY with what the doctor would say. Keep responses concise and focused.
 
         # Build context message
         if turn_number >= max_turns - 2:
-            context = f"\n\n[You are near the end of the interview (turn {turn_number}/{max_turns}). Start summarizing and explaining next steps.]"
+            hint = f"[You are near the end of the interview (turn {turn_number}/{max_turns}). Start summarizing and explaining next steps.]"
         else:
-            context = ""
+            hint = ""
 
         # Build messages for LLM
-        messages = [
-            {"role": "system", "content": self.system_prompt + context},
-            *self.conversation_history
-        ]
+        if self.prompt_layout == 'cache_friendly':
+            # Trailing hint leaves the system prompt (and so the cached prefix) unchanged
+            messages = self.context_policy.build_messages(
+                self.system_prompt,
+                self.conversation_history,
+                summarizer=self._summarize_history
+            )
+            if hint:
+                messages.append({"role": "system", "content": hint})
+        else:
+            messages = self.context_policy.build_messages(
+                self.system_prompt + (f"\n\n{hint}" if hint else ""),
+                self.conversation_history,
+                summarizer=self._summarize_history
+            )
 
-        response = self.client.generate(
+        completion = self.client.complete(
             model_id=self.model_id,
-            messages=messages
+            messages=messages,
+            role='doctor',
+            seed=self.seed
         )
+        self.usage.add(completion)
+        self.last_hedge = completion.hedge
+        response = self._read_signal(completion.text)
 
         # Add doctor response to history
         self.conversation_history.append({
@@ -164,18 +217,34 @@ Respond ONLY with what the doctor would say. Keep responses concise and focused.
 
         return response
 
-    def should_end_interview(self, turn_number: int, max_turns: int) -> bool:
+    def _read_signal(self, text: str) -> str:
+        """Strip the completion signal from a reply, remembering whether it was given"""
+        if not self.termination.completion_signal:
+            return text
+        text, self.interview_complete = strip_signal(text)
+        return text
+
+    def should_end_interview(self,
+                             turn_number: int,
+                             max_turns: int,
+                             dialog_history: Optional[List[Dict[str, str]]] = None) -> bool:
         """
         Determine if interview should end
 
+        The reason is kept in `termination_reason` (see TerminationPolicy.check).
+
         Args:
             turn_number: Current turn number
             max_turns: Maximum allowed turns
+            dialog_history: Dialogue so far, ending with the patient's reply
 
         Returns:
             True if interview should end
         """
-        return turn_number >= max_turns
+        self.termination_reason = self.termination.check(
+            dialog_history or [], turn_number, max_turns, self.interview_complete
+        )
+        return self.termination_reason is not None
 
     def summarize_findings(self) -> str:
         """
@@ -190,20 +259,38 @@ Respond ONLY with what the doctor would say. Keep responses concise and focused.
             {"role": "user", "content": "Provide a brief clinical summary of this case."}
         ]
 
-        summary = self.client.generate(
+        completion = self.client.complete(
             model_id=self.model_id,
             messages=messages,
-            max_tokens=200
+            max_tokens=200,
+            role='doctor',
+            seed=self.seed
         )
+        self.usage.add(completion)
+        summary = completion.text
 
         return summary
 
+    def _summarize_history(self, previous_summary: str, evicted: List[Dict[str, str]]) -> str:
+        """Fold turns leaving the context window into the rolling summary"""
+        completion = self.client.complete(
+            model_id=self.model_id,
+            messages=summary_messages(previous_summary, evicted, speaker='Doctor'),
+            max_tokens=self.context_policy.summary_max_tokens,
+            role='doctor',
+            seed=self.seed
+        )
+        self.usage.add(completion)
+        return completion.text
+
     def reset_conversation(self):
         """Clear conversation history"""
         self.conversation_history = []
+        self.context_policy.reset()
 
     def get_metadata(self) -> Dict:
         """Return doctor metadata for logging"""
         return {
-            "doctor_engine_name": self.model_id
+            "doctor_engine_name": self.model_id,
+            "doctor_usage": self.usage.to_dict()
         }
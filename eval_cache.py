@@ -0,0 +1,162 @@
+"""
+Incremental evaluation cache - per-dialogue metric rows keyed by a content fingerprint
+A dialogue's fingerprint covers its record, its entries in the judge label files
+and its ground-truth profile, so only dialogues whose inputs changed are
+re-scored. Each backbone directory also remembers the file signature its
+fingerprints were computed from, so unchanged backbones are not even parsed.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# Bump when the metric code changes so every cached row is recomputed
+EVAL_VERSION = 2
+
+
+def fingerprint(*parts) -> str:
+    """Stable SHA-256 of JSON-serializable inputs (plus EVAL_VERSION)"""
+    canonical = json.dumps([EVAL_VERSION, *parts], sort_keys=True, ensure_ascii=False,
+                           separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def file_signature(paths: List[Path], *extra) -> str:
+    """Cheap signature of input files from their names, sizes and mtimes"""
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats.append([str(path), stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            stats.append([str(path), None, None])
+    return fingerprint(stats, *extra)
+
+
+class EvalCache:
+    """
+    SQLite store of per-dialogue evaluation results
+
+    `results` maps a dialogue fingerprint to its metric rows; `sources` maps a
+    backbone directory to the file signature and fingerprints of its last
+    evaluation. Worker processes open the cache read-only; only the parent
+    process writes, after the workers finish.
+    """
+
+    def __init__(self, path: str, readonly: bool = False):
+        """
+        Args:
+            path: SQLite database file
+            readonly: Open an existing cache without write access (worker processes)
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{Path(path).resolve()}?mode=ro", uri=True,
+                                         check_same_thread=False)
+            return
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " fingerprint TEXT PRIMARY KEY,"
+            " result TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " source TEXT PRIMARY KEY,"
+            " signature TEXT NOT NULL,"
+            " fingerprints TEXT NOT NULL)"
+        )
+
+    def get_many(self, fingerprints: List[str]) -> Dict[str, Dict]:
+        """Cached results for the fingerprints that have one"""
+        found = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(fingerprints), 500):
+                chunk = fingerprints[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT fingerprint, result FROM results WHERE fingerprint IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                found.update((key, json.loads(result)) for key, result in rows)
+        self.hits += len(found)
+        self.misses += len(set(fingerprints)) - len(found)
+        return found
+
+    def put_many(self, results: Dict[str, Dict]):
+        """Store results by fingerprint"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (fingerprint, result, created_at) VALUES (?, ?, ?)",
+                [(key, json.dumps(result, ensure_ascii=False), now) for key, result in results.items()]
+            )
+            self._conn.execute("COMMIT")
+
+    def get_source(self, source: str, signature: str) -> Optional[List[str]]:
+        """Fingerprints of a backbone's last evaluation, if its files still match `signature`"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT signature, fingerprints FROM sources WHERE source = ?", (source,)
+            ).fetchone()
+        if row is None or row[0] != signature:
+            return None
+        return json.loads(row[1])
+
+    def put_source(self, source: str, signature: str, fingerprints: List[str]):
+        """Remember the fingerprints a backbone's files produced"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (source, signature, fingerprints) VALUES (?, ?, ?)",
+                (source, signature, json.dumps(fingerprints))
+            )
+
+    def prune(self) -> int:
+        """Delete results no backbone refers to any more; returns rows removed"""
+        with self._lock:
+            live = set()
+            for (fingerprints,) in self._conn.execute("SELECT fingerprints FROM sources"):
+                live.update(json.loads(fingerprints))
+            stale = [key for (key,) in self._conn.execute("SELECT fingerprint FROM results")
+                     if key not in live]
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM results WHERE fingerprint = ?", [(key,) for key in stale])
+            self._conn.execute("COMMIT")
+        return len(stale)
+
+    def clear(self):
+        """Remove every cached result"""
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.execute("DELETE FROM sources")
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            size = len(self)
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
+
+    def close(self):
+        """Close the underlying database"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,470 @@
+"""
+Profile-consistency evaluation - dialogue-level scores from analysis.ipynb as a CLI
+Joins simulated dialogues, judge-extracted profiles and judge scores with the
+ground-truth patient profiles for every patient backbone, plus sentence-level
+statistics where a backbone has a sentence label file. Per-dialogue results
+are cached by content fingerprint (see eval_cache.py), so re-runs only
+re-score dialogues whose inputs changed.
+"""
+
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from eval_cache import EvalCache, fingerprint, file_signature
+from profile_store import ProfileStore
+
+
+DEFAULT_JUDGE = "gemini-2.5-flash-preview-04-17"
+
+META_KEYS = ["doctor_engine_name", "patient_engine_name", "cefr_type",
+             "personality_type", "recall_level_type", "dazed_level_type"]
+
+EVAL_KEY_CAT = {
+    "Social_History": ['tobacco', 'alcohol', 'illicit_drug', 'exercise', 'marital_status', 'children',
+                       'living_situation', 'occupation'],
+    "Previous_Medical_History": ['allergies', 'family_medical_history', 'medical_device', 'medical_history'],
+    "Current_Visit_Information": ['chiefcomplaint', 'present_illness_positive', 'present_illness_negative',
+                                  'pain', 'medication'],
+}
+EVAL_KEY_TO_CAT = {key: category for category, keys in EVAL_KEY_CAT.items() for key in keys}
+CATEGORY_ORDER = list(EVAL_KEY_CAT)
+
+ITEM_COLUMNS = META_KEYS + ["hadm_id", "key", "pred", "llm_raw"]
+
+# Per-dialogue sentence counts (the notebook's analyze_sentence_data)
+SENTENCE_COUNTS = ["total_utter_num", "total_sent_num", "num_infomatic_sent", "num_entail", "num_support",
+                   "num_support_only", "num_unsupport", "num_unsupport_only", "both", "contradict_cnt"]
+SENTENCE_FRACTIONS = ["info_frac", "support_frac", "unsupport_frac", "entail_frac", "contradict_frac",
+                      "plausibility_score"]
+
+
+def normalize_hadm_id(hadm_id) -> str:
+    """'28162080', 28162080 and 28162080.0 all map to '28162080'"""
+    return str(int(float(hadm_id)))
+
+
+def flatten_profile(d: Dict, parent_key: str = "") -> Dict:
+    """Flatten a judge-extracted profile; only present_illness children keep their prefix"""
+    items = {}
+    for k, v in d.items():
+        new_key = f"{parent_key}_{k}" if parent_key == "present_illness" else k
+        if isinstance(v, dict):
+            items.update(flatten_profile(v, new_key))
+        else:
+            items[new_key] = v
+    return items
+
+
+def backbone_files(backbone_dir: Path, judge: str) -> Dict[str, Path]:
+    """Input files of one backbone directory (the sentence label file is optional)"""
+    return {
+        "dialogues": backbone_dir / "llm_dialogue.jsonl",
+        "profiles": backbone_dir / f"{judge}_profile_consistency_Patient.json",
+        "scores": backbone_dir / f"{judge}_profile_consistency_LLMscore_Patient.json",
+        "sentences": backbone_dir / f"{judge}_sentence_label.json",
+    }
+
+
+def _read_dialogues(path: Path) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _dialogue_id(dialogue: Dict) -> str:
+    # Older runs stored the id as `scenario`
+    return str(dialogue.get('hadm_id', dialogue.get('scenario')))
+
+
+def dialogue_rows(dialogue: Dict, predicted: Dict, score_texts: Optional[Dict]) -> List[List]:
+    """Long-format prediction rows (ITEM_COLUMNS) of one dialogue"""
+    hadm_id = _dialogue_id(dialogue)
+    meta = [dialogue.get(key) for key in META_KEYS]
+    score_texts = score_texts or {}
+    return [meta + [normalize_hadm_id(hadm_id), key, value, score_texts.get(key)]
+            for key, value in flatten_profile(predicted).items()]
+
+
+def _melt_profiles(profiles: List[Dict]) -> pd.DataFrame:
+    profiles = pd.DataFrame(profiles)
+    profiles['hadm_id'] = profiles['hadm_id'].map(normalize_hadm_id)
+    return profiles.melt(id_vars='hadm_id', var_name='key', value_name='gt')
+
+
+def ground_truth(profile_path: str, cache_dir: Optional[str] = None) -> pd.DataFrame:
+    """Ground-truth profiles in long format: (hadm_id, key, gt)"""
+    store = ProfileStore(profile_path, cache_dir)
+    profiles = list(store)
+    store.close()
+    return _melt_profiles(profiles)
+
+
+def sentence_stats(dialog_history: List[Dict], labels: Dict) -> Optional[Dict]:
+    """
+    Sentence-level counts for one dialogue from its sentence label entry
+
+    Args:
+        dialog_history: The dialogue's messages
+        labels: utterance -> sentence -> step results (one hadm_id of a sentence label file)
+
+    Returns:
+        Counts, or None if the labelled utterances are not the dialogue's
+        Patient utterances (a label file made for another generation of
+        llm_dialogue.jsonl)
+    """
+    patient_utterances = {message["content"] for message in dialog_history if message.get("role") == "Patient"}
+    if set(labels) != patient_utterances:
+        return None
+
+    stats = {name: 0 for name in SENTENCE_COUNTS}
+    stats["total_utter_num"] = len(labels)
+    plausibility = []
+    for sentences in labels.values():
+        for result in sentences.values():
+            stats["total_sent_num"] += 1
+            if result["step0"]["prediction"] != "information":
+                continue
+            stats["num_infomatic_sent"] += 1
+
+            related = [s for s in result.get("step1-1", []) if int(s["prediction"]) == 1]
+            unsupported = int(result.get("step1-2", {}).get("prediction", 0)) == 1
+            entailments = [s for s in result.get("step2-2", []) if s["entailment_prediction"] != 0]
+
+            if related and entailments:
+                if any(s["entailment_prediction"] == -1 for s in entailments):
+                    stats["contradict_cnt"] += 1
+                else:
+                    stats["num_entail"] += 1
+
+            # No entailed profile item means the sentence is unsupported, whatever step1-2 said
+            if unsupported or not entailments:
+                stats["num_unsupport"] += 1
+                if "step2-1" in result:
+                    plausibility.append(result["step2-1"]["likelihood_rating"])
+                if entailments:
+                    stats["num_support"] += 1
+                    stats["both"] += 1
+                else:
+                    stats["num_unsupport_only"] += 1
+            else:
+                stats["num_support"] += 1
+                stats["num_support_only"] += 1
+
+    stats["plausibility_score"] = sum(plausibility) / len(plausibility) if plausibility else None
+    return stats
+
+
+def score_dialogues(inputs: Dict[str, Dict]) -> Dict[str, Dict]:
+    """
+    Evaluate dialogues from scratch
+
+    Args:
+        inputs: fingerprint -> {"dialogue", "predicted", "scores", "labels", "profile"}
+
+    Returns:
+        fingerprint -> {"items": item rows (see `score_items`), "sentence": sentence stats or None,
+        "label_mismatch": True if the dialogue's sentence labels belong to other utterances}
+    """
+    if not inputs:
+        return {}
+
+    rows = []
+    for key, entry in inputs.items():
+        rows.extend([key] + row for row in dialogue_rows(entry["dialogue"], entry["predicted"], entry["scores"]))
+    predictions = pd.DataFrame(rows, columns=["fingerprint"] + ITEM_COLUMNS)
+    profiles = [entry["profile"] for entry in inputs.values() if entry["profile"] is not None]
+    truth = _melt_profiles(profiles) if profiles else pd.DataFrame(columns=['hadm_id', 'key', 'gt'])
+    items = score_items(predictions, truth)
+
+    # JSON round trip turns numpy scalars into plain values for the cache
+    by_dialogue = {key: json.loads(group.drop(columns="fingerprint").to_json(orient='records'))
+                   for key, group in items.groupby("fingerprint", sort=False)}
+
+    results = {}
+    for key, entry in inputs.items():
+        sentence = None
+        mismatch = False
+        if entry["labels"] is not None:
+            dialogue = entry["dialogue"]
+            stats = sentence_stats(dialogue.get("dialog_history", []), entry["labels"])
+            if stats is None:
+                mismatch = True
+            else:
+                sentence = {
+                    "hadm_id": normalize_hadm_id(_dialogue_id(dialogue)),
+                    "doctor_engine_name": dialogue.get("doctor_engine_name"),
+                    "patient_engine_name": dialogue.get("patient_engine_name"),
+                    **stats
+                }
+        results[key] = {"items": by_dialogue.get(key, []), "sentence": sentence, "label_mismatch": mismatch}
+    return results
+
+
+def score_backbone(backbone_dir: str,
+                   judge: str = DEFAULT_JUDGE,
+                   profile_path: str = 'patient_profile.json',
+                   profile_cache_dir: Optional[str] = None,
+                   cache_path: Optional[str] = None) -> Dict:
+    """
+    Per-dialogue results for one backbone, re-scoring only dialogues missing from the cache
+
+    A dialogue's fingerprint covers its record, its entries in the judge
+    files, its ground-truth profile and the judge name. If none of the
+    backbone's files changed since the last run (same sizes and mtimes and
+    the same profile file), the cached fingerprints are used without
+    parsing anything.
+
+    Returns:
+        {"items", "sentences" (DataFrames), "new" (fingerprint -> result, for
+        the caller to store), "source", "signature", "fingerprints", "reused"}
+    """
+    backbone_dir = Path(backbone_dir)
+    files = backbone_files(backbone_dir, judge)
+    store = ProfileStore(profile_path, profile_cache_dir)
+    cache = EvalCache(cache_path, readonly=True) if cache_path else None
+    source = str(backbone_dir.resolve())
+    signature = file_signature(list(files.values()), judge, store.source_sha256)
+
+    results = {}
+    fingerprints = cache.get_source(source, signature) if cache is not None else None
+    if fingerprints is not None:
+        results = cache.get_many(fingerprints)
+        if len(results) < len(set(fingerprints)):
+            fingerprints = None
+
+    new = {}
+    if fingerprints is None:
+        with open(files["profiles"], 'r') as f:
+            predicted = json.load(f)
+        with open(files["scores"], 'r') as f:
+            scores = json.load(f)
+        labels = None
+        if files["sentences"].exists():
+            with open(files["sentences"], 'r') as f:
+                labels = json.load(f)
+
+        fingerprints, inputs = [], {}
+        for dialogue in _read_dialogues(files["dialogues"]):
+            hadm_id = _dialogue_id(dialogue)
+            entry = {
+                "dialogue": dialogue,
+                "predicted": predicted[hadm_id],
+                "scores": scores.get(hadm_id),
+                "labels": labels.get(hadm_id) if labels is not None else None,
+                "profile": store.get(normalize_hadm_id(hadm_id))
+            }
+            key = fingerprint(judge, entry)
+            fingerprints.append(key)
+            inputs[key] = entry
+
+        results = cache.get_many(fingerprints) if cache is not None else {}
+        new = score_dialogues({key: entry for key, entry in inputs.items() if key not in results})
+        results.update(new)
+
+    store.close()
+    if cache is not None:
+        cache.close()
+
+    mismatched = sum(1 for key in fingerprints if results[key].get("label_mismatch"))
+    if mismatched:
+        print(f"Warning: skipped sentence labels of {mismatched} dialogues in {backbone_dir}: "
+              f"labelled utterances differ from the dialogue (labels from another run?)")
+
+    items = pd.DataFrame([row for key in fingerprints for row in results[key]["items"]],
+                         columns=ITEM_COLUMNS + ["gt", "valid", "llm"])
+    sentences = pd.DataFrame([results[key]["sentence"] for key in fingerprints
+                              if results[key]["sentence"] is not None])
+    return {
+        "items": items,
+        "sentences": sentences,
+        "new": new,
+        "source": source,
+        "signature": signature,
+        "fingerprints": fingerprints,
+        "reused": len(fingerprints) - len(new)
+    }
+
+
+def score_items(predictions: pd.DataFrame, truth: pd.DataFrame) -> pd.DataFrame:
+    """Join predictions with ground truth and add validity and judge score columns"""
+    df = predictions.merge(truth, on=['hadm_id', 'key'], how='left')
+
+    # An item counts only if both sides recorded something; a predicted pain
+    # level flagged "(predicted)" was guessed rather than stated
+    not_recorded = (df['gt'] == "Not recorded") | (df['pred'] == "Not recorded")
+    guessed_pain = (df['key'] == 'pain') & df['pred'].astype(str).str.contains("(predicted)", regex=False)
+    df['valid'] = ~(not_recorded | guessed_pain)
+
+    # Judge output ends with "[RESULT]: <score>"
+    df['llm'] = pd.to_numeric(df['llm_raw'].str[-1], errors='coerce')
+    return df
+
+
+def aggregate(df: pd.DataFrame, group_keys: List[str]) -> pd.DataFrame:
+    """Per-key valid fraction and mean judge score over valid items"""
+    df = df[df['key'].isin(EVAL_KEY_TO_CAT)].assign(llm_valid=lambda d: d['llm'].where(d['valid']))
+    per_key = df.groupby(group_keys + ['key']).agg(
+        total_count=('valid', 'size'),
+        valid_count=('valid', 'sum'),
+        llm_score_mean=('llm_valid', 'mean')
+    ).reset_index()
+    per_key['valid_percentage'] = per_key['valid_count'] / per_key['total_count']
+    per_key['category'] = per_key['key'].map(EVAL_KEY_TO_CAT)
+    return per_key
+
+
+def sentence_summary(sentences: pd.DataFrame, group_keys: List[str]) -> pd.DataFrame:
+    """Per-group means of the sentence fractions (the notebook's sentence-level table)"""
+    df = sentences.assign(
+        info_frac=sentences['num_infomatic_sent'] / sentences['total_sent_num'],
+        support_frac=sentences['num_support'] / sentences['num_infomatic_sent'],
+        unsupport_frac=sentences['num_unsupport'] / sentences['num_infomatic_sent'],
+        entail_frac=sentences['num_entail'] / sentences['num_support'],
+        contradict_frac=sentences['contradict_cnt'] / sentences['num_support'],
+        plausibility_score=pd.to_numeric(sentences['plausibility_score'])
+    )
+    return df.groupby(group_keys)[SENTENCE_FRACTIONS].mean().round(3)
+
+
+def summary_table(per_key: pd.DataFrame, group_keys: List[str]) -> pd.DataFrame:
+    """Category means of the per-key metrics, one column block per metric"""
+    by_category = per_key.groupby(group_keys + ['category'])[['valid_percentage', 'llm_score_mean']].mean()
+    table = by_category.unstack('category')
+    table = table.reindex(columns=pd.MultiIndex.from_product(
+        [['valid_percentage', 'llm_score_mean'], CATEGORY_ORDER]))
+    return table.round(2)
+
+
+def evaluate(root: str,
+             profile_path: str,
+             judge: str = DEFAULT_JUDGE,
+             workers: Optional[int] = None,
+             cache_dir: Optional[str] = None,
+             eval_cache: Optional[str] = None):
+    """
+    Score every backbone directory under `root`
+
+    Args:
+        root: Directory with one sub-directory per patient backbone
+        profile_path: Ground-truth patient profiles
+        judge: Judge model prefix of the label files
+        workers: Processes (default: CPU count)
+        cache_dir: ProfileStore cache directory
+        eval_cache: Evaluation cache database; None re-scores everything
+
+    Returns:
+        (items, per_key, summary, sentences) DataFrames; `sentences` has one
+        row per dialogue of backbones with a sentence label file
+    """
+    backbone_dirs = sorted(str(p) for p in Path(root).iterdir()
+                           if (p / "llm_dialogue.jsonl").exists())
+    if not backbone_dirs:
+        raise FileNotFoundError(f"No llm_dialogue.jsonl found under {root}")
+
+    # Build the profile index and cache tables once, before the workers open them
+    ProfileStore(profile_path, cache_dir).close()
+    cache = EvalCache(eval_cache) if eval_cache else None
+
+    # JSON parsing dominates, so each backbone loads in its own process
+    count = len(backbone_dirs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        outputs = list(pool.map(score_backbone, backbone_dirs, [judge] * count, [profile_path] * count,
+                                [cache_dir] * count, [eval_cache] * count))
+
+    if cache is not None:
+        for output in outputs:
+            if output["new"]:
+                cache.put_many(output["new"])
+            cache.put_source(output["source"], output["signature"], output["fingerprints"])
+        cache.close()
+        print(f"Evaluation cache: {sum(output['reused'] for output in outputs)} dialogues reused, "
+              f"{sum(len(output['new']) for output in outputs)} scored")
+
+    items = pd.concat([output["items"] for output in outputs], ignore_index=True)
+    # Cached rows come back from JSON, so restore the column types
+    items['valid'] = items['valid'].astype(bool)
+    items['llm'] = pd.to_numeric(items['llm'])
+    sentences = pd.concat([output["sentences"] for output in outputs], ignore_index=True)
+
+    group_keys = ['patient_engine_name']
+    per_key = aggregate(items, group_keys)
+    return items, per_key, summary_table(per_key, group_keys), sentences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile-consistency evaluation of simulated patients')
+
+    parser.add_argument('--root', default=os.path.join('info_test', 'llm_simulation'),
+                        help='Directory with one sub-directory per patient backbone')
+    parser.add_argument('--profiles', default='patient_profile.json', help='Ground-truth patient profiles')
+    parser.add_argument('--profile-cache-dir', default='.profile_cache', help='ProfileStore cache directory')
+    parser.add_argument('--judge', default=DEFAULT_JUDGE, help='Judge model prefix of the score files')
+    parser.add_argument('--eval-cache', default=os.path.join('.eval_cache', 'evaluate.sqlite'),
+                        help='Per-dialogue result cache; only changed dialogues are re-scored')
+    parser.add_argument('--no-eval-cache', action='store_true', help='Re-score every dialogue')
+    parser.add_argument('--prune-eval-cache', action='store_true',
+                        help='Drop cached results no longer referenced by any evaluated backbone')
+    parser.add_argument('--workers', type=int, default=None, help='Processes (default: CPU count)')
+    parser.add_argument('--order', help='Comma-separated patient_engine_name display order')
+    parser.add_argument('--per-key-out', help='Write per-key metrics to this CSV')
+    parser.add_argument('--out', help='Write the summary table to this CSV (or .json)')
+    parser.add_argument('--sentence-out', help='Write per-dialogue sentence statistics to this CSV')
+
+    args = parser.parse_args()
+
+    eval_cache = None if args.no_eval_cache else args.eval_cache
+    items, per_key, summary, sentences = evaluate(args.root, args.profiles, args.judge, args.workers,
+                                                  args.profile_cache_dir, eval_cache)
+
+    if eval_cache and args.prune_eval_cache:
+        cache = EvalCache(eval_cache)
+        print(f"Pruned {cache.prune()} cached results")
+        cache.close()
+
+    if args.order:
+        order = [name.strip() for name in args.order.split(',')]
+        summary = summary.reindex([name for name in order if name in summary.index])
+
+    print(f"Scored {len(items)} items from {items['patient_engine_name'].nunique()} backbones "
+          f"({int(items['valid'].sum())} valid)")
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(summary)
+
+        if not sentences.empty:
+            sentence_table = sentence_summary(sentences, ['patient_engine_name'])
+            if args.order:
+                sentence_table = sentence_table.reindex([name for name in order if name in sentence_table.index])
+            print(f"\nSentence-level statistics ({len(sentences)} dialogues)")
+            print(sentence_table)
+
+    if args.sentence_out:
+        if sentences.empty:
+            print(f"No {args.judge}_sentence_label.json files found (or none matched their dialogues); "
+                  f"not writing {args.sentence_out}")
+        else:
+            sentences.to_csv(args.sentence_out, index=False)
+            print(f"Saved sentence statistics to {args.sentence_out}")
+
+    if args.per_key_out:
+        per_key.to_csv(args.per_key_out, index=False)
+        print(f"Saved per-key metrics to {args.per_key_out}")
+
+    if args.out:
+        if args.out.endswith('.json'):
+            flat = summary.copy()
+            flat.columns = [f"{metric}/{category}" for metric, category in flat.columns]
+            flat = flat.astype(object).where(flat.notna(), None)
+            with open(args.out, 'w') as f:
+                json.dump(flat.to_dict(orient='index'), f, indent=2)
+        else:
+            summary.to_csv(args.out)
+        print(f"Saved summary to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
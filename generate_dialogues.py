@@ -2,38 +2,112 @@
 Main script to generate patient-doctor dialogues
 """
 
-import json
 import jsonlines
 import os
 import yaml
 from typing import List, Dict, Optional
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
 import argparse
+import threading
 from tqdm import tqdm
 
-from llm_client import LLMClient
+from llm_client import LLMClient, StopCondition
+from context_policy import ContextPolicy
+from termination import TerminationPolicy
+from checkpoint import DialogueWriter, drop_dialogues, load_completed_keys
+from manifest import RunManifest, dialogue_seed, stable_hash
+from profile_store import ProfileStore
+from dialogue_store import export_jsonl, write_dialogue_dataset
+from sharding import (DEFAULT_LEASE_SECONDS, SHARD_MANIFEST, SHARD_OUTPUT, WorkQueue,
+                      merge_shards, parse_shard, shard_of, worker_tag)
 from patient_agent import PatientAgent
+from persona_templates import get_templates
 from doctor_agent import DoctorAgent
 
 
+class _OrderedSink:
+    """Writes one output file's dialogues in job order as they complete out of order"""
+
+    def __init__(self,
+                 writer: DialogueWriter,
+                 manifest: RunManifest,
+                 output_file: Path,
+                 split: str,
+                 queue: Optional[WorkQueue] = None):
+        self.writer = writer
+        self.manifest = manifest
+        self.output_file = output_file
+        self.split = split
+        self.queue = queue
+        self._pending = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def put(self, index: int, dialogue: Optional[Dict]):
+        """Record the result for job `index` (None if it failed) and flush what is in order"""
+        with self._lock:
+            self._pending[index] = dialogue
+            while self._next in self._pending:
+                ready = self._pending.pop(self._next)
+                self._next += 1
+                if ready is not None:
+                    self.writer.write(ready)
+                    self.manifest.add(ready['hadm_id'], ready['seed'], ready['prompt_hash'])
+                    if self.queue is not None:
+                        self.queue.complete(ready['hadm_id'])
+
+    def close(self):
+        with self._lock:
+            self.writer.close()
+            self.manifest.save()
+        if self.queue is not None:
+            self.queue.close()
+
+
 class DialogueGenerator:
     """Orchestrates dialogue generation between doctor and patient"""
 
-    def __init__(self, config_path: str = "config.yaml"):
-        """Initialize generator with configuration"""
+    def __init__(self, config_path: str = "config.yaml", trace: Optional[Dict] = None):
+        """
+        Initialize generator with configuration
+
+        Args:
+            config_path: Config file path
+            trace: Overrides the `trace:` config section (record or replay LLM traffic)
+        """
         with open(config_path, 'r') as f:
             self.config = yaml.safe_load(f)
 
-        self.llm_client = LLMClient(config_path)
+        self.llm_client = LLMClient(config_path, trace=trace)
         self.max_turns = self.config['simulation']['max_turns']
+        self.concurrency = self.config['simulation'].get('concurrency', 1)
+        self.fsync_every = self.config['simulation'].get('fsync_every', 10)
+        self.prompt_layout = self.config['simulation'].get('prompt_layout', 'legacy')
+        # Run seed; None keeps the original unseeded behaviour
+        self.seed = self.config['simulation'].get('seed')
+        # When interviews end; the default runs every dialogue to max_turns
+        self.termination = TerminationPolicy.from_config(self.config.get('termination'))
+        # Optional streaming stop rule for patient replies (None = off)
+        self.patient_stop = StopCondition.from_config(self.config.get('patient_stop'))
+        # Persona instruction text, compiled once and shared by every patient agent
+        self.persona_templates = get_templates(self.config.get('persona', {}).get('instructions'))
         self.output_dir = Path(self.config['simulation']['output_dir'])
-
-        # Load patient profiles
-        profile_path = self.config['patient_profile_path']
-        with open(profile_path, 'r') as f:
-            self.patient_profiles = json.load(f)
-
-        print(f"Loaded {len(self.patient_profiles)} patient profiles")
+        # Optional (index, count) shard of each split by hadm_id hash (set by --shard)
+        self.shard = None
+        # Optional shared directory of work-queue lock files (set by --queue-dir)
+        self.queue_dir = None
+        self.queue_lease = self.config['simulation'].get('queue_lease_seconds', DEFAULT_LEASE_SECONDS)
+        # 'jsonl' (default) or 'parquet' to also export the columnar dialogue store
+        output_config = self.config.get('output', {})
+        self.dialogue_format = output_config.get('dialogue_format', 'jsonl')
+        self.columnar_dir = Path(output_config.get('columnar_dir') or self.output_dir / "columnar")
+
+        # Indexed patient profiles; records are decoded on demand
+        self.profiles = ProfileStore(self.config['patient_profile_path'],
+                                     cache_dir=self.config.get('profile_cache_dir'))
+
+        print(f"Loaded {len(self.profiles)} patient profiles")
         print(f"Available models: {self.llm_client.get_available_models()}")
 
     def generate_single_dialogue(self,
@@ -51,64 +125,112 @@ class DialogueGenerator:
         Returns:
             Dialogue data dict
         """
-        # Initialize agents
-        patient = PatientAgent(
-            profile=profile,
-            model_id=patient_model,
-            llm_client=self.llm_client
-        )
-
-        doctor = DoctorAgent(
-            model_id=doctor_model,
-            llm_client=self.llm_client,
-            patient_chief_complaint=profile.get('chiefcomplaint', 'Not specified')
-        )
+        patient, doctor = self._build_agents(profile, doctor_model, patient_model)
 
         # Start dialogue
         dialog_history = []
 
         # Doctor starts
         doctor_message = doctor.start_interview()
-        dialog_history.append({
-            "role": "Doctor",
-            "content": doctor_message
-        })
+        dialog_history.append(self._turn("Doctor", doctor_message, doctor.last_hedge))
 
         # Conversation loop
+        num_turns = 0
         for turn in range(self.max_turns):
+            num_turns = turn + 1
             # Patient responds
             patient_message = patient.respond(doctor_message)
-            dialog_history.append({
-                "role": "Patient",
-                "content": patient_message
-            })
+            dialog_history.append(self._turn("Patient", patient_message, patient.last_hedge))
 
             # Check if should end
-            if doctor.should_end_interview(turn + 1, self.max_turns):
+            if doctor.should_end_interview(num_turns, self.max_turns, dialog_history):
                 break
 
             # Doctor responds
             doctor_message = doctor.respond(patient_message, turn + 1, self.max_turns)
-            dialog_history.append({
-                "role": "Doctor",
-                "content": doctor_message
-            })
+            dialog_history.append(self._turn("Doctor", doctor_message, doctor.last_hedge))
 
         # Build output
         dialogue_data = {
             **patient.get_metadata(),
             **doctor.get_metadata(),
+            "context_policy": patient.context_policy.describe(),
+            "termination_policy": doctor.termination.describe(),
+            "termination_reason": doctor.termination_reason,
+            "num_turns": num_turns,
+            "prompt_layout": self.prompt_layout,
+            "seed": patient.seed,
+            "prompt_hash": self._prompt_hash(patient, doctor),
             "dialog_history": dialog_history,
             "diagnosis": profile.get('diagnosis')
         }
 
         return dialogue_data
 
+    @staticmethod
+    def _turn(role: str, content: str, hedge: Optional[Dict] = None) -> Dict:
+        """One dialog_history entry; hedged calls keep their hedge record as turn metadata"""
+        turn = {"role": role, "content": content}
+        if hedge is not None:
+            turn["hedge"] = hedge
+        return turn
+
+    def _build_agents(self, profile: Dict, doctor_model: str, patient_model: str):
+        """Create the patient and doctor agents for one dialogue"""
+        # Each agent keeps its own context window state
+        context_config = self.config.get('context')
+
+        seed = None
+        if self.seed is not None:
+            seed = dialogue_seed(self.seed, profile.get('hadm_id'), patient_model)
+
+        patient = PatientAgent(
+            profile=profile,
+            model_id=patient_model,
+            llm_client=self.llm_client,
+            context_policy=ContextPolicy.from_config(context_config),
+            prompt_layout=self.prompt_layout,
+            seed=seed,
+            stop_condition=self.patient_stop,
+            templates=self.persona_templates
+        )
+
+        doctor = DoctorAgent(
+            model_id=doctor_model,
+            llm_client=self.llm_client,
+            patient_chief_complaint=profile.get('chiefcomplaint', 'Not specified'),
+            context_policy=ContextPolicy.from_config(context_config),
+            prompt_layout=self.prompt_layout,
+            seed=seed,
+            termination=self.termination
+        )
+
+        return patient, doctor
+
+    @staticmethod
+    def _prompt_hash(patient: PatientAgent, doctor: DoctorAgent) -> str:
+        """Hash of everything that shapes a dialogue's requests apart from model output"""
+        shape = {
+            "patient_model": patient.model_id,
+            "doctor_model": doctor.model_id,
+            "patient_prompt": patient.system_prompt,
+            "doctor_prompt": doctor.system_prompt,
+            "seed": patient.seed,
+            "context_policy": patient.context_policy.describe()
+        }
+        # Only hashed when set, so runs without a stop rule or early stopping keep their hashes
+        if patient.stop_condition is not None:
+            shape["patient_stop"] = patient.stop_condition.describe()
+        if doctor.termination.mode != 'max_turns':
+            shape["termination"] = doctor.termination.describe()
+        return stable_hash(shape)
+
     def generate_for_split(self,
                            split: str,
                            doctor_model: str,
                            patient_model: str,
-                           limit: Optional[int] = None) -> List[Dict]:
+                           limit: Optional[int] = None,
+                           concurrency: Optional[int] = None) -> List[Dict]:
         """
         Generate dialogues for a specific data split
 
@@ -117,35 +239,100 @@ class DialogueGenerator:
             doctor_model: Model ID for doctor
             patient_model: Model ID for patient
             limit: Optional limit on number of profiles to process
+            concurrency: Number of dialogues to run at once (defaults to config)
 
         Returns:
-            List of dialogue dicts
+            List of dialogue dicts, in profile order
         """
-        # Filter profiles by split
-        split_profiles = [p for p in self.patient_profiles if p.get('split') == split]
-
-        if limit:
-            split_profiles = split_profiles[:limit]
+        split_profiles = self._split_profiles(split, limit)
 
         print(f"\nGenerating {len(split_profiles)} dialogues for {split} split")
         print(f"Doctor: {doctor_model}, Patient: {patient_model}")
 
         dialogues = []
-        for profile in tqdm(split_profiles, desc=f"Generating {split} dialogues"):
-            try:
-                dialogue = self.generate_single_dialogue(
-                    profile=profile,
-                    doctor_model=doctor_model,
-                    patient_model=patient_model
-                )
+        for profile, dialogue in self._iter_dialogues(split_profiles,
+                                                      doctor_model,
+                                                      patient_model,
+                                                      concurrency or self.concurrency,
+                                                      desc=f"Generating {split} dialogues"):
+            if dialogue is not None:
                 dialogues.append(dialogue)
 
-            except Exception as e:
-                print(f"\nError processing hadm_id {profile.get('hadm_id')}: {str(e)}")
-                continue
-
         return dialogues
 
+    def _split_profiles(self, split: str, limit: Optional[int] = None) -> List[Dict]:
+        """Profiles belonging to a split (case/whitespace-insensitive), truncated to `limit`"""
+        return self.profiles.load_split(split, limit)
+
+    def _generate_or_none(self,
+                          profile: Dict,
+                          doctor_model: str,
+                          patient_model: str,
+                          queue: Optional[WorkQueue] = None) -> Optional[Dict]:
+        """
+        Generate one dialogue, logging and swallowing errors for its hadm_id
+
+        With a work queue the profile is claimed first; profiles another
+        worker holds or finished are skipped (None), as are profiles whose
+        claim failed (e.g. a shared-filesystem error).
+        """
+        claimed = False
+        try:
+            if queue is not None:
+                if not queue.claim(profile.get('hadm_id')):
+                    return None
+                claimed = True
+            return self.generate_single_dialogue(
+                profile=profile,
+                doctor_model=doctor_model,
+                patient_model=patient_model
+            )
+        except Exception as e:
+            print(f"\nError processing hadm_id {profile.get('hadm_id')}: {str(e)}")
+            if claimed:
+                try:
+                    queue.release(profile.get('hadm_id'))
+                except OSError as release_error:
+                    # The claim expires after the lease once the heartbeat stops
+                    print(f"Could not release claim for hadm_id {profile.get('hadm_id')}: {release_error}")
+            return None
+
+    def _iter_dialogues(self,
+                        profiles: List[Dict],
+                        doctor_model: str,
+                        patient_model: str,
+                        concurrency: int,
+                        desc: str,
+                        queue: Optional[WorkQueue] = None):
+        """
+        Run dialogues with bounded concurrency
+
+        Yields (profile, dialogue) pairs in the same order as `profiles`,
+        regardless of completion order, so output matches a serial run.
+        `dialogue` is None when generation failed for that profile (or, with
+        a work queue, another worker took it).
+        """
+        if concurrency <= 1:
+            for profile in tqdm(profiles, desc=desc):
+                yield profile, self._generate_or_none(profile, doctor_model, patient_model, queue)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        progress = tqdm(total=len(profiles), desc=desc)
+        try:
+            futures = []
+            for profile in profiles:
+                future = executor.submit(self._generate_or_none, profile, doctor_model, patient_model, queue)
+                future.add_done_callback(lambda _: progress.update(1))
+                futures.append(future)
+
+            for profile, future in zip(profiles, futures):
+                yield profile, future.result()
+        finally:
+            # Drop queued work if the consumer stops early (e.g. Ctrl-C)
+            executor.shutdown(wait=True, cancel_futures=True)
+            progress.close()
+
     def save_dialogues(self, dialogues: List[Dict], output_path: Path):
         """Save dialogues to JSONL file"""
         output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -156,89 +343,362 @@ class DialogueGenerator:
 
         print(f"Saved {len(dialogues)} dialogues to {output_path}")
 
+    def export_columnar(self, dialogues: List[Dict], split: str) -> int:
+        """
+        Write dialogues of one split to the columnar store at `self.columnar_dir`
+
+        Replaces the (split, patient model) partitions being written. Works
+        whatever output.dialogue_format is; the JSONL output stays the source
+        of truth.
+
+        Args:
+            dialogues: Dialogue dicts
+            split: Split the dialogues belong to
+
+        Returns:
+            Number of dialogues written
+        """
+        count = write_dialogue_dataset(dialogues, self.columnar_dir, split)
+        print(f"Exported {count} dialogues to {self.columnar_dir}")
+        return count
+
+    def _export_columnar(self, output_file: Path, split: str):
+        """Refresh a split's columnar partition from its finished JSONL (parquet format only)"""
+        if self.dialogue_format != 'parquet':
+            return
+        if output_file.name != "llm_dialogue.jsonl":
+            # A shard holds part of the partition; it is exported after `merge`
+            return
+        count = export_jsonl(output_file, self.columnar_dir, split)
+        print(f"Exported {count} dialogues from {output_file} to {self.columnar_dir}")
+
+    def save_metrics(self, output_path: Path):
+        """Write the run-level LLM call summary (Prometheus text for .prom, JSON otherwise)"""
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        metrics = self.llm_client.metrics
+
+        with open(output_path, 'w') as f:
+            if output_path.suffix == '.prom':
+                f.write(metrics.to_prometheus())
+            else:
+                f.write(metrics.to_json())
+
+        print(f"Saved run metrics to {output_path}")
+
+    def _prepare_split_run(self,
+                           split: str,
+                           doctor_model: str,
+                           patient_model: str,
+                           limit: Optional[int],
+                           resume: bool):
+        """
+        Work out what one (split, patient model) run still has to generate
+
+        Sharded and work-queue runs write their own llm_dialogue.shard-<tag>.jsonl
+        (and manifest), to be combined with `merge`.
+
+        Returns:
+            (profiles to generate, output JSONL path, RunManifest, WorkQueue or None)
+        """
+        # Save to appropriate directory
+        split_dir = self.output_dir / f"{split}_test" / "llm_simulation" / patient_model
+        canonical_file = split_dir / "llm_dialogue.jsonl"
+        output_file = canonical_file
+        manifest_file = split_dir / "run_manifest.json"
+
+        split_profiles = self._split_profiles(split, limit)
+
+        tag = None
+        if self.shard is not None:
+            index, count = self.shard
+            split_profiles = [p for p in split_profiles if shard_of(p.get('hadm_id'), count) == index]
+            tag = f"{index}-of-{count}"
+        queue = None
+        if self.queue_dir is not None:
+            queue = WorkQueue(Path(self.queue_dir) / f"{split}_test" / patient_model, self.queue_lease)
+            tag = f"{tag}-{worker_tag()}" if tag else worker_tag()
+        if tag is not None:
+            output_file = split_dir / SHARD_OUTPUT.format(tag=tag)
+            manifest_file = split_dir / SHARD_MANIFEST.format(tag=tag)
+
+        manifest = RunManifest(manifest_file, self.config, self.seed, doctor_model, patient_model, split)
+
+        if resume:
+            previous = RunManifest.load_dialogues(manifest_file)
+            if self.seed is not None and previous:
+                # Seeded prompts are reproducible, so a changed hash means the
+                # dialogue's inputs changed and it must be regenerated
+                stale = set()
+                for profile in split_profiles:
+                    hadm_id = str(profile.get('hadm_id'))
+                    entry = previous.get(hadm_id)
+                    if entry is not None:
+                        current = self._prompt_hash(*self._build_agents(profile, doctor_model, patient_model))
+                        if entry.get('prompt_hash') != current:
+                            stale.add(hadm_id)
+                if stale:
+                    removed = drop_dialogues(output_file, stale)
+                    print(f"Regenerating {removed} dialogues whose prompts changed")
+                previous = {k: v for k, v in previous.items() if k not in stale}
+            manifest.update(previous)
+
+            completed = load_completed_keys(output_file)
+            if output_file != canonical_file:
+                # Dialogues already merged into the canonical file are done too
+                completed |= load_completed_keys(canonical_file)
+            remaining = [
+                p for p in split_profiles
+                if (str(p.get('hadm_id')), patient_model, doctor_model) not in completed
+            ]
+            print(f"Resuming: {len(split_profiles) - len(remaining)} dialogues already in {output_file}")
+            split_profiles = remaining
+
+        return split_profiles, output_file, manifest, queue
+
     def run_full_simulation(self,
                            doctor_model: str,
                            patient_model: str,
                            splits: List[str] = ['persona', 'info'],
-                           limit: Optional[int] = None):
+                           limit: Optional[int] = None,
+                           concurrency: Optional[int] = None,
+                           resume: bool = False):
         """
         Run full simulation for specified splits
 
+        Each finished dialogue is appended to the split's llm_dialogue.jsonl as
+        soon as it (and every dialogue before it) completes, so a crash only
+        loses in-flight work. With output.dialogue_format: parquet the finished
+        file is then exported to the columnar store (see dialogue_store.py).
+
         Args:
             doctor_model: Model ID for doctor
             patient_model: Model ID for patient
             splits: List of splits to process
             limit: Optional limit per split
+            concurrency: Number of dialogues to run at once (defaults to config)
+            resume: Keep existing output and skip dialogues already in it
         """
         for split in splits:
             print(f"\n{'='*60}")
             print(f"Processing {split.upper()} split")
             print(f"{'='*60}")
 
-            # Generate dialogues
-            dialogues = self.generate_for_split(
-                split=split,
-                doctor_model=doctor_model,
-                patient_model=patient_model,
-                limit=limit
+            split_profiles, output_file, manifest, queue = self._prepare_split_run(
+                split, doctor_model, patient_model, limit, resume
             )
 
-            # Save to appropriate directory
-            split_dir = self.output_dir / f"{split}_test" / "llm_simulation" / patient_model
-            output_file = split_dir / "llm_dialogue.jsonl"
+            print(f"\nGenerating {len(split_profiles)} dialogues for {split} split")
+            print(f"Doctor: {doctor_model}, Patient: {patient_model}")
 
-            self.save_dialogues(dialogues, output_file)
+            try:
+                with DialogueWriter(output_file, append=resume, fsync_every=self.fsync_every) as writer:
+                    for _, dialogue in self._iter_dialogues(split_profiles,
+                                                            doctor_model,
+                                                            patient_model,
+                                                            concurrency or self.concurrency,
+                                                            desc=f"Generating {split} dialogues",
+                                                            queue=queue):
+                        if dialogue is not None:
+                            writer.write(dialogue)
+                            manifest.add(dialogue['hadm_id'], dialogue['seed'], dialogue['prompt_hash'])
+                            if queue is not None:
+                                queue.complete(dialogue['hadm_id'])
+            finally:
+                manifest.save()
+                if queue is not None:
+                    queue.close()
+
+            print(f"Saved {writer.count} dialogues to {output_file}")
+            self._export_columnar(output_file, split)
 
     def run_multi_model_simulation(self,
                                    doctor_model: str,
                                    patient_models: List[str],
                                    splits: List[str] = ['persona', 'info'],
-                                   limit: Optional[int] = None):
+                                   limit: Optional[int] = None,
+                                   concurrency: Optional[int] = None,
+                                   resume: bool = False):
         """
         Run simulation with one doctor model and multiple patient models
 
+        Every (patient_model, split, profile) is a job in one sweep. Each patient
+        model gets its own worker pool sized by its `concurrency` entry in
+        config.yaml (falling back to `concurrency`), and all pools run at the same
+        time, so providers are kept busy in parallel instead of one after another.
+        Per-model rate limits and connection pools still apply inside LLMClient.
+        Output keeps the per-model {split}_test/llm_simulation/{model}/ layout, in
+        profile order.
+
         Args:
             doctor_model: Model ID for doctor
             patient_models: List of patient model IDs
             splits: List of splits to process
             limit: Optional limit per split
+            concurrency: Default dialogues in flight per patient model (defaults to config)
+            resume: Keep existing output and skip dialogues already in it
         """
-        for patient_model in patient_models:
-            print(f"\n{'#'*60}")
-            print(f"PATIENT MODEL: {patient_model}")
-            print(f"{'#'*60}")
+        default_concurrency = concurrency or self.concurrency
+        sinks = []
+        jobs_by_model = {}
+
+        try:
+            for patient_model in patient_models:
+                jobs = []
+                for split in splits:
+                    split_profiles, output_file, manifest, queue = self._prepare_split_run(
+                        split, doctor_model, patient_model, limit, resume
+                    )
+                    writer = DialogueWriter(output_file, append=resume, fsync_every=self.fsync_every)
+                    sink = _OrderedSink(writer, manifest, output_file, split, queue)
+                    sinks.append(sink)
+                    jobs.extend((sink, index, profile) for index, profile in enumerate(split_profiles))
+                jobs_by_model[patient_model] = jobs
+
+            total = sum(len(jobs) for jobs in jobs_by_model.values())
+            print(f"\nSweep: {total} dialogues across {len(patient_models)} patient models, Doctor: {doctor_model}")
+            for patient_model, jobs in jobs_by_model.items():
+                workers = self._model_concurrency(patient_model, default_concurrency)
+                print(f"  {patient_model}: {len(jobs)} dialogues, {workers} in flight")
+
+            progress = tqdm(total=total, desc="Sweep")
+            executors = []
+            futures = []
+            try:
+                for patient_model, jobs in jobs_by_model.items():
+                    executor = ThreadPoolExecutor(
+                        max_workers=self._model_concurrency(patient_model, default_concurrency)
+                    )
+                    executors.append(executor)
+                    for sink, index, profile in jobs:
+                        future = executor.submit(self._generate_or_none, profile, doctor_model, patient_model,
+                                                 sink.queue)
+                        future.add_done_callback(self._sink_callback(sink, index, progress))
+                        futures.append(future)
+
+                # Failed jobs are logged by their callbacks and don't stop the other pools
+                wait(futures)
+            finally:
+                for executor in executors:
+                    executor.shutdown(wait=True, cancel_futures=True)
+                progress.close()
+        finally:
+            for sink in sinks:
+                sink.close()
+
+        for sink in sinks:
+            print(f"Saved {sink.writer.count} dialogues to {sink.output_file}")
+            self._export_columnar(sink.output_file, sink.split)
+
+    def merge_shard_outputs(self,
+                            patient_models: List[str],
+                            splits: List[str],
+                            limit: Optional[int] = None,
+                            remove_shards: bool = False):
+        """
+        Combine shard outputs of each (split, patient model) into llm_dialogue.jsonl
 
-            self.run_full_simulation(
-                doctor_model=doctor_model,
-                patient_model=patient_model,
-                splits=splits,
-                limit=limit
-            )
+        Args:
+            patient_models: Patient model IDs
+            splits: Splits to merge
+            limit: The --limit the shards ran with (profiles beyond it are not reported missing)
+            remove_shards: Delete shard files once merged
+        """
+        for patient_model in patient_models:
+            for split in splits:
+                split_dir = self.output_dir / f"{split}_test" / "llm_simulation" / patient_model
+                if not split_dir.exists():
+                    print(f"Nothing to merge in {split_dir}")
+                    continue
+                order = [str(p.get('hadm_id')) for p in self.profiles.iter_split(split, limit)]
+                stats = merge_shards(split_dir, order, remove_shards)
+                print(f"Merged {stats['shards']} shards into {split_dir / 'llm_dialogue.jsonl'}: "
+                      f"{stats['dialogues']} dialogues, {stats['duplicates']} duplicates dropped, "
+                      f"{stats['conflicts']} conflicts, {stats['missing']} profiles missing")
+                self._export_columnar(split_dir / "llm_dialogue.jsonl", split)
+
+    @staticmethod
+    def _sink_callback(sink: _OrderedSink, index: int, progress):
+        """Future callback that hands a finished job to its output sink"""
+        def callback(future):
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                # A failed job still has to advance the sink, or later dialogues stay pending
+                print(f"\nError in {sink.split} job {index}: {error}")
+            sink.put(index, None if error is not None else future.result())
+            progress.update(1)
+        return callback
+
+    def _model_concurrency(self, model_id: str, default: int) -> int:
+        """Dialogues in flight for a patient model: its `concurrency` entry, else `default`"""
+        model_config = self.config['models'].get(model_id, {})
+        return max(1, model_config.get('concurrency', default))
 
 
 def main():
     parser = argparse.ArgumentParser(description='Generate patient-doctor dialogues')
 
+    parser.add_argument('command', nargs='?', choices=['run', 'merge'], default='run',
+                        help='run (default) generates dialogues; merge combines shard outputs')
     parser.add_argument('--config', default='config.yaml', help='Config file path')
     parser.add_argument('--doctor-model', default='gpt-4.1-api', help='Doctor model ID')
     parser.add_argument('--patient-model', default='deepseek-api', help='Patient model ID (or comma-separated list)')
     parser.add_argument('--splits', default='persona,info', help='Comma-separated splits to process')
     parser.add_argument('--limit', type=int, help='Limit number of profiles per split (for testing)')
-    parser.add_argument('--test-connection', action='store_true', help='Test API connections and exit')
+    parser.add_argument('--concurrency', type=int, help='Number of dialogues to generate in parallel (default: simulation.concurrency)')
+    parser.add_argument('--seed', type=int, help='Run seed for reproducible prompts and sampling (default: simulation.seed)')
+    parser.add_argument('--resume', action='store_true', help='Skip dialogues already present in existing output files')
+    parser.add_argument('--shard', help='Only generate shard i/N of each split (stable hash of hadm_id, i = 0..N-1)')
+    parser.add_argument('--queue-dir', help='Shared directory of work-queue lock files; workers pull profiles without overlap')
+    parser.add_argument('--queue-lease', type=float, help='Seconds before an unfinished claim is taken over (default: simulation.queue_lease_seconds)')
+    parser.add_argument('--remove-shards', action='store_true', help='merge: delete shard files after merging')
+    parser.add_argument('--metrics-out', help='Write run metrics to this file (.prom for Prometheus text, otherwise JSON)')
+    parser.add_argument('--no-cache', action='store_true', help='Bypass the response cache for this run')
+    parser.add_argument('--test-connection', action='store_true',
+                        help='Check all model endpoints concurrently (no generation) and exit')
+    parser.add_argument('--health-timeout', type=float, default=5.0,
+                        help='Per-model timeout in seconds for --test-connection')
+    parser.add_argument('--record-trace', help='Record every LLM request and response to this trace file')
+    parser.add_argument('--replay-trace', help='Serve LLM responses from this trace file instead of the providers')
+    parser.add_argument('--replay-order', choices=['hash', 'sequential'], default='hash',
+                        help='Match replayed requests by hash (default) or strictly in recorded order')
 
     args = parser.parse_args()
 
+    if args.record_trace and args.replay_trace:
+        parser.error("--record-trace and --replay-trace are mutually exclusive")
+    trace = None
+    if args.record_trace:
+        trace = {"mode": "record", "path": args.record_trace}
+    elif args.replay_trace:
+        trace = {"mode": "replay", "path": args.replay_trace, "order": args.replay_order}
+
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+
     # Initialize generator
-    generator = DialogueGenerator(config_path=args.config)
+    generator = DialogueGenerator(config_path=args.config, trace=trace)
+    generator.shard = shard
+    generator.queue_dir = args.queue_dir
+    if args.queue_lease is not None:
+        generator.queue_lease = args.queue_lease
+    generator.llm_client.cache_bypass = args.no_cache
+    if args.seed is not None:
+        generator.seed = args.seed
 
     # Test connections if requested
     if args.test_connection:
         print("\nTesting API connections...")
-        for model_id in generator.llm_client.get_available_models():
-            if generator.llm_client.test_connection(model_id):
-                print(f"✓ {model_id}")
-            else:
-                print(f"✗ {model_id}")
+        results = generator.llm_client.health_check(timeout=args.health_timeout)
+        for model_id, result in results.items():
+            mark = "✓" if result["ok"] else "✗"
+            print(f"{mark} {model_id} ({result['latency'] * 1000:.0f} ms): {result['detail']}")
+        generator.llm_client.close()
         return
 
     # Parse patient models
@@ -247,26 +707,59 @@ def main():
     # Parse splits
     splits = [s.strip() for s in args.splits.split(',')]
 
+    if args.command == 'merge':
+        generator.merge_shard_outputs(patient_models, splits, args.limit, remove_shards=args.remove_shards)
+        return
+
     # Run simulation
     if len(patient_models) == 1:
         generator.run_full_simulation(
             doctor_model=args.doctor_model,
             patient_model=patient_models[0],
             splits=splits,
-            limit=args.limit
+            limit=args.limit,
+            concurrency=args.concurrency,
+            resume=args.resume
         )
     else:
         generator.run_multi_model_simulation(
             doctor_model=args.doctor_model,
             patient_models=patient_models,
             splits=splits,
-            limit=args.limit
+            limit=args.limit,
+            concurrency=args.concurrency,
+            resume=args.resume
         )
 
     print("\n" + "="*60)
     print("SIMULATION COMPLETE")
     print("="*60)
 
+    for row in generator.llm_client.metrics.summary():
+        print(f"{row['model']} ({row['role']}): {row['calls']} calls, {row['errors']} errors, "
+              f"{row['prompt_tokens']} prompt ({row['cached_tokens']} cached) + "
+              f"{row['completion_tokens']} completion tokens")
+
+    if args.metrics_out:
+        generator.save_metrics(Path(args.metrics_out))
+
+    cache_stats = generator.llm_client.cache_stats()
+    if cache_stats:
+        print(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+              f"{cache_stats['entries']} entries")
+
+    for model_id, stats in generator.llm_client.batch_stats().items():
+        print(f"Batching {model_id}: {stats['requests']} requests in {stats['batches']} batches "
+              f"(mean size {stats['mean_batch_size']})")
+
+    trace_stats = generator.llm_client.trace_stats()
+    if trace_stats.get('mode') == 'record':
+        print(f"Recorded {trace_stats['records']} requests to {trace_stats['path']}")
+    elif trace_stats.get('mode') == 'replay':
+        print(f"Replayed {trace_stats['served']} requests from {trace_stats['path']} "
+              f"({trace_stats['remaining']} unused)")
+    generator.llm_client.close()
+
 
 if __name__ == "__main__":
     main()
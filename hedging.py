@@ -0,0 +1,89 @@
+"""
+Hedged requests for LLMClient - duplicate a slow call once it passes a latency percentile
+"""
+
+import time
+from typing import Dict, Optional
+
+from metrics import MetricsRegistry, percentile
+
+
+class HedgePolicy:
+    """
+    When to send a duplicate (hedge) request, and to which model
+
+    A call still running after `percentile` of its model's recent latencies
+    (tracked online by MetricsRegistry) gets one more request, to the model's
+    `fallbacks` entry or else to the same model. The first answer wins and the
+    other request is cancelled. Until `min_samples` calls have completed,
+    `initial_delay_s` is used instead (None = no hedging yet).
+    """
+
+    def __init__(self,
+                 enabled: bool = False,
+                 percentile: float = 0.95,
+                 min_samples: int = 20,
+                 initial_delay_s: Optional[float] = None,
+                 min_delay_s: float = 1.0,
+                 fallbacks: Optional[Dict[str, str]] = None,
+                 refresh_s: float = 1.0):
+        """
+        Args:
+            enabled: Hedge at all
+            percentile: Latency quantile (0-1) after which a call is hedged
+            min_samples: Completed calls of a model before its percentile is trusted
+            initial_delay_s: Hedge delay while a model has fewer samples
+            min_delay_s: Lower bound on the hedge delay
+            fallbacks: model_id -> model_id that receives the hedge
+            refresh_s: Recompute a model's percentile at most this often
+        """
+        if not 0 < percentile < 1:
+            raise ValueError(f"Hedge percentile must be between 0 and 1, got {percentile}")
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay_s = initial_delay_s
+        self.min_delay_s = min_delay_s
+        self.fallbacks = fallbacks or {}
+        self.refresh_s = refresh_s
+        # model_id -> (computed at, delay)
+        self._delays = {}
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'HedgePolicy':
+        """Build a policy from the `hedging:` section of config.yaml"""
+        config = config or {}
+        return cls(
+            enabled=config.get('enabled', False),
+            percentile=config.get('percentile', 0.95),
+            min_samples=config.get('min_samples', 20),
+            initial_delay_s=config.get('initial_delay_s'),
+            min_delay_s=config.get('min_delay_s', 1.0),
+            fallbacks=config.get('fallbacks')
+        )
+
+    def delay(self, model_id: str, metrics: MetricsRegistry) -> Optional[float]:
+        """Seconds after which a call to `model_id` is hedged, or None to not hedge it"""
+        if not self.enabled:
+            return None
+
+        # Sorting the sample window on every call would stall the event loop at high concurrency
+        now = time.monotonic()
+        cached = self._delays.get(model_id)
+        if cached is not None and now - cached[0] < self.refresh_s:
+            return cached[1]
+
+        # Cancelled primaries count at their elapsed time, or hedging would pull the percentile down
+        samples = metrics.latencies(model_id, include_censored=True)
+        if len(samples) >= self.min_samples:
+            delay = max(self.min_delay_s, percentile(samples, self.percentile))
+        elif self.initial_delay_s is not None:
+            delay = max(self.min_delay_s, self.initial_delay_s)
+        else:
+            delay = None
+        self._delays[model_id] = (now, delay)
+        return delay
+
+    def target(self, model_id: str) -> str:
+        """Model that receives the hedge for a call to `model_id`"""
+        return self.fallbacks.get(model_id, model_id)
@@ -1,126 +1,1220 @@
 """
 LLM Client Wrapper for PatientSim
-Supports: DeepSeek API, GPT-4.1 API, Ollama
+Supports: DeepSeek API, GPT-4.1 API, Ollama, OpenAI-compatible servers, offline mock
 """
 
 import os
+import re
+import sys
+import json
+import time
+import queue
+import random
+import asyncio
+import threading
 import yaml
-from typing import List, Dict, Optional
-import requests
-from openai import OpenAI
+from typing import AsyncIterator, Iterator, List, Dict, Optional
+import httpx
+
+from response_cache import ResponseCache
+from metrics import MetricsRegistry
+from rate_limiter import RateLimiter
+from token_utils import estimate_message_tokens, estimate_tokens
+from mock_llm import MockBackend, MockProviderError
+from batching import BatchItemError, MicroBatcher
+from traffic_trace import TraceRecorder, TraceReplay
+from hedging import HedgePolicy
+
+
+# Default number of pooled connections per model (override with `pool_size`)
+DEFAULT_POOL_SIZE = 10
+
+# Retry defaults (override per model with `timeout`, `max_retries`, `retry_backoff`)
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_RETRY_BACKOFF = 1.0
+MAX_RETRY_DELAY = 60.0
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Completion fields stored in traffic traces
+TRACE_FIELDS = ('text', 'prompt_tokens', 'completion_tokens', 'cached_tokens',
+                'latency', 'ttft', 'cache_hit', 'stopped', 'hedge')
+
+# Micro-batching defaults for local servers (override per model under `batching`)
+DEFAULT_NUM_PARALLEL = 4    # Ollama's usual OLLAMA_NUM_PARALLEL
+DEFAULT_FLUSH_MS = 10
+
+
+class Completion:
+    """Text of one LLM call plus its token usage and timings"""
+
+    def __init__(self,
+                 text: str,
+                 model_id: str,
+                 prompt_tokens: int = 0,
+                 completion_tokens: int = 0,
+                 cached_tokens: int = 0,
+                 latency: float = 0.0,
+                 ttft: Optional[float] = None,
+                 cache_hit: bool = False,
+                 stopped: bool = False,
+                 hedge: Optional[Dict] = None):
+        self.text = text
+        self.model_id = model_id
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+        self.latency = latency
+        self.ttft = ttft
+        self.cache_hit = cache_hit
+        # True when a StopCondition cut the streamed reply short
+        self.stopped = stopped
+        # Set when a hedge request was sent: {"after_s", "model_id", "winner"}
+        self.hedge = hedge
+
+
+class StopCondition:
+    """
+    Client-side stop rule for streamed replies
+
+    The reply is cut at the first stop sequence (e.g. a stray "Doctor:" turn
+    prefix) or after `max_sentences` sentences, whichever comes first, and
+    the request is closed so the server stops generating.
+    """
+
+    _SENTENCE_END = re.compile(r'[.!?]+["\')\]]*(?=\s)')
+
+    def __init__(self,
+                 stop_sequences: Optional[List[str]] = None,
+                 max_sentences: Optional[int] = None):
+        self.stop_sequences = [s for s in (stop_sequences or []) if s]
+        self.max_sentences = max_sentences
+        # Trailing characters held back while they could still grow into a stop sequence
+        self.holdback = max((len(s) for s in self.stop_sequences), default=1) - 1
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> Optional['StopCondition']:
+        """Build from a config section; None when no condition is set"""
+        config = config or {}
+        stop = cls(config.get('stop_sequences'), config.get('max_sentences'))
+        if not stop.stop_sequences and not stop.max_sentences:
+            return None
+        return stop
+
+    def find_cut(self, text: str) -> Optional[int]:
+        """Index at which `text` should be cut, or None to keep streaming"""
+        cut = None
+        for sequence in self.stop_sequences:
+            # A match at the very start is the model echoing its own label, not a new turn
+            index = text.find(sequence, 1)
+            if index != -1 and (cut is None or index < cut):
+                cut = index
+
+        if self.max_sentences:
+            for count, match in enumerate(self._SENTENCE_END.finditer(text), start=1):
+                if cut is not None and match.end() >= cut:
+                    break
+                if count == self.max_sentences:
+                    cut = match.end()
+                    break
+
+        return cut
+
+    def describe(self) -> Dict:
+        """Settings for cache keys and dialogue metadata"""
+        return {"stop_sequences": self.stop_sequences, "max_sentences": self.max_sentences}
 
 
 class LLMClient:
-    """Unified client for multiple LLM providers"""
+    """Unified client for multiple LLM providers
+
+    All requests run on a single background event loop owned by the client,
+    so connection pools and async clients are shared by every caller. Use
+    `agenerate` from async code or `generate` from sync/threaded code.
+    """
 
-    def __init__(self, config_path: str = "config.yaml"):
+    def __init__(self, config_path: str = "config.yaml", trace: Optional[Dict] = None):
+        """
+        Args:
+            config_path: Config file path
+            trace: Overrides the `trace:` config section (mode, path, order, replay_latency)
+        """
         with open(config_path, 'r') as f:
             self.config = yaml.safe_load(f)
 
+        # Optional traffic trace: record every request/response, or replay a
+        # recorded trace instead of calling any provider
+        trace_config = trace if trace is not None else (self.config.get('trace') or {})
+        trace_mode = trace_config.get('mode') or 'off'
+        if trace_mode not in ('off', 'record', 'replay'):
+            raise ValueError(f"Unknown trace mode: {trace_mode}")
+        self.recorder = TraceRecorder(trace_config['path']) if trace_mode == 'record' else None
+        self.replay = TraceReplay(trace_config['path'], trace_config.get('order', 'hash')) \
+            if trace_mode == 'replay' else None
+        self.replay_latency = trace_config.get('replay_latency', False)
+
+        # Usable model entries; `clients`, `limiters` and `batchers` fill in lazily
+        self.model_configs = {}
         self.clients = {}
+        self.limiters = {}
+        self.batchers = {}
+        self._clients_lock = threading.Lock()
+        self.metrics = MetricsRegistry()
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
         self._initialize_clients()
 
+        # Optional hedging of slow calls; fallbacks must point at usable models
+        self.hedging = HedgePolicy.from_config(self.config.get('hedging'))
+        for model_id, target in list(self.hedging.fallbacks.items()):
+            if target not in self.model_configs:
+                print(f"Warning: hedge fallback {target} for {model_id} is not available, hedging to {model_id}")
+                del self.hedging.fallbacks[model_id]
+
+        # Optional persistent response cache; `cache_bypass` skips it for every call
+        cache_config = self.config.get('cache', {})
+        self.cache = None
+        self.cache_bypass = False
+        if cache_config.get('enabled', False):
+            self.cache = ResponseCache(
+                path=cache_config.get('path', './.llm_cache/responses.sqlite'),
+                max_entries=cache_config.get('max_entries', 100000),
+                ttl_seconds=cache_config.get('ttl_seconds')
+            )
+
+    @staticmethod
+    def _http_limits(model_config: Dict) -> httpx.Limits:
+        """Connection pool limits for one model entry"""
+        pool_size = model_config.get('pool_size', DEFAULT_POOL_SIZE)
+        return httpx.Limits(max_connections=pool_size,
+                            max_keepalive_connections=pool_size)
+
     def _initialize_clients(self):
-        """Initialize API clients for each provider"""
+        """
+        Work out which configured models can be used
+
+        Only configs and API key presence are checked here; SDK clients,
+        connection pools, limiters and batchers are built on a model's first
+        use (see `_client`), so startup does not pay for unused models.
+        """
         for model_id, model_config in self.config['models'].items():
             provider = model_config['provider']
 
-            if provider == 'deepseek':
-                api_key = os.getenv(model_config['api_key_env'])
-                if not api_key:
+            if self.replay is None and provider in ('deepseek', 'openai_compatible', 'openai'):
+                if not os.getenv(model_config['api_key_env']):
                     print(f"Warning: {model_config['api_key_env']} not found for {model_id}")
                     continue
 
-                self.clients[model_id] = {
-                    'type': 'openai_compatible',
-                    'client': OpenAI(
-                        api_key=api_key,
-                        base_url=model_config['base_url']
-                    ),
-                    'config': model_config
-                }
+            self.model_configs[model_id] = model_config
 
-            elif provider == 'openai':
-                api_key = os.getenv(model_config['api_key_env'])
-                if not api_key:
-                    print(f"Warning: {model_config['api_key_env']} not found for {model_id}")
-                    continue
+    def _client(self, model_id: str) -> Dict:
+        """Client info for a model, building its client, limiter and batcher on first use"""
+        client_info = self.clients.get(model_id)
+        if client_info is not None:
+            return client_info
+        if model_id not in self.model_configs:
+            raise ValueError(f"Model {model_id} not initialized. Check API keys.")
 
-                self.clients[model_id] = {
-                    'type': 'openai',
-                    'client': OpenAI(api_key=api_key),
-                    'config': model_config
-                }
+        with self._clients_lock:
+            client_info = self.clients.get(model_id)
+            if client_info is None:
+                client_info = self._build_client(self.model_configs[model_id])
 
-            elif provider == 'ollama':
-                self.clients[model_id] = {
-                    'type': 'ollama',
-                    'base_url': model_config['base_url'],
-                    'config': model_config
-                }
+                # One limiter per model, shared by every caller. Retries are handled in
+                # `_request_with_retry`, so the SDK's own retries are disabled.
+                rate_limit = client_info['config'].get('rate_limit') or {}
+                if client_info['type'] == 'replay':
+                    rate_limit = {}
+                self.limiters[model_id] = RateLimiter(
+                    requests_per_minute=rate_limit.get('requests_per_minute'),
+                    tokens_per_minute=rate_limit.get('tokens_per_minute')
+                )
+
+                # Optional micro-batching for local servers, see `_make_batcher`
+                batching = client_info['config'].get('batching') or {}
+                if batching.get('enabled') and client_info['type'] in ('ollama', 'mock'):
+                    self.batchers[model_id] = self._make_batcher(model_id, client_info, batching)
+
+                self.clients[model_id] = client_info
+        return client_info
+
+    def _build_client(self, model_config: Dict) -> Dict:
+        """Construct the provider client for one model entry"""
+        provider = model_config['provider']
+
+        if self.replay is not None:
+            # Replay serves every configured model from the trace: no SDK
+            # clients, API keys, rate limits or batching
+            return {
+                'type': 'replay',
+                'client': self.replay,
+                'config': model_config
+            }
+
+        if provider in ('deepseek', 'openai_compatible'):
+            # Deferred: the SDK import is slow and unused by local-only runs
+            from openai import AsyncOpenAI
+            return {
+                'type': 'openai_compatible',
+                'client': AsyncOpenAI(
+                    api_key=os.getenv(model_config['api_key_env']),
+                    base_url=model_config['base_url'],
+                    timeout=model_config.get('timeout', DEFAULT_TIMEOUT),
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(limits=self._http_limits(model_config))
+                ),
+                'config': model_config
+            }
+
+        elif provider == 'openai':
+            from openai import AsyncOpenAI
+            return {
+                'type': 'openai',
+                'client': AsyncOpenAI(
+                    api_key=os.getenv(model_config['api_key_env']),
+                    timeout=model_config.get('timeout', DEFAULT_TIMEOUT),
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(limits=self._http_limits(model_config))
+                ),
+                'config': model_config
+            }
+
+        elif provider == 'ollama':
+            return {
+                'type': 'ollama',
+                'base_url': model_config['base_url'],
+                'client': httpx.AsyncClient(
+                    base_url=model_config['base_url'],
+                    limits=self._http_limits(model_config),
+                    timeout=model_config.get('timeout', DEFAULT_TIMEOUT)
+                ),
+                'config': model_config
+            }
+
+        elif provider == 'mock':
+            # In-process simulated model, no network (see mock_llm.py)
+            return {
+                'type': 'mock',
+                'client': MockBackend(model_config.get('mock')),
+                'config': model_config
+            }
+
+        raise ValueError(f"Unknown provider: {provider}")
+
+    def _make_batcher(self, model_id: str, client_info: Dict, batching: Dict) -> MicroBatcher:
+        """
+        Micro-batcher for one local model
+
+        Requests arriving within `flush_ms` of each other are dispatched
+        together, with as many in flight as the server has decode slots
+        (`num_parallel`, else $OLLAMA_NUM_PARALLEL). With `batch_endpoint`
+        each batch is one POST to /api/batch (served by mock_llm.py).
+        """
+        parallel = batching.get('num_parallel') or int(os.getenv('OLLAMA_NUM_PARALLEL') or DEFAULT_NUM_PARALLEL)
+
+        async def send_one(request):
+            return await self._request(model_id, client_info, *request)
+
+        async def send_batch(requests):
+            return await self._request_batch(model_id, client_info, requests)
+
+        return MicroBatcher(
+            send_one=send_one,
+            send_batch=send_batch if batching.get('batch_endpoint') else None,
+            max_batch=batching.get('max_batch') or parallel,
+            flush_interval=batching.get('flush_ms', DEFAULT_FLUSH_MS) / 1000.0,
+            parallel=parallel
+        )
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Return the client's event loop, starting its thread on first use"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="llm-client-loop",
+                    daemon=True
+                )
+                self._loop_thread.start()
+        return self._loop
+
+    def _run(self, coro):
+        """Run a coroutine on the client's event loop and block for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    async def _on_loop(self, coro):
+        """Await a coroutine on the client's event loop from any event loop"""
+        loop = self._get_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
 
     def generate(self,
                  model_id: str,
                  messages: List[Dict[str, str]],
                  temperature: Optional[float] = None,
-                 max_tokens: Optional[int] = None) -> str:
+                 max_tokens: Optional[int] = None,
+                 use_cache: bool = True,
+                 role: Optional[str] = None,
+                 seed: Optional[int] = None,
+                 stop: Optional[StopCondition] = None) -> str:
+        """
+        Generate response from specified model (blocking wrapper over `agenerate`)
+
+        Args:
+            model_id: Model identifier (e.g., 'deepseek-api', 'gpt-4.1-api')
+            messages: List of message dicts with 'role' and 'content'
+            temperature: Override default temperature
+            max_tokens: Override default max_tokens
+            use_cache: Set False to bypass the response cache for this call
+            role: Calling agent ('doctor', 'patient') for metrics
+            seed: Sampling seed, sent to providers that support one
+            stop: Stream the reply and cut it where this condition fires
+
+        Returns:
+            Generated text response
+        """
+        return self.complete(model_id, messages, temperature, max_tokens, use_cache, role, seed, stop).text
+
+    async def agenerate(self,
+                        model_id: str,
+                        messages: List[Dict[str, str]],
+                        temperature: Optional[float] = None,
+                        max_tokens: Optional[int] = None,
+                        use_cache: bool = True,
+                        role: Optional[str] = None,
+                        seed: Optional[int] = None,
+                        stop: Optional[StopCondition] = None) -> str:
         """
         Generate response from specified model
 
+        Can be awaited from any event loop; the request itself always runs on
+        the client's loop so pooled connections are reused.
+
         Args:
             model_id: Model identifier (e.g., 'deepseek-api', 'gpt-4.1-api')
             messages: List of message dicts with 'role' and 'content'
             temperature: Override default temperature
             max_tokens: Override default max_tokens
+            use_cache: Set False to bypass the response cache for this call
+            role: Calling agent ('doctor', 'patient') for metrics
+            seed: Sampling seed, sent to providers that support one
+            stop: Stream the reply and cut it where this condition fires
 
         Returns:
             Generated text response
         """
-        if model_id not in self.clients:
-            raise ValueError(f"Model {model_id} not initialized. Check API keys.")
+        completion = await self.acomplete(model_id, messages, temperature, max_tokens, use_cache, role, seed, stop)
+        return completion.text
+
+    def complete(self,
+                 model_id: str,
+                 messages: List[Dict[str, str]],
+                 temperature: Optional[float] = None,
+                 max_tokens: Optional[int] = None,
+                 use_cache: bool = True,
+                 role: Optional[str] = None,
+                 seed: Optional[int] = None,
+                 stop: Optional[StopCondition] = None) -> Completion:
+        """Like `generate`, but return a `Completion` with token usage and timings"""
+        return self._run(self._acomplete(model_id, messages, temperature, max_tokens, use_cache, role, seed, stop))
 
-        client_info = self.clients[model_id]
+    async def acomplete(self,
+                        model_id: str,
+                        messages: List[Dict[str, str]],
+                        temperature: Optional[float] = None,
+                        max_tokens: Optional[int] = None,
+                        use_cache: bool = True,
+                        role: Optional[str] = None,
+                        seed: Optional[int] = None,
+                        stop: Optional[StopCondition] = None) -> Completion:
+        """Like `agenerate`, but return a `Completion` with token usage and timings"""
+        return await self._on_loop(
+            self._acomplete(model_id, messages, temperature, max_tokens, use_cache, role, seed, stop))
+
+    def generate_stream(self,
+                        model_id: str,
+                        messages: List[Dict[str, str]],
+                        temperature: Optional[float] = None,
+                        max_tokens: Optional[int] = None,
+                        role: Optional[str] = None,
+                        seed: Optional[int] = None,
+                        stop: Optional[StopCondition] = None,
+                        completion: Optional[Completion] = None) -> Iterator[str]:
+        """
+        Stream a response as text deltas (blocking iterator over `agenerate_stream`)
+
+        Streams bypass the response cache. Leaving the loop early closes the
+        request, so the server stops generating.
+
+        Args:
+            model_id: Model identifier (e.g., 'deepseek-api', 'gpt-4.1-api')
+            messages: List of message dicts with 'role' and 'content'
+            temperature: Override default temperature
+            max_tokens: Override default max_tokens
+            role: Calling agent ('doctor', 'patient') for metrics
+            seed: Sampling seed, sent to providers that support one
+            stop: End the stream where this condition fires
+            completion: Filled in with the full text, usage and timings
+                (including time to first token) when the stream ends
+
+        Yields:
+            Text deltas; joined together they are the reply
+        """
+        items = queue.Queue()
+        stream = self._astream(model_id, messages, temperature, max_tokens, role, seed, stop, completion)
+        future = asyncio.run_coroutine_threadsafe(self._pump(stream, items.put), self._get_loop())
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == 'error':
+                    raise value
+                if kind == 'done':
+                    return
+                yield value
+        finally:
+            future.cancel()
+
+    async def agenerate_stream(self,
+                               model_id: str,
+                               messages: List[Dict[str, str]],
+                               temperature: Optional[float] = None,
+                               max_tokens: Optional[int] = None,
+                               role: Optional[str] = None,
+                               seed: Optional[int] = None,
+                               stop: Optional[StopCondition] = None,
+                               completion: Optional[Completion] = None) -> AsyncIterator[str]:
+        """Async version of `generate_stream`; can be iterated from any event loop"""
+        loop = self._get_loop()
+        stream = self._astream(model_id, messages, temperature, max_tokens, role, seed, stop, completion)
+
+        if asyncio.get_running_loop() is loop:
+            try:
+                async for delta in stream:
+                    yield delta
+            finally:
+                await stream.aclose()
+            return
+
+        caller_loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._pump(stream, lambda item: caller_loop.call_soon_threadsafe(items.put_nowait, item)),
+            loop
+        )
+        try:
+            while True:
+                kind, value = await items.get()
+                if kind == 'error':
+                    raise value
+                if kind == 'done':
+                    return
+                yield value
+        finally:
+            future.cancel()
+
+    @staticmethod
+    async def _pump(stream: AsyncIterator[str], put):
+        """Forward a stream to another thread or loop as ('delta' | 'error' | 'done', value) items"""
+        try:
+            async for delta in stream:
+                put(('delta', delta))
+        except Exception as e:
+            put(('error', e))
+        else:
+            put(('done', None))
+        finally:
+            await stream.aclose()
+
+    def _resolve(self,
+                 model_id: str,
+                 temperature: Optional[float],
+                 max_tokens: Optional[int],
+                 seed: Optional[int]):
+        """Look up a model and fill in default sampling parameters"""
+        client_info = self._client(model_id)
         config = client_info['config']
 
         # Use provided params or defaults from config
         temp = temperature if temperature is not None else config['temperature']
         max_tok = max_tokens if max_tokens is not None else config['max_tokens']
 
+        # Only send a seed to providers that honour it
+        if seed is not None and not self._supports_seed(client_info):
+            seed = None
+
+        return client_info, temp, max_tok, seed
+
+    def _record(self, model_id: str, role: Optional[str], completion: Completion):
+        """Add one finished request to the metrics registry"""
+        self.metrics.record(
+            model_id, role,
+            prompt_tokens=completion.prompt_tokens,
+            completion_tokens=completion.completion_tokens,
+            cached_tokens=completion.cached_tokens,
+            latency=completion.latency,
+            ttft=completion.ttft
+        )
+
+    async def _acomplete(self,
+                         model_id: str,
+                         messages: List[Dict[str, str]],
+                         temperature: Optional[float],
+                         max_tokens: Optional[int],
+                         use_cache: bool = True,
+                         role: Optional[str] = None,
+                         seed: Optional[int] = None,
+                         stop: Optional[StopCondition] = None) -> Completion:
+        """Issue one request; must run on the client's event loop"""
+        requested_seed = seed
+        client_info, temp, max_tok, seed = self._resolve(model_id, temperature, max_tokens, seed)
+        use_cache = use_cache and self.cache is not None and not self.cache_bypass
+
+        request = key = None
+        if use_cache or self.recorder is not None or self.replay is not None:
+            request = self._describe_request(client_info, messages, temp, max_tok, seed, stop)
+            key = ResponseCache.make_key(request)
+
+        if self.replay is not None:
+            return await self._replay(model_id, role, key)
+
+        cache_key = key if use_cache else None
+
+        def hedge_fetch():
+            # Same request again, or the same messages to the fallback model with its own defaults
+            target = self.hedging.target(model_id)
+            if target == model_id:
+                return target, self._fetch(model_id, client_info, messages, temp, max_tok, role, seed, stop,
+                                           cache_key=cache_key)
+            target_info, target_temp, target_max_tok, target_seed = \
+                self._resolve(target, temperature, max_tokens, requested_seed)
+            return target, self._fetch(target, target_info, messages, target_temp, target_max_tok, role,
+                                       target_seed, stop)
+
         try:
-            if client_info['type'] in ['openai', 'openai_compatible']:
-                response = client_info['client'].chat.completions.create(
-                    model=config['model_name'],
-                    messages=messages,
-                    temperature=temp,
-                    max_tokens=max_tok
-                )
-                return response.choices[0].message.content
-
-            elif client_info['type'] == 'ollama':
-                response = requests.post(
-                    f"{client_info['base_url']}/api/chat",
-                    json={
-                        "model": config['model_name'],
-                        "messages": messages,
-                        "stream": False,
-                        "options": {
-                            "temperature": temp,
-                            "num_predict": max_tok
-                        }
-                    }
-                )
-                response.raise_for_status()
-                result = response.json()
-                # Ollama returns message as a dict with 'content' and optionally 'thinking'
-                message = result.get('message', {})
-                return message.get('content', '')
+            fetch = self._fetch(model_id, client_info, messages, temp, max_tok, role, seed, stop,
+                                cache_key=cache_key)
+            delay = self.hedging.delay(model_id, self.metrics)
+            if delay is None:
+                completion = await fetch
+            else:
+                completion = await self._hedged(model_id, role, fetch, delay, hedge_fetch)
+        except Exception as e:
+            self._trace(key, model_id, role, request, error=e)
+            raise
+        self._trace(key, model_id, role, request, completion=completion)
+        return completion
+
+    async def _hedged(self, model_id: str, role: Optional[str], fetch, delay: float, hedge_fetch) -> Completion:
+        """
+        Await `fetch`, racing it against a hedge request once it has run for `delay` seconds
+
+        The first successful answer wins and the other request is cancelled;
+        if both fail, the primary's error is raised. The winner's `hedge`
+        field records what happened.
+        """
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(fetch)
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+
+            hedge_after = time.perf_counter() - start
+            target, hedge_coro = hedge_fetch()
+            hedge = asyncio.ensure_future(hedge_coro)
+            tasks.append(hedge)
+            winner = None
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                winner = succeeded[0] if succeeded else None
+            if winner is None:
+                return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        hedge_won = winner is hedge
+        # A cancelled primary never reports its latency; its elapsed time is a lower bound
+        # that keeps the model's latency percentile from drifting down
+        self.metrics.record_hedge(model_id, role, hedge_won,
+                                  elapsed=time.perf_counter() - start if hedge_won else None)
+        completion = winner.result()
+        if hedge_won:
+            # The caller also waited for the primary until the hedge was sent
+            completion.latency += hedge_after
+        completion.hedge = {
+            "after_s": round(delay, 3),
+            "model_id": target,
+            "winner": "hedge" if hedge_won else "primary"
+        }
+        return completion
+
+    @staticmethod
+    def _describe_request(client_info: Dict,
+                          messages: List[Dict[str, str]],
+                          temp: float,
+                          max_tok: int,
+                          seed: Optional[int],
+                          stop: Optional[StopCondition]) -> Dict:
+        """Everything that determines a response; hashed for cache and trace keys"""
+        config = client_info['config']
+        request = {
+            "model_name": config['model_name'],
+            "provider": config['provider'],
+            "messages": messages,
+            "temperature": temp,
+            "max_tokens": max_tok
+        }
+        if seed is not None:
+            request["seed"] = seed
+        if stop is not None:
+            request["stop"] = stop.describe()
+        return request
+
+    async def _fetch(self,
+                     model_id: str,
+                     client_info: Dict,
+                     messages: List[Dict[str, str]],
+                     temp: float,
+                     max_tok: int,
+                     role: Optional[str],
+                     seed: Optional[int],
+                     stop: Optional[StopCondition],
+                     cache_key: Optional[str] = None) -> Completion:
+        """Serve a request from the response cache or the provider"""
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.metrics.record(model_id, role, cache_hit=True)
+                return Completion(cached, model_id, cache_hit=True)
+
+        if stop is not None:
+            # Stop conditions are applied client-side, so the reply has to be streamed
+            completion = Completion('', model_id)
+            async for _ in self._astream(model_id, messages, temp, max_tok, role, seed, stop, completion,
+                                         traced=False):
+                pass
+        else:
+            start = time.perf_counter()
+            try:
+                completion = await self._request_with_retry(model_id, client_info, messages, temp, max_tok, seed)
+            except Exception:
+                self.metrics.record_error(model_id, role)
+                raise
+            completion.latency = time.perf_counter() - start
+            self._record(model_id, role, completion)
+
+        if cache_key is not None and completion.text is not None:
+            self.cache.put(cache_key, completion.text)
+
+        return completion
+
+    def _trace(self,
+               key: Optional[str],
+               model_id: str,
+               role: Optional[str],
+               request: Optional[Dict],
+               completion: Optional[Completion] = None,
+               error: Optional[Exception] = None):
+        """Append a finished request to the recording trace, if one is open"""
+        if self.recorder is None:
+            return
+        response = None
+        if completion is not None:
+            response = {field: getattr(completion, field) for field in TRACE_FIELDS}
+        self.recorder.record(key, model_id, role, request, response=response, error=error)
+
+    async def _replay(self,
+                      model_id: str,
+                      role: Optional[str],
+                      key: str,
+                      completion: Optional[Completion] = None) -> Completion:
+        """Serve a request from the replay trace, filling in `completion` if given"""
+        entry = self.replay.take(key)
+        if 'error' in entry:
+            self.metrics.record_error(model_id, role)
+            raise RuntimeError(entry['error'])
+
+        response = entry['response']
+        if self.replay_latency and response.get('latency'):
+            await asyncio.sleep(response['latency'])
+
+        if completion is None:
+            completion = Completion('', model_id)
+        for field in TRACE_FIELDS:
+            setattr(completion, field, response.get(field, getattr(completion, field)))
 
+        if completion.cache_hit:
+            self.metrics.record(model_id, role, cache_hit=True)
+        else:
+            self._record(model_id, role, completion)
+        return completion
+
+    async def _astream(self,
+                       model_id: str,
+                       messages: List[Dict[str, str]],
+                       temperature: Optional[float],
+                       max_tokens: Optional[int],
+                       role: Optional[str] = None,
+                       seed: Optional[int] = None,
+                       stop: Optional[StopCondition] = None,
+                       completion: Optional[Completion] = None,
+                       traced: bool = True) -> AsyncIterator[str]:
+        """
+        Stream one request on the client's event loop
+
+        Rate limits and retries work as in `_request_with_retry`, except that a
+        failure after the first token is not retried (the caller has already
+        seen part of the reply). `completion` receives the final text, usage
+        and timings. With `traced`, the request is recorded to (or replayed
+        from) the trace; `_fetch` turns it off because it traces the call itself.
+        """
+        client_info, temp, max_tok, seed = self._resolve(model_id, temperature, max_tokens, seed)
+        if completion is None:
+            completion = Completion('', model_id)
+
+        request = key = None
+        if traced and (self.recorder is not None or self.replay is not None):
+            request = self._describe_request(client_info, messages, temp, max_tok, seed, stop)
+            key = ResponseCache.make_key(request)
+
+        if self.replay is not None:
+            # The recorded reply already had the stop condition applied
+            await self._replay(model_id, role, key, completion)
+            if completion.text:
+                yield completion.text
+            return
+        config = client_info['config']
+        limiter = self.limiters[model_id]
+        max_retries = config.get('max_retries', DEFAULT_MAX_RETRIES)
+        backoff = config.get('retry_backoff', DEFAULT_RETRY_BACKOFF)
+        estimated = estimate_message_tokens(messages)
+        holdback = stop.holdback if stop is not None else 0
+
+        start = time.perf_counter()
+        text = ''
+        emitted = 0
+        usage = {}
+        attempt = 0
+        try:
+            while True:
+                await limiter.acquire(estimated)
+                stream = self._stream_request(client_info, messages, temp, max_tok, seed, usage)
+                try:
+                    async for delta in stream:
+                        if completion.ttft is None:
+                            completion.ttft = time.perf_counter() - start
+                        text += delta
+
+                        cut = stop.find_cut(text) if stop is not None else None
+                        if cut is not None:
+                            text = text[:max(cut, emitted)]
+                            completion.stopped = True
+                            break
+
+                        ready = len(text) - holdback
+                        if ready > emitted:
+                            yield text[emitted:ready]
+                            emitted = ready
+                    break
+                except Exception as e:
+                    if text or attempt >= max_retries or not self._is_retryable(e):
+                        raise RuntimeError(f"Error generating from {model_id}: {str(e)}")
+
+                    delay = self._retry_after(e)
+                    if delay is None:
+                        delay = random.uniform(0, min(MAX_RETRY_DELAY, backoff * 2 ** attempt))
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                finally:
+                    # Closing the stream drops the request, so a cut reply stops generating
+                    await stream.aclose()
         except Exception as e:
-            raise RuntimeError(f"Error generating from {model_id}: {str(e)}")
+            self.metrics.record_error(model_id, role)
+            if traced:
+                self._trace(key, model_id, role, request, error=e)
+            raise
+
+        completion.text = text
+        completion.latency = time.perf_counter() - start
+        # Usage arrives with the last chunk, so a cut stream falls back to estimates
+        completion.prompt_tokens = usage.get('prompt_tokens') or estimated
+        completion.completion_tokens = usage.get('completion_tokens') or estimate_tokens(text)
+        completion.cached_tokens = usage.get('cached_tokens', 0)
+        limiter.record_usage(completion.prompt_tokens + completion.completion_tokens, estimated)
+        self._record(model_id, role, completion)
+        if traced:
+            self._trace(key, model_id, role, request, completion=completion)
+
+        if emitted < len(text):
+            yield text[emitted:]
+
+    async def _request_with_retry(self,
+                                  model_id: str,
+                                  client_info: Dict,
+                                  messages: List[Dict[str, str]],
+                                  temp: float,
+                                  max_tok: int,
+                                  seed: Optional[int] = None) -> Completion:
+        """Rate-limit, send and retry transient failures with jittered exponential backoff"""
+        config = client_info['config']
+        limiter = self.limiters[model_id]
+        max_retries = config.get('max_retries', DEFAULT_MAX_RETRIES)
+        backoff = config.get('retry_backoff', DEFAULT_RETRY_BACKOFF)
+        estimated = estimate_message_tokens(messages)
+
+        attempt = 0
+        while True:
+            await limiter.acquire(estimated)
+            try:
+                completion = await self._send(model_id, client_info, messages, temp, max_tok, seed)
+                if not completion.prompt_tokens:
+                    # Provider did not report usage; fall back to estimates
+                    completion.prompt_tokens = estimated
+                    completion.completion_tokens = estimate_tokens(completion.text or '')
+                limiter.record_usage(completion.prompt_tokens + completion.completion_tokens, estimated)
+                return completion
+            except Exception as e:
+                if attempt >= max_retries or not self._is_retryable(e):
+                    raise RuntimeError(f"Error generating from {model_id}: {str(e)}")
+
+                delay = self._retry_after(e)
+                if delay is None:
+                    # Full jitter: uniform over [0, backoff * 2^attempt]
+                    delay = random.uniform(0, min(MAX_RETRY_DELAY, backoff * 2 ** attempt))
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _supports_seed(client_info: Dict) -> bool:
+        """OpenAI and Ollama accept a seed; other providers opt in with `supports_seed`"""
+        # By provider, so a replayed model hashes its requests as the live one did
+        default = client_info['config']['provider'] in ('openai', 'ollama', 'mock')
+        return client_info['config'].get('supports_seed', default)
+
+    @staticmethod
+    def _cached_prompt_tokens(usage) -> int:
+        """Prompt tokens served from the provider's prefix cache"""
+        if usage is None:
+            return 0
+        # OpenAI: usage.prompt_tokens_details.cached_tokens
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', None) if details is not None else None
+        if cached is None:
+            # DeepSeek: usage.prompt_cache_hit_tokens
+            cached = getattr(usage, 'prompt_cache_hit_tokens', None)
+        return cached or 0
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """True for rate limits, server errors, timeouts and dropped connections"""
+        # The OpenAI SDK is imported lazily, so its errors can only occur once it is loaded
+        openai = sys.modules.get('openai')
+        if openai is not None:
+            if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+                return True
+            if isinstance(error, openai.APIStatusError):
+                return error.status_code in RETRYABLE_STATUS_CODES
+        if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+            return True
+        if isinstance(error, (MockProviderError, BatchItemError)):
+            return error.status_code in RETRYABLE_STATUS_CODES
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRYABLE_STATUS_CODES
+        return False
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Server-requested delay from a Retry-After header, if any"""
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        value = headers.get('retry-after')
+        try:
+            return min(MAX_RETRY_DELAY, float(value)) if value is not None else None
+        except ValueError:
+            return None
+
+    async def _send(self,
+                    model_id: str,
+                    client_info: Dict,
+                    messages: List[Dict[str, str]],
+                    temp: float,
+                    max_tok: int,
+                    seed: Optional[int] = None) -> Completion:
+        """Send one request, through the model's micro-batcher when it has one"""
+        batcher = self.batchers.get(model_id)
+        if batcher is None:
+            return await self._request(model_id, client_info, messages, temp, max_tok, seed)
+        return await batcher.submit((messages, temp, max_tok, seed))
+
+    async def _request(self,
+                       model_id: str,
+                       client_info: Dict,
+                       messages: List[Dict[str, str]],
+                       temp: float,
+                       max_tok: int,
+                       seed: Optional[int] = None) -> Completion:
+        """Send one request to the provider, bypassing cache, limits and retries"""
+        config = client_info['config']
+
+        if client_info['type'] in ['openai', 'openai_compatible']:
+            extra = {"seed": seed} if seed is not None else {}
+            response = await client_info['client'].chat.completions.create(
+                model=config['model_name'],
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_tok,
+                **extra
+            )
+            usage = response.usage
+            return Completion(
+                response.choices[0].message.content,
+                model_id,
+                prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+                completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+                cached_tokens=self._cached_prompt_tokens(usage)
+            )
+
+        elif client_info['type'] == 'ollama':
+            options = {
+                "temperature": temp,
+                "num_predict": max_tok
+            }
+            if seed is not None:
+                options["seed"] = seed
+            response = await client_info['client'].post(
+                "/api/chat",
+                json={
+                    "model": config['model_name'],
+                    "messages": messages,
+                    "stream": False,
+                    "options": options
+                }
+            )
+            response.raise_for_status()
+            return self._ollama_completion(model_id, response.json())
+
+        elif client_info['type'] == 'mock':
+            return await self._mock_request(model_id, client_info, messages, max_tok, seed)
+
+    async def _request_batch(self,
+                             model_id: str,
+                             client_info: Dict,
+                             requests: List) -> List:
+        """
+        Send a batch of (messages, temp, max_tok, seed) requests in one call
+
+        Returns:
+            One Completion, or exception for a failed item, per request
+        """
+        if client_info['type'] == 'mock':
+            # Batched decoding: the batch finishes with its slowest member
+            results, longest = [], 0.0
+            for messages, _, max_tok, seed in requests:
+                try:
+                    text, prompt_tokens, completion_tokens, ttft, total = \
+                        client_info['client'].plan(messages, max_tok, seed)
+                except MockProviderError as e:
+                    results.append(e)
+                    continue
+                longest = max(longest, total)
+                results.append(Completion(text, model_id, prompt_tokens=prompt_tokens,
+                                          completion_tokens=completion_tokens, ttft=ttft))
+            await asyncio.sleep(longest)
+            return results
+
+        items = []
+        for messages, temp, max_tok, seed in requests:
+            options = {"temperature": temp, "num_predict": max_tok}
+            if seed is not None:
+                options["seed"] = seed
+            items.append({"messages": messages, "options": options})
+
+        response = await client_info['client'].post(
+            "/api/batch",
+            json={"model": client_info['config']['model_name'], "requests": items}
+        )
+        response.raise_for_status()
+        results = []
+        for result in response.json().get('responses', []):
+            if 'error' in result:
+                results.append(BatchItemError(result.get('status', 500), str(result['error'])))
+            else:
+                results.append(self._ollama_completion(model_id, result))
+        return results
+
+    @staticmethod
+    def _ollama_completion(model_id: str, result: Dict) -> Completion:
+        """Completion from one non-streamed Ollama /api/chat response body"""
+        # Ollama returns message as a dict with 'content' and optionally 'thinking'
+        message = result.get('message', {})
+        # Durations are reported in nanoseconds; load + prompt eval is the
+        # server-side time before the first generated token
+        ttft_ns = result.get('load_duration', 0) + result.get('prompt_eval_duration', 0)
+        return Completion(
+            message.get('content', ''),
+            model_id,
+            prompt_tokens=result.get('prompt_eval_count', 0),
+            completion_tokens=result.get('eval_count', 0),
+            ttft=ttft_ns / 1e9 if ttft_ns else None
+        )
+
+    async def _mock_request(self,
+                            model_id: str,
+                            client_info: Dict,
+                            messages: List[Dict[str, str]],
+                            max_tok: int,
+                            seed: Optional[int]) -> Completion:
+        """Simulated call: sleep for the planned latency and return canned text"""
+        text, prompt_tokens, completion_tokens, ttft, total = \
+            client_info['client'].plan(messages, max_tok, seed)
+        await asyncio.sleep(total)
+        return Completion(
+            text,
+            model_id,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            ttft=ttft
+        )
+
+    async def _stream_request(self,
+                              client_info: Dict,
+                              messages: List[Dict[str, str]],
+                              temp: float,
+                              max_tok: int,
+                              seed: Optional[int],
+                              usage: Dict) -> AsyncIterator[str]:
+        """
+        Stream one request from the provider, yielding non-empty text deltas
+
+        Token usage reported at the end of the stream is written into `usage`.
+        """
+        config = client_info['config']
+
+        if client_info['type'] in ['openai', 'openai_compatible']:
+            extra = {"seed": seed} if seed is not None else {}
+            if client_info['type'] == 'openai':
+                # OpenAI only reports usage for streams when asked to
+                extra["stream_options"] = {"include_usage": True}
+            stream = await client_info['client'].chat.completions.create(
+                model=config['model_name'],
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_tok,
+                stream=True,
+                **extra
+            )
+            try:
+                async for chunk in stream:
+                    if getattr(chunk, 'usage', None) is not None:
+                        usage.update(
+                            prompt_tokens=chunk.usage.prompt_tokens or 0,
+                            completion_tokens=chunk.usage.completion_tokens or 0,
+                            cached_tokens=self._cached_prompt_tokens(chunk.usage)
+                        )
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+
+        elif client_info['type'] == 'ollama':
+            options = {
+                "temperature": temp,
+                "num_predict": max_tok
+            }
+            if seed is not None:
+                options["seed"] = seed
+            async with client_info['client'].stream(
+                "POST",
+                "/api/chat",
+                json={
+                    "model": config['model_name'],
+                    "messages": messages,
+                    "stream": True,
+                    "options": options
+                }
+            ) as response:
+                response.raise_for_status()
+                # Newline-delimited JSON chunks; the last one has done=true and the counts
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('done'):
+                        usage.update(
+                            prompt_tokens=chunk.get('prompt_eval_count', 0),
+                            completion_tokens=chunk.get('eval_count', 0)
+                        )
+                    content = chunk.get('message', {}).get('content')
+                    if content:
+                        yield content
+
+        elif client_info['type'] == 'mock':
+            text, prompt_tokens, completion_tokens, ttft, _ = \
+                client_info['client'].plan(messages, max_tok, seed)
+            await asyncio.sleep(ttft)
+            delay = 1.0 / client_info['client'].tokens_per_second
+            for index, word in enumerate(re.findall(r'\S+\s*', text)):
+                if index:
+                    await asyncio.sleep(delay)
+                yield word
+            usage.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    async def aclose(self):
+        """Close pooled connections for all providers"""
+        for client_info in self.clients.values():
+            if client_info['type'] == 'ollama':
+                await client_info['client'].aclose()
+            elif client_info['type'] not in ('mock', 'replay'):
+                await client_info['client'].close()
+
+    def close(self):
+        """Close pooled connections, the response cache, traces and the client's event loop"""
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.replay is not None:
+            self.replay.close()
+        if self._loop is None:
+            return
+        self._run(self.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop = None
+
+    def batch_stats(self) -> Dict:
+        """Per-model micro-batching counters (empty if no model batches)"""
+        return {model_id: batcher.stats() for model_id, batcher in self.batchers.items()}
+
+    def trace_stats(self) -> Dict:
+        """Records written (record mode) or served and left (replay mode); empty when off"""
+        if self.recorder is not None:
+            return {"mode": "record", "path": str(self.recorder.path), "records": self.recorder.count}
+        if self.replay is not None:
+            return {"mode": "replay", "path": str(self.replay.path), "served": self.replay.served,
+                    "remaining": self.replay.remaining()}
+        return {}
+
+    def cache_stats(self) -> Dict:
+        """Return response cache hit/miss counters (empty if caching is disabled)"""
+        if self.cache is None:
+            return {}
+        return self.cache.stats()
 
     def get_available_models(self) -> List[str]:
-        """Return list of successfully initialized models"""
-        return list(self.clients.keys())
+        """Return list of models that can be used (clients are built on first use)"""
+        return list(self.model_configs)
 
     def test_connection(self, model_id: str) -> bool:
         """Test if model is accessible"""
@@ -136,6 +1230,67 @@ class LLMClient:
             print(f"Connection test failed for {model_id}: {str(e)}")
             return False
 
+    async def _ahealth_check(self, model_id: str, timeout: float) -> Dict:
+        """Probe one model's endpoint, see `health_check`"""
+        start = time.perf_counter()
+        try:
+            client_info = self._client(model_id)
+            ok, detail = await asyncio.wait_for(self._probe(client_info), timeout)
+        except asyncio.TimeoutError:
+            ok, detail = False, f"no response within {timeout:g}s"
+        except Exception as e:
+            ok, detail = False, str(e) or type(e).__name__
+        return {"ok": ok, "latency": round(time.perf_counter() - start, 4), "detail": detail}
+
+    @staticmethod
+    async def _probe(client_info: Dict):
+        """(ok, detail) from a provider's model listing; no tokens are generated"""
+        model_name = client_info['config']['model_name']
+
+        if client_info['type'] in ('mock', 'replay'):
+            return True, client_info['type']
+
+        if client_info['type'] == 'ollama':
+            response = await client_info['client'].get("/api/tags")
+            response.raise_for_status()
+            pulled = {m.get('name') for m in response.json().get('models', [])}
+            # Ollama lists untagged models as name:latest
+            if model_name in pulled or f"{model_name}:latest" in pulled:
+                return True, "model available"
+            return False, f"{model_name} not pulled (ollama pull {model_name})"
+
+        models = await client_info['client'].models.list()
+        listed = {m.id for m in models.data}
+        if model_name in listed:
+            return True, "model available"
+        # Some OpenAI-compatible servers list nothing or only aliases
+        if not listed:
+            return True, "endpoint reachable (no model list)"
+        return False, f"{model_name} not listed by {client_info['config'].get('base_url', 'provider')}"
+
+    def health_check(self, model_ids: Optional[List[str]] = None, timeout: float = 5.0) -> Dict[str, Dict]:
+        """
+        Check all endpoints concurrently through their cheap metadata routes
+
+        Ollama models are looked up in /api/tags, OpenAI-style providers in
+        the models list; mock and replay models always pass. Each probe is cut
+        off after `timeout` seconds, so a dead endpoint costs at most that long.
+
+        Args:
+            model_ids: Models to check (default: all available models)
+            timeout: Per-model timeout in seconds
+
+        Returns:
+            model_id -> {"ok": bool, "latency": seconds, "detail": str}
+        """
+        model_ids = self.get_available_models() if model_ids is None else model_ids
+
+        async def check_all():
+            results = await asyncio.gather(*(self._ahealth_check(m, timeout) for m in model_ids))
+            return dict(zip(model_ids, results))
+
+        return self._run(check_all())
+
 
 if __name__ == "__main__":
     # Test script
@@ -144,9 +1299,7 @@ if __name__ == "__main__":
 
     print(f"\nAvailable models: {client.get_available_models()}")
 
-    for model_id in client.get_available_models():
-        print(f"\nTesting {model_id}...")
-        if client.test_connection(model_id):
-            print(f"✓ {model_id} is working")
-        else:
-            print(f"✗ {model_id} failed")
+    for model_id, result in client.health_check().items():
+        mark = "✓" if result["ok"] else "✗"
+        print(f"{mark} {model_id} ({result['latency'] * 1000:.0f} ms): {result['detail']}")
+    client.close()
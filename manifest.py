@@ -0,0 +1,71 @@
+"""
+Run manifests - seeds, config and prompt hashes for reproducible simulation runs
+"""
+
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def stable_hash(obj) -> str:
+    """SHA-256 of an object's canonical JSON form"""
+    canonical = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def dialogue_seed(run_seed: int, hadm_id: str, patient_model: str) -> int:
+    """Per-dialogue seed derived from (run_seed, hadm_id, patient_model), fits in 31 bits"""
+    digest = hashlib.sha256(f"{run_seed}:{hadm_id}:{patient_model}".encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) & 0x7FFFFFFF
+
+
+class RunManifest:
+    """Records what one (split, patient model) run sent, so runs can be compared and resumed"""
+
+    def __init__(self,
+                 path: Path,
+                 config: Dict,
+                 run_seed: Optional[int],
+                 doctor_model: str,
+                 patient_model: str,
+                 split: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.data = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "config_hash": stable_hash(config),
+            "run_seed": run_seed,
+            "doctor_model": doctor_model,
+            "patient_model": patient_model,
+            "split": split,
+            "dialogues": {}
+        }
+
+    @staticmethod
+    def load_dialogues(path: Path) -> Dict[str, Dict]:
+        """Per-hadm_id entries of an existing manifest ({} if there is none)"""
+        path = Path(path)
+        if not path.exists():
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f).get('dialogues', {})
+
+    def update(self, dialogues: Dict[str, Dict]):
+        """Carry over entries from a previous manifest (e.g. when resuming)"""
+        with self._lock:
+            self.data['dialogues'].update(dialogues)
+
+    def add(self, hadm_id: str, seed: Optional[int], prompt_hash: str):
+        """Record one finished dialogue"""
+        with self._lock:
+            self.data['dialogues'][str(hadm_id)] = {"seed": seed, "prompt_hash": prompt_hash}
+
+    def save(self):
+        """Write the manifest next to the run's output"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            with open(self.path, 'w') as f:
+                json.dump(self.data, f, indent=2, sort_keys=True)
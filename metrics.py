@@ -0,0 +1,230 @@
+"""
+Call metrics for LLMClient - token usage, latency and errors per model and role
+"""
+
+import json
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+
+# Latency samples kept per (model, role) for percentile estimates
+MAX_SAMPLES = 10000
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of `samples` (q in [0, 1])"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class UsageTotals:
+    """Running token/latency totals for one agent in one dialogue"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.latency_s = 0.0
+
+    def add(self, completion):
+        """Accumulate one `Completion` from LLMClient"""
+        self.calls += 1
+        self.prompt_tokens += completion.prompt_tokens
+        self.completion_tokens += completion.completion_tokens
+        self.cached_tokens += completion.cached_tokens
+        self.latency_s += completion.latency
+
+    def to_dict(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "latency_s": round(self.latency_s, 3)
+        }
+
+
+class _Series:
+    """Aggregates for one (model, role) pair"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.latency_sum = 0.0
+        self.ttft_sum = 0.0
+        self.ttft_count = 0
+        self.latencies = deque(maxlen=MAX_SAMPLES)
+        self.ttfts = deque(maxlen=MAX_SAMPLES)
+        # Lower bounds from primaries cancelled when their hedge won; kept out of
+        # the latency summary, whose sum and count only cover completed calls
+        self.censored = deque(maxlen=MAX_SAMPLES)
+
+
+class MetricsRegistry:
+    """Thread-safe registry of LLM call metrics keyed by (model_id, role)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _get(self, model_id: str, role: Optional[str]) -> _Series:
+        key = (model_id, role or 'unknown')
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+        return series
+
+    def record(self,
+               model_id: str,
+               role: Optional[str],
+               prompt_tokens: int = 0,
+               completion_tokens: int = 0,
+               cached_tokens: int = 0,
+               latency: float = 0.0,
+               ttft: Optional[float] = None,
+               cache_hit: bool = False):
+        """Record one successful call"""
+        with self._lock:
+            series = self._get(model_id, role)
+            series.calls += 1
+            if cache_hit:
+                series.cache_hits += 1
+                return
+            series.prompt_tokens += prompt_tokens
+            series.completion_tokens += completion_tokens
+            series.cached_tokens += cached_tokens
+            series.latency_sum += latency
+            series.latencies.append(latency)
+            if ttft is not None:
+                series.ttft_sum += ttft
+                series.ttft_count += 1
+                series.ttfts.append(ttft)
+
+    def record_error(self, model_id: str, role: Optional[str]):
+        """Record one failed call (after retries)"""
+        with self._lock:
+            self._get(model_id, role).errors += 1
+
+    def record_hedge(self, model_id: str, role: Optional[str], won: bool, elapsed: Optional[float] = None):
+        """
+        Record a call that was hedged
+
+        Args:
+            won: The hedge answered first (the original request was cancelled)
+            elapsed: Time the cancelled original had run (a censored latency sample)
+        """
+        with self._lock:
+            series = self._get(model_id, role)
+            series.hedges += 1
+            if won:
+                series.hedge_wins += 1
+            if elapsed is not None:
+                series.censored.append(elapsed)
+
+    def latencies(self,
+                  model_id: str,
+                  role: Optional[str] = None,
+                  include_censored: bool = False) -> List[float]:
+        """
+        Recent latency samples for a model (all roles if `role` is None)
+
+        Args:
+            include_censored: Also return the elapsed times of cancelled hedged
+                primaries (lower bounds, for estimating the latency tail)
+        """
+        with self._lock:
+            samples = []
+            for (series_model, series_role), series in self._series.items():
+                if series_model == model_id and (role is None or series_role == role):
+                    samples.extend(series.latencies)
+                    if include_censored:
+                        samples.extend(series.censored)
+            return samples
+
+    def summary(self) -> List[Dict]:
+        """One row per (model, role) with totals and latency percentiles"""
+        with self._lock:
+            rows = []
+            for (model_id, role), series in sorted(self._series.items()):
+                latencies = list(series.latencies)
+                ttfts = list(series.ttfts)
+                requests = series.calls - series.cache_hits
+                rows.append({
+                    "model": model_id,
+                    "role": role,
+                    "calls": series.calls,
+                    "errors": series.errors,
+                    "cache_hits": series.cache_hits,
+                    "hedges": series.hedges,
+                    "hedge_wins": series.hedge_wins,
+                    "prompt_tokens": series.prompt_tokens,
+                    "completion_tokens": series.completion_tokens,
+                    "cached_tokens": series.cached_tokens,
+                    "prefix_cache_hit_rate": (series.cached_tokens / series.prompt_tokens
+                                              if series.prompt_tokens else None),
+                    "latency_mean_s": series.latency_sum / requests if requests else None,
+                    **{f"latency_p{int(q * 100)}_s": percentile(latencies, q) for q in QUANTILES},
+                    "ttft_mean_s": series.ttft_sum / series.ttft_count if series.ttft_count else None,
+                    **{f"ttft_p{int(q * 100)}_s": percentile(ttfts, q) for q in QUANTILES},
+                })
+            return rows
+
+    def to_json(self) -> str:
+        """Run-level summary as JSON"""
+        return json.dumps({"llm_calls": self.summary()}, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Run-level summary in Prometheus text exposition format"""
+        counters = [
+            ("calls", "LLM calls, including cache hits"),
+            ("errors", "LLM calls that failed after retries"),
+            ("cache_hits", "LLM calls served from the response cache"),
+            ("hedges", "LLM calls that got a hedge request"),
+            ("hedge_wins", "Hedged LLM calls answered by the hedge"),
+            ("prompt_tokens", "Prompt tokens sent"),
+            ("completion_tokens", "Completion tokens received"),
+            ("cached_tokens", "Prompt tokens served from the provider prefix cache"),
+        ]
+        rows = self.summary()
+        lines = []
+
+        for name, help_text in counters:
+            metric = f"patientsim_llm_{name}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for row in rows:
+                lines.append(f'{metric}{{model="{row["model"]}",role="{row["role"]}"}} {row[name]}')
+
+        with self._lock:
+            series_items = sorted(self._series.items())
+            for name, attr, total_attr, count_attr, help_text in [
+                ("latency_seconds", "latencies", "latency_sum", None, "End-to-end LLM call latency"),
+                ("ttft_seconds", "ttfts", "ttft_sum", "ttft_count", "Time to first token"),
+            ]:
+                metric = f"patientsim_llm_{name}"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} summary")
+                for (model_id, role), series in series_items:
+                    labels = f'model="{model_id}",role="{role}"'
+                    samples = list(getattr(series, attr))
+                    for q in QUANTILES:
+                        value = percentile(samples, q)
+                        lines.append(f'{metric}{{{labels},quantile="{q}"}} {value if value is not None else "NaN"}')
+                    count = getattr(series, count_attr) if count_attr else series.calls - series.cache_hits
+                    lines.append(f"{metric}_sum{{{labels}}} {getattr(series, total_attr)}")
+                    lines.append(f"{metric}_count{{{labels}}} {count}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,322 @@
+"""
+Offline mock LLM backend for benchmarks and tests
+Used in-process by LLMClient (provider: mock) and as a local HTTP stand-in
+speaking the OpenAI and Ollama chat protocols
+"""
+
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from token_utils import estimate_message_tokens
+
+
+WORDS = (
+    "pain started yesterday evening after dinner and it has been getting worse "
+    "I feel sick to my stomach sometimes the pain moves to my back I took some "
+    "medicine at home but it did not help much my wife told me to come here "
+    "tell me more about when it began have you had anything like this before "
+    "do you take any medications every day any allergies that you know of"
+).split()
+
+
+class MockProviderError(Exception):
+    """Injected provider failure; carries an HTTP status like a real API error"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Mock provider error {status_code}")
+        self.status_code = status_code
+
+
+class MockBackend:
+    """
+    Simulated model with configurable latency, token rate and error injection
+
+    Settings (all optional):
+        ttft_ms: median time to first token (default 200)
+        ttft_jitter: lognormal sigma applied to ttft (default 0.3, 0 = fixed)
+        tokens_per_second: generation rate after the first token (default 80)
+        completion_tokens: mean completion length in tokens (default 60)
+        error_rate: probability a call fails (default 0)
+        error_status: HTTP status used for injected errors (default 503)
+    """
+
+    def __init__(self, settings: Optional[Dict] = None):
+        settings = settings or {}
+        self.ttft_ms = settings.get('ttft_ms', 200)
+        self.ttft_jitter = settings.get('ttft_jitter', 0.3)
+        self.tokens_per_second = settings.get('tokens_per_second', 80)
+        self.completion_tokens = settings.get('completion_tokens', 60)
+        self.error_rate = settings.get('error_rate', 0.0)
+        self.error_status = settings.get('error_status', 503)
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+
+    def plan(self,
+             messages: List[Dict[str, str]],
+             max_tokens: int,
+             seed: Optional[int] = None) -> Tuple[str, int, int, float, float]:
+        """
+        Decide the outcome of one call without waiting
+
+        Returns:
+            (text, prompt_tokens, completion_tokens, ttft_s, total_s)
+
+        Raises:
+            MockProviderError: when an error is injected
+        """
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+            jitter = self._rng.lognormvariate(0, self.ttft_jitter) if self.ttft_jitter else 1.0
+        if failed:
+            raise MockProviderError(self.error_status)
+
+        # Text depends only on the request (and seed), so replays are stable
+        digest = hashlib.sha256(json.dumps([messages, seed], sort_keys=True).encode('utf-8')).digest()
+        rng = random.Random(digest)
+        n_tokens = max(1, min(max_tokens, int(rng.gauss(self.completion_tokens, self.completion_tokens / 4))))
+        words = [rng.choice(WORDS) for _ in range(n_tokens)]
+        text = " ".join(words).capitalize() + "."
+
+        ttft = self.ttft_ms / 1000.0 * jitter
+        total = ttft + n_tokens / self.tokens_per_second
+        return text, estimate_message_tokens(messages), n_tokens, ttft, total
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """OpenAI (/v1/chat/completions) and Ollama (/api/chat, plus /api/batch) chat endpoints"""
+
+    backend: MockBackend = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/api/tags':
+            self._send_json(200, {"models": [{"name": "mock:latest"}]})
+        elif self.path.rstrip('/') == '/v1/models':
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path.rstrip('/') == '/v1/chat/completions':
+            self._openai_chat(request)
+        elif self.path.rstrip('/') == '/api/chat':
+            self._ollama_chat(request)
+        elif self.path.rstrip('/') == '/api/batch':
+            self._ollama_batch(request)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _run(self, messages, max_tokens, seed, wait=True):
+        """Plan and (unless streaming) wait out one call; returns the plan or None after sending an error"""
+        try:
+            plan = self.backend.plan(messages, max_tokens, seed)
+        except MockProviderError as e:
+            self._send_json(e.status_code, {"error": {"message": str(e)}})
+            return None
+        if wait:
+            time.sleep(plan[4])
+        return plan
+
+    def _stream(self, plan, content_type: str, chunks):
+        """
+        Send the planned text word by word at the planned rate
+
+        Args:
+            plan: Result of MockBackend.plan
+            content_type: Response content type
+            chunks: Callable mapping (word, done) to the bytes sent for it
+        """
+        text, _, _, ttft, total = plan
+        words = re.findall(r'\S+\s*', text)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        time.sleep(ttft)
+        delay = (total - ttft) / max(1, len(words))
+        try:
+            for index, word in enumerate(words):
+                if index:
+                    time.sleep(delay)
+                self.wfile.write(chunks(word, False))
+                self.wfile.flush()
+            self.wfile.write(chunks('', True))
+        except (BrokenPipeError, ConnectionResetError):
+            # Client stopped reading (e.g. a stop condition fired)
+            pass
+
+    def _openai_chat(self, request: Dict):
+        streaming = request.get('stream', False)
+        plan = self._run(request.get('messages', []), request.get('max_tokens') or 2048,
+                         request.get('seed'), wait=not streaming)
+        if plan is None:
+            return
+        text, prompt_tokens, completion_tokens, _, _ = plan
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+        if streaming:
+            include_usage = (request.get('stream_options') or {}).get('include_usage', False)
+
+            def chunks(word, done):
+                if not done:
+                    chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                             "model": request.get('model', 'mock'),
+                             "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                    return f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+                tail = {"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                        "model": request.get('model', 'mock'),
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                if include_usage:
+                    tail["usage"] = usage
+                return f"data: {json.dumps(tail)}\n\ndata: [DONE]\n\n".encode('utf-8')
+
+            self._stream(plan, 'text/event-stream', chunks)
+            return
+
+        self._send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'mock'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def _ollama_chat(self, request: Dict):
+        options = request.get('options', {})
+        # Ollama streams unless told otherwise
+        streaming = request.get('stream', True)
+        plan = self._run(request.get('messages', []), options.get('num_predict') or 2048,
+                         options.get('seed'), wait=not streaming)
+        if plan is None:
+            return
+        text, prompt_tokens, completion_tokens, ttft, total = plan
+
+        if streaming:
+            def chunks(word, done):
+                chunk = {"model": request.get('model', 'mock'),
+                         "message": {"role": "assistant", "content": word},
+                         "done": done}
+                if done:
+                    chunk.update(prompt_eval_count=prompt_tokens, eval_count=completion_tokens)
+                return (json.dumps(chunk) + "\n").encode('utf-8')
+
+            self._stream(plan, 'application/x-ndjson', chunks)
+            return
+
+        self._send_json(200, {
+            "model": request.get('model', 'mock'),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": text},
+            "done": True,
+            "total_duration": int(total * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(ttft * 1e9),
+            "eval_count": completion_tokens,
+            "eval_duration": int((total - ttft) * 1e9)
+        })
+
+    def _ollama_batch(self, request: Dict):
+        """Non-standard batch endpoint: several /api/chat requests decoded together"""
+        responses, longest = [], 0.0
+        for item in request.get('requests', []):
+            options = item.get('options', {})
+            try:
+                text, prompt_tokens, completion_tokens, ttft, total = self.backend.plan(
+                    item.get('messages', []), options.get('num_predict') or 2048, options.get('seed'))
+            except MockProviderError as e:
+                responses.append({"error": str(e), "status": e.status_code})
+                continue
+            # The batch finishes with its slowest member
+            longest = max(longest, total)
+            responses.append({
+                "model": request.get('model', 'mock'),
+                "message": {"role": "assistant", "content": text},
+                "done": True,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(ttft * 1e9),
+                "eval_count": completion_tokens
+            })
+        time.sleep(longest)
+        self._send_json(200, {"responses": responses})
+
+
+def start_server(host: str = "127.0.0.1",
+                 port: int = 0,
+                 settings: Optional[Dict] = None) -> ThreadingHTTPServer:
+    """
+    Start the HTTP stand-in on a background thread
+
+    Args:
+        host: Bind address
+        port: Port (0 picks a free one; see server.server_address)
+        settings: MockBackend settings
+
+    Returns:
+        Running server; call shutdown() to stop it
+    """
+    handler = type('MockHandler', (_Handler,), {'backend': MockBackend(settings)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local mock LLM server (OpenAI + Ollama protocols)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--ttft-ms', type=float, default=200)
+    parser.add_argument('--tokens-per-second', type=float, default=80)
+    parser.add_argument('--completion-tokens', type=int, default=60)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, {
+        'ttft_ms': args.ttft_ms,
+        'tokens_per_second': args.tokens_per_second,
+        'completion_tokens': args.completion_tokens,
+        'error_rate': args.error_rate
+    })
+    print(f"Mock LLM server on http://{args.host}:{server.server_address[1]} "
+          f"(OpenAI: /v1/chat/completions, Ollama: /api/chat)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
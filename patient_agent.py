@@ -4,13 +4,24 @@ Patient Agent - Simulates patient with specific persona traits
 
 import random
 from typing import Dict, List, Optional
-from llm_client import LLMClient
+from llm_client import LLMClient, StopCondition
+from metrics import UsageTotals
+from context_policy import ContextPolicy, summary_messages
+from persona_templates import INTRO, RULES_BLOCK, PersonaTemplates, get_templates, vocabulary_table
 
 
 class PatientAgent:
     """Simulates a patient with persona-driven responses"""
 
-    def __init__(self, profile: Dict, model_id: str, llm_client: LLMClient):
+    def __init__(self,
+                 profile: Dict,
+                 model_id: str,
+                 llm_client: LLMClient,
+                 context_policy: Optional[ContextPolicy] = None,
+                 prompt_layout: str = 'legacy',
+                 seed: Optional[int] = None,
+                 stop_condition: Optional[StopCondition] = None,
+                 templates: Optional[PersonaTemplates] = None):
         """
         Initialize patient agent with profile and persona
 
@@ -18,11 +29,27 @@ class PatientAgent:
             profile: Patient profile dict from patient_profile.json
             model_id: LLM model to use (e.g., 'deepseek-api')
             llm_client: Initialized LLMClient instance
+            context_policy: History policy for each turn (defaults to full history)
+            prompt_layout: 'legacy', or 'cache_friendly' to put shared instructions
+                before per-patient data for provider prefix caching
+            seed: Per-dialogue seed for vocabulary sampling and provider sampling
+                (None = unseeded)
+            stop_condition: Stream replies and cut them at a turn boundary or
+                sentence limit (None = full non-streamed replies)
+            templates: Compiled persona instructions (defaults to the built-in text)
         """
         self.profile = profile
         self.model_id = model_id
         self.client = llm_client
         self.conversation_history = []
+        self.usage = UsageTotals()
+        # Hedge record of the last reply's LLM call (None if it was not hedged)
+        self.last_hedge = None
+        self.context_policy = context_policy or ContextPolicy()
+        self.prompt_layout = prompt_layout
+        self.seed = seed
+        self.stop_condition = stop_condition
+        self.templates = templates or get_templates()
 
         # Extract persona attributes
         self.cefr_level = profile.get('cefr', 'B')
@@ -35,128 +62,39 @@ class PatientAgent:
 
     def _build_system_prompt(self) -> str:
         """Build comprehensive system prompt based on patient profile and persona"""
-
-        # CEFR language level instructions
-        cefr_instructions = {
-            'A': "Use very simple English. Use short sentences (5-10 words). Use only basic vocabulary. Avoid complex grammar. Speak like a beginner English learner.",
-            'B': "Use everyday English. Use moderate sentence length (10-15 words). Use common vocabulary. Avoid very complex words. Speak like an intermediate English speaker.",
-            'C': "Use fluent English. Use varied sentence structures. Use sophisticated vocabulary when appropriate. Speak like an advanced English speaker."
-        }
-
-        # Personality instructions
-        personality_instructions = {
-            'plain': "Be cooperative and straightforward. Answer questions directly and honestly. Trust the doctor.",
-            'distrust': "Be somewhat guarded and suspicious. Question the doctor's recommendations. Show reluctance to share information immediately. Express doubts about treatments."
-        }
-
-        # Recall level instructions
-        recall_instructions = {
-            'low': "You have difficulty remembering details. Often say 'I don't remember' or 'I'm not sure' when asked about specifics. Provide vague timeframes.",
-            'medium': "You remember most important details but may forget minor specifics. Occasionally need prompting to recall information.",
-            'high': "You remember details clearly. Provide specific dates, times, and descriptions when asked."
-        }
-
-        # Dazed level instructions
-        dazed_instructions = {
-            'normal': "You are clear-headed and can follow the conversation well.",
-            'confused': "You are somewhat confused or disoriented. Occasionally lose track of the conversation. Ask the doctor to repeat questions. Mix up some details."
-        }
-
-        # Build medical vocabulary list for this CEFR level
-        vocab_keys = {
-            'A': ['med_A', 'cefr_A1', 'cefr_A2'],
-            'B': ['med_A', 'med_B', 'cefr_A1', 'cefr_A2', 'cefr_B1', 'cefr_B2'],
-            'C': ['med_A', 'med_B', 'med_C', 'cefr_A1', 'cefr_A2', 'cefr_B1', 'cefr_B2', 'cefr_C1', 'cefr_C2']
-        }
-
-        vocabulary = []
-        for key in vocab_keys.get(self.cefr_level, ['med_A']):
-            if key in self.profile:
-                vocab_list = self.profile[key]
-                if isinstance(vocab_list, str):
-                    vocabulary.extend(vocab_list.split(', '))
-
-        vocab_sample = random.sample(vocabulary, min(30, len(vocabulary)))
-
-        # Build comprehensive prompt
-        prompt = f"""You are simulating a patient visiting the emergency department. You must stay in character throughout the conversation.
-
-## PATIENT PROFILE
-
-**Demographics:**
-- Age: {self.profile.get('age')} years old
-- Gender: {self.profile.get('gender')}
-- Race: {self.profile.get('race')}
-- Marital Status: {self.profile.get('marital_status')}
-- Occupation: {self.profile.get('occupation')}
-- Living Situation: {self.profile.get('living_situation')}
-- Children: {self.profile.get('children', 'Not recorded')}
-
-**Chief Complaint:** {self.profile.get('chiefcomplaint')}
-**Pain Level:** {self.profile.get('pain')}/10
-**Diagnosis (DO NOT REVEAL):** {self.profile.get('diagnosis')}
-
-**Present Illness - Symptoms You Experience:**
-{self.profile.get('present_illness_positive', 'Not recorded')}
-
-**Symptoms You DO NOT Have:**
-{self.profile.get('present_illness_negative', 'Not recorded')}
-
-**Medical History:**
-{self.profile.get('medical_history', 'None reported')}
-
-**Current Medications:**
-{self.profile.get('medication', 'None')}
-
-**Allergies:**
-{self.profile.get('allergies', 'No known allergies')}
-
-**Social History:**
-- Tobacco: {self.profile.get('tobacco', 'Not recorded')}
-- Alcohol: {self.profile.get('alcohol', 'Not recorded')}
-- Drugs: {self.profile.get('illicit_drug', 'Not recorded')}
-- Exercise: {self.profile.get('exercise', 'Not recorded')}
-
-**Family History:**
-{self.profile.get('family_medical_history', 'Noncontributory')}
-
-## PERSONA ATTRIBUTES
-
-**Language Level (CEFR {self.cefr_level}):**
-{cefr_instructions.get(self.cefr_level, cefr_instructions['B'])}
-
-**Vocabulary to use:** {', '.join(vocab_sample[:20])}
-Avoid using complex medical terms unless you're CEFR level C.
-
-**Personality ({self.personality}):**
-{personality_instructions.get(self.personality, personality_instructions['plain'])}
-
-**Memory/Recall ({self.recall_level}):**
-{recall_instructions.get(self.recall_level, recall_instructions['medium'])}
-
-**Mental Clarity ({self.dazed_level}):**
-{dazed_instructions.get(self.dazed_level, dazed_instructions['normal'])}
-
-## IMPORTANT RULES
-
-1. **Stay in character:** Always respond as this specific patient would, based on their persona
-2. **Be realistic:** Respond naturally like a real patient would in an ED
-3. **Don't volunteer everything:** Let the doctor ask questions
-4. **Show emotions:** Express pain, worry, frustration as appropriate
-5. **Only reveal what you know:** Don't mention the diagnosis or information not in your profile
-6. **Use appropriate language:** Match your CEFR level consistently
-7. **Be consistent:** Don't contradict information you've already shared
-8. **Natural responses:** Use filler words, pauses, and natural speech patterns
-
-## RESPONSE FORMAT
-
-Respond ONLY with what the patient would say. Do not include:
-- Stage directions like "(coughs)" or "[looks worried]"
-- Explanations of why you're responding this way
-- Meta-commentary
-
-Just speak naturally as the patient.
-"""
+        templates = self.templates
+
+        # Vocabulary for this CEFR level (pre-split table shared across models)
+        vocabulary = vocabulary_table(self.profile, self.cefr_level)
+        rng = random.Random(self.seed) if self.seed is not None else random
+        vocab_sample = rng.sample(vocabulary, min(30, len(vocabulary)))
+
+        profile_block = templates.profile_block(self.profile)
+        language_block = templates.language_block(self.cefr_level)
+        traits_block = templates.traits_block(self.personality, self.recall_level, self.dazed_level)
+
+        vocab_block = f"""**Vocabulary to use:** {', '.join(vocab_sample[:20])}
+Avoid using complex medical terms unless you're CEFR level C."""
+
+        if self.prompt_layout == 'cache_friendly':
+            # Shared instructions first, then persona text (a handful of variants),
+            # then per-patient data, so providers can reuse the longest common prefix
+            blocks = [
+                INTRO,
+                RULES_BLOCK,
+                f"## PERSONA ATTRIBUTES\n\n{language_block}\n\n{traits_block}",
+                profile_block,
+                f"## VOCABULARY\n\n{vocab_block}\n"
+            ]
+        else:
+            blocks = [
+                INTRO,
+                profile_block,
+                f"## PERSONA ATTRIBUTES\n\n{language_block}\n\n{vocab_block}\n\n{traits_block}",
+                RULES_BLOCK
+            ]
+
+        prompt = "\n\n".join(blocks)
 
         return prompt
 
@@ -177,16 +115,24 @@ Just speak naturally as the patient.
         })
 
         # Build messages for LLM
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-            *self.conversation_history
-        ]
+        messages = self.context_policy.build_messages(
+            self.system_prompt,
+            self.conversation_history,
+            summarizer=self._summarize_history
+        )
 
         # Generate response
-        response = self.client.generate(
+        completion = self.client.complete(
             model_id=self.model_id,
-            messages=messages
+            messages=messages,
+            role='patient',
+            seed=self.seed,
+            stop=self.stop_condition
         )
+        self.usage.add(completion)
+        self.last_hedge = completion.hedge
+        # A cut reply may end in the whitespace before the stray turn prefix
+        response = completion.text.rstrip() if completion.stopped else completion.text
 
         # Add patient response to history (as assistant)
         self.conversation_history.append({
@@ -196,9 +142,22 @@ Just speak naturally as the patient.
 
         return response
 
+    def _summarize_history(self, previous_summary: str, evicted: List[Dict[str, str]]) -> str:
+        """Fold turns leaving the context window into the rolling summary"""
+        completion = self.client.complete(
+            model_id=self.model_id,
+            messages=summary_messages(previous_summary, evicted, speaker='Patient'),
+            max_tokens=self.context_policy.summary_max_tokens,
+            role='patient',
+            seed=self.seed
+        )
+        self.usage.add(completion)
+        return completion.text
+
     def reset_conversation(self):
         """Clear conversation history"""
         self.conversation_history = []
+        self.context_policy.reset()
 
     def get_metadata(self) -> Dict:
         """Return patient metadata for logging"""
@@ -211,5 +170,6 @@ Just speak naturally as the patient.
             "personality_type": self.personality,
             "recall_level_type": self.recall_level,
             "dazed_level_type": self.dazed_level,
-            "patient_engine_name": self.model_id
+            "patient_engine_name": self.model_id,
+            "patient_usage": self.usage.to_dict()
         }
@@ -0,0 +1,221 @@
+"""
+Persona prompt templates for PatientAgent - compiled once per instruction set
+"""
+
+import copy
+import json
+import threading
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+
+# Built-in persona instructions; override any entry with `persona.instructions` in config.yaml
+DEFAULT_INSTRUCTIONS = {
+    # CEFR language level instructions
+    'cefr': {
+        'A': "Use very simple English. Use short sentences (5-10 words). Use only basic vocabulary. Avoid complex grammar. Speak like a beginner English learner.",
+        'B': "Use everyday English. Use moderate sentence length (10-15 words). Use common vocabulary. Avoid very complex words. Speak like an intermediate English speaker.",
+        'C': "Use fluent English. Use varied sentence structures. Use sophisticated vocabulary when appropriate. Speak like an advanced English speaker."
+    },
+    # Personality instructions
+    'personality': {
+        'plain': "Be cooperative and straightforward. Answer questions directly and honestly. Trust the doctor.",
+        'distrust': "Be somewhat guarded and suspicious. Question the doctor's recommendations. Show reluctance to share information immediately. Express doubts about treatments."
+    },
+    # Recall level instructions
+    'recall': {
+        'low': "You have difficulty remembering details. Often say 'I don't remember' or 'I'm not sure' when asked about specifics. Provide vague timeframes.",
+        'medium': "You remember most important details but may forget minor specifics. Occasionally need prompting to recall information.",
+        'high': "You remember details clearly. Provide specific dates, times, and descriptions when asked."
+    },
+    # Dazed level instructions
+    'dazed': {
+        'normal': "You are clear-headed and can follow the conversation well.",
+        'confused': "You are somewhat confused or disoriented. Occasionally lose track of the conversation. Ask the doctor to repeat questions. Mix up some details."
+    }
+}
+
+# Fallback entry for persona values without an instruction
+DEFAULT_LEVELS = {'cefr': 'B', 'personality': 'plain', 'recall': 'medium', 'dazed': 'normal'}
+
+# Profile vocabulary fields offered at each CEFR level
+VOCAB_KEYS = {
+    'A': ('med_A', 'cefr_A1', 'cefr_A2'),
+    'B': ('med_A', 'med_B', 'cefr_A1', 'cefr_A2', 'cefr_B1', 'cefr_B2'),
+    'C': ('med_A', 'med_B', 'med_C', 'cefr_A1', 'cefr_A2', 'cefr_B1', 'cefr_B2', 'cefr_C1', 'cefr_C2')
+}
+
+INTRO = "You are simulating a patient visiting the emergency department. You must stay in character throughout the conversation."
+
+PROFILE_TEMPLATE = """## PATIENT PROFILE
+
+**Demographics:**
+- Age: {age} years old
+- Gender: {gender}
+- Race: {race}
+- Marital Status: {marital_status}
+- Occupation: {occupation}
+- Living Situation: {living_situation}
+- Children: {children}
+
+**Chief Complaint:** {chiefcomplaint}
+**Pain Level:** {pain}/10
+**Diagnosis (DO NOT REVEAL):** {diagnosis}
+
+**Present Illness - Symptoms You Experience:**
+{present_illness_positive}
+
+**Symptoms You DO NOT Have:**
+{present_illness_negative}
+
+**Medical History:**
+{medical_history}
+
+**Current Medications:**
+{medication}
+
+**Allergies:**
+{allergies}
+
+**Social History:**
+- Tobacco: {tobacco}
+- Alcohol: {alcohol}
+- Drugs: {illicit_drug}
+- Exercise: {exercise}
+
+**Family History:**
+{family_medical_history}"""
+
+# Profile fields in PROFILE_TEMPLATE and their defaults when missing (None = no default)
+PROFILE_FIELDS = {
+    'age': None,
+    'gender': None,
+    'race': None,
+    'marital_status': None,
+    'occupation': None,
+    'living_situation': None,
+    'children': 'Not recorded',
+    'chiefcomplaint': None,
+    'pain': None,
+    'diagnosis': None,
+    'present_illness_positive': 'Not recorded',
+    'present_illness_negative': 'Not recorded',
+    'medical_history': 'None reported',
+    'medication': 'None',
+    'allergies': 'No known allergies',
+    'tobacco': 'Not recorded',
+    'alcohol': 'Not recorded',
+    'illicit_drug': 'Not recorded',
+    'exercise': 'Not recorded',
+    'family_medical_history': 'Noncontributory'
+}
+
+RULES_BLOCK = """## IMPORTANT RULES
+
+1. **Stay in character:** Always respond as this specific patient would, based on their persona
+2. **Be realistic:** Respond naturally like a real patient would in an ED
+3. **Don't volunteer everything:** Let the doctor ask questions
+4. **Show emotions:** Express pain, worry, frustration as appropriate
+5. **Only reveal what you know:** Don't mention the diagnosis or information not in your profile
+6. **Use appropriate language:** Match your CEFR level consistently
+7. **Be consistent:** Don't contradict information you've already shared
+8. **Natural responses:** Use filler words, pauses, and natural speech patterns
+
+## RESPONSE FORMAT
+
+Respond ONLY with what the patient would say. Do not include:
+- Stage directions like "(coughs)" or "[looks worried]"
+- Explanations of why you're responding this way
+- Meta-commentary
+
+Just speak naturally as the patient.
+"""
+
+
+class PersonaTemplates:
+    """Persona instruction blocks rendered once per attribute combination"""
+
+    def __init__(self, instructions: Optional[Dict] = None):
+        """
+        Args:
+            instructions: Overrides for DEFAULT_INSTRUCTIONS, e.g.
+                {'cefr': {'A': '...'}, 'personality': {'anxious': '...'}}
+        """
+        self.instructions = copy.deepcopy(DEFAULT_INSTRUCTIONS)
+        for attribute, entries in (instructions or {}).items():
+            self.instructions.setdefault(attribute, {}).update(entries or {})
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def instruction(self, attribute: str, value: str) -> str:
+        """Instruction text for one persona attribute, falling back to its default level"""
+        entries = self.instructions[attribute]
+        return entries.get(value, entries[DEFAULT_LEVELS[attribute]])
+
+    def language_block(self, cefr_level: str) -> str:
+        return self._cached(('language', cefr_level), lambda: f"""**Language Level (CEFR {cefr_level}):**
+{self.instruction('cefr', cefr_level)}""")
+
+    def traits_block(self, personality: str, recall_level: str, dazed_level: str) -> str:
+        return self._cached(('traits', personality, recall_level, dazed_level), lambda: f"""**Personality ({personality}):**
+{self.instruction('personality', personality)}
+
+**Memory/Recall ({recall_level}):**
+{self.instruction('recall', recall_level)}
+
+**Mental Clarity ({dazed_level}):**
+{self.instruction('dazed', dazed_level)}""")
+
+    def _cached(self, key: Tuple, render) -> str:
+        block = self._blocks.get(key)
+        if block is None:
+            with self._lock:
+                block = self._blocks.setdefault(key, render())
+        return block
+
+    @staticmethod
+    def profile_block(profile: Dict) -> str:
+        fields = {name: profile.get(name, default) for name, default in PROFILE_FIELDS.items()}
+        return PROFILE_TEMPLATE.format_map(fields)
+
+
+# Compiled templates keyed by their instruction overrides
+_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_templates(instructions: Optional[Dict] = None) -> PersonaTemplates:
+    """Shared PersonaTemplates for an instruction set (compiled on first use)"""
+    key = json.dumps(instructions or {}, sort_keys=True)
+    templates = _REGISTRY.get(key)
+    if templates is None:
+        with _REGISTRY_LOCK:
+            templates = _REGISTRY.setdefault(key, PersonaTemplates(instructions))
+    return templates
+
+
+@lru_cache(maxsize=4096)
+def _split_vocabulary(values: Tuple[str, ...]) -> Tuple[str, ...]:
+    words = []
+    for value in values:
+        words.extend(value.split(', '))
+    return tuple(words)
+
+
+def vocabulary_table(profile: Dict, cefr_level: str) -> Tuple[str, ...]:
+    """
+    Vocabulary a patient may use at their CEFR level
+
+    The comma-separated profile fields are split once and cached, so every
+    model simulating the same patient in a sweep reuses the same table.
+    """
+    values = tuple(profile[key] for key in VOCAB_KEYS.get(cefr_level, ('med_A',))
+                   if isinstance(profile.get(key), str))
+    return _split_vocabulary(values)
+
+
+def clear_caches():
+    """Drop compiled templates and vocabulary tables (for benchmarks)"""
+    with _REGISTRY_LOCK:
+        _REGISTRY.clear()
+    _split_vocabulary.cache_clear()
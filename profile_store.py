@@ -0,0 +1,208 @@
+"""
+Patient profile store - indexed, lazily loaded access to patient_profile.json
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: concurrent builders then each build, but still write safely
+    fcntl = None
+
+
+# Bump when the cache layout changes so old caches are rebuilt
+CACHE_VERSION = 1
+
+
+def normalize_split(split) -> str:
+    """Canonical split name ('valid ' and 'Valid' both become 'valid')"""
+    return str(split or '').strip().lower()
+
+
+def file_sha256(path: Path) -> str:
+    """SHA-256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ProfileStore:
+    """
+    Read-only view of a patient profile JSON file
+
+    The first use builds a cache in `cache_dir`: a data file of
+    compressed records and a JSON index by hadm_id and normalized split.
+    Later runs read only the index and decode records on demand. The
+    cache is rebuilt when the source file's hash changes (the hash is only
+    recomputed when its size or mtime changes).
+
+    Several processes may open the same cache at once (parallel shards,
+    queue workers): builds are serialized by a lock file in `cache_dir`, and
+    every file is written under a unique temporary name before being
+    renamed into place.
+    """
+
+    def __init__(self, path: str, cache_dir: Optional[str] = None):
+        """
+        Open the store, building or refreshing its cache if needed
+
+        Args:
+            path: Patient profile JSON (a list of profile dicts)
+            cache_dir: Where the cache lives (default: next to the JSON file)
+        """
+        self.path = Path(path)
+        cache_dir = Path(cache_dir) if cache_dir else self.path.parent
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.data_path = cache_dir / f"{self.path.stem}.profiles.bin"
+        self.index_path = cache_dir / f"{self.path.stem}.profiles.idx.json"
+        self.lock_path = cache_dir / f"{self.path.stem}.profiles.lock"
+
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+        if self._index is None:
+            with self._build_lock():
+                # Another process may have built the cache while we waited
+                self._index = self._load_index() or self._build()
+        self._data = open(self.data_path, 'rb')
+
+    @contextmanager
+    def _build_lock(self):
+        """Exclusive lock on the cache across processes (held while building)"""
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _replace(self, target: Path, write):
+        """Write a file through a unique temp file in the same directory, then rename it over `target`"""
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=target.name + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _load_index(self) -> Optional[Dict]:
+        """Index of a cache that still matches the source file, else None"""
+        if not self.index_path.exists() or not self.data_path.exists():
+            return None
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return None
+        if index.get('version') != CACHE_VERSION:
+            return None
+
+        stat = self.path.stat()
+        if index['source_size'] == stat.st_size and index['source_mtime_ns'] == stat.st_mtime_ns:
+            return index
+
+        # Touched but maybe unchanged (e.g. a fresh checkout): compare content hashes
+        if index['source_sha256'] != file_sha256(self.path):
+            return None
+        index['source_size'] = stat.st_size
+        index['source_mtime_ns'] = stat.st_mtime_ns
+        self._write_index(index)
+        return index
+
+    def _build(self) -> Dict:
+        """Parse the source JSON once and write the record file and index"""
+        stat = self.path.stat()
+        source_hash = file_sha256(self.path)
+        with open(self.path, 'r') as f:
+            profiles = json.load(f)
+
+        offsets = []
+        by_id = {}
+        splits = {}
+
+        def write_records(out):
+            for position, profile in enumerate(profiles):
+                blob = zlib.compress(json.dumps(profile, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+                offsets.append([out.tell(), len(blob)])
+                out.write(blob)
+                by_id.setdefault(str(profile.get('hadm_id')), position)
+                splits.setdefault(normalize_split(profile.get('split')), []).append(position)
+        self._replace(self.data_path, write_records)
+
+        index = {
+            "version": CACHE_VERSION,
+            "source_sha256": source_hash,
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "offsets": offsets,
+            "by_id": by_id,
+            "splits": splits
+        }
+        self._write_index(index)
+        print(f"Indexed {len(offsets)} patient profiles into {self.data_path}")
+        return index
+
+    def _write_index(self, index: Dict):
+        encoded = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        self._replace(self.index_path, lambda f: f.write(encoded))
+
+    def _read(self, position: int) -> Dict:
+        """Decode one record from the data file"""
+        offset, length = self._index['offsets'][position]
+        with self._lock:
+            self._data.seek(offset)
+            blob = self._data.read(length)
+        return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+    @property
+    def source_sha256(self) -> str:
+        """Content hash of the source JSON the cache was built from"""
+        return self._index['source_sha256']
+
+    def __len__(self) -> int:
+        return len(self._index['offsets'])
+
+    def __iter__(self) -> Iterator[Dict]:
+        for position in range(len(self)):
+            yield self._read(position)
+
+    def get(self, hadm_id) -> Optional[Dict]:
+        """Profile with this hadm_id, or None"""
+        position = self._index['by_id'].get(str(hadm_id))
+        return self._read(position) if position is not None else None
+
+    def split_counts(self) -> Dict[str, int]:
+        """Number of profiles per normalized split"""
+        return {split: len(positions) for split, positions in self._index['splits'].items()}
+
+    def iter_split(self, split: str, limit: Optional[int] = None) -> Iterator[Dict]:
+        """Profiles in a split (matched after normalization), in file order"""
+        positions = self._index['splits'].get(normalize_split(split), [])
+        if limit:
+            positions = positions[:limit]
+        for position in positions:
+            yield self._read(position)
+
+    def load_split(self, split: str, limit: Optional[int] = None) -> List[Dict]:
+        """Like `iter_split`, but as a list"""
+        return list(self.iter_split(split, limit))
+
+    def close(self):
+        self._data.close()
@@ -0,0 +1,61 @@
+"""
+Token-bucket rate limiting for LLM providers
+Limits are per model and shared by every caller on the client's event loop
+"""
+
+import time
+import asyncio
+from typing import Optional
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at a per-minute rate"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        """Wait until `amount` tokens are available, then take them"""
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float):
+        """Charge (positive) or refund (negative) tokens after the fact; may go into debt"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one model"""
+
+    def __init__(self,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, estimated_tokens: int):
+        """Wait for one request slot and `estimated_tokens` of token budget"""
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(estimated_tokens)
+
+    def record_usage(self, actual_tokens: int, estimated_tokens: int):
+        """Correct the token budget once the real usage is known"""
+        if self.tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
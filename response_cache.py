@@ -0,0 +1,137 @@
+"""
+Persistent response cache for LLMClient
+Content-addressed SQLite store with LRU eviction and optional TTL
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+
+# Re-read the exact row count after this many inserts (other processes may share the file)
+COUNT_SYNC_EVERY = 1000
+
+
+class ResponseCache:
+    """On-disk cache of LLM responses keyed by a stable hash of the request"""
+
+    def __init__(self,
+                 path: str,
+                 max_entries: int = 100000,
+                 ttl_seconds: Optional[float] = None):
+        """
+        Open (or create) a response cache
+
+        Args:
+            path: SQLite database file
+            max_entries: Size cap; least recently used entries are evicted beyond it
+            ttl_seconds: Entries older than this are treated as misses (None = never expire)
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)"
+        )
+        # Row count kept in memory so inserts don't scan the table
+        self._count = len(self)
+        self._inserts_since_sync = 0
+
+    @staticmethod
+    def make_key(request: Dict) -> str:
+        """Stable SHA-256 of a request dict (model, messages, sampling params)"""
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for `key`, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                deleted = self._conn.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+                self._count = max(0, self._count - deleted)
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str):
+        """Store a response and evict least recently used entries over the cap"""
+        now = time.time()
+        with self._lock:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO responses (key, response, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            ).rowcount
+            if not inserted:
+                self._conn.execute(
+                    "UPDATE responses SET response = ?, created_at = ?, accessed_at = ? WHERE key = ?",
+                    (response, now, now, key)
+                )
+                return
+
+            self._count += 1
+            self._inserts_since_sync += 1
+            if self._inserts_since_sync >= COUNT_SYNC_EVERY:
+                self._count = len(self)
+                self._inserts_since_sync = 0
+
+            excess = self._count - self.max_entries
+            if excess > 0:
+                evicted = self._conn.execute(
+                    "DELETE FROM responses WHERE key IN"
+                    " (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                    (excess,)
+                ).rowcount
+                self._count -= evicted
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._count = 0
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            size = len(self)
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
+
+    def close(self):
+        """Close the underlying database"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,309 @@
+"""
+Streaming reader for sentence-level label files (sentence_label_*.json)
+Files are shaped hadm_id -> utterance -> sentence -> step results; records are
+yielded one sentence at a time without loading the whole document
+"""
+
+import json
+import argparse
+from typing import Dict, Iterator, Tuple
+
+try:
+    import ijson
+except ImportError:
+    # ijson is optional; fall back to incremental json.raw_decode
+    ijson = None
+
+
+# Flat record columns and their types; missing integer values are stored as -1
+COLUMNS = [
+    ("hadm_id", str),
+    ("utterance_index", int),
+    ("utterance", str),
+    ("sentence_index", int),
+    ("sentence", str),
+    ("sentence_id", str),
+    ("step0", str),             # step0 prediction ('information', ...)
+    ("categories", str),        # step1-1 categories predicted related, ';'-joined
+    ("unsupported", int),       # step1-2 prediction (1 = not supported by the profile)
+    ("plausibility", int),      # step2-1 likelihood rating
+    ("num_entail", int),        # step2-2 items with a non-zero entailment prediction
+    ("num_contradict", int),    # step2-2 items predicted as contradictions (-1)
+    ("step2_2", str),           # JSON list of non-zero step2-2 items {profile, entailment_prediction}
+]
+
+MISSING = -1
+
+READ_CHUNK = 1 << 16
+
+
+class _IncrementalReader:
+    """Walks nested JSON objects from a file, decoding leaf values with raw_decode"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(READ_CHUNK)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Next non-whitespace character ('' at end of file)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in label file, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof or not self._fill():
+                    raise
+                continue
+            # A number could continue in the next chunk
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def keys(self) -> Iterator[str]:
+        """Iterate an object's keys; the caller consumes each value before the next key"""
+        self._expect('{')
+        while True:
+            char = self._peek()
+            if char == '}':
+                self.pos += 1
+                return
+            if char == ',':
+                self.pos += 1
+                continue
+            key = self.value()
+            self._expect(':')
+            yield key
+
+
+def _iter_fallback(f) -> Iterator[Tuple[str, str, str, Dict]]:
+    reader = _IncrementalReader(f)
+    for hadm_id in reader.keys():
+        for utterance in reader.keys():
+            for sentence in reader.keys():
+                yield hadm_id, utterance, sentence, reader.value()
+
+
+def _iter_ijson(f) -> Iterator[Tuple[str, str, str, Dict]]:
+    # Keys (utterances, sentences) contain dots, so track depth from events
+    # rather than relying on ijson's dotted prefixes
+    events = ijson.basic_parse(f)
+    depth = 0
+    hadm_id = utterance = None
+    for event, value in events:
+        if event == 'start_map':
+            depth += 1
+        elif event == 'end_map':
+            depth -= 1
+        elif event == 'map_key':
+            if depth == 1:
+                hadm_id = value
+            elif depth == 2:
+                utterance = value
+            elif depth == 3:
+                yield hadm_id, utterance, value, _build_value(events)
+
+
+def _build_value(events):
+    """Assemble the next complete value from an ijson event stream"""
+    builder = ijson.ObjectBuilder()
+    nesting = 0
+    for event, value in events:
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            nesting += 1
+        elif event in ('end_map', 'end_array'):
+            nesting -= 1
+        if nesting == 0:
+            return builder.value
+
+
+def iter_sentence_results(path: str) -> Iterator[Tuple[str, str, str, Dict]]:
+    """Yield (hadm_id, utterance, sentence, step results) in file order"""
+    if ijson is not None:
+        with open(path, 'rb') as f:
+            yield from _iter_ijson(f)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from _iter_fallback(f)
+
+
+def flatten_sentence(hadm_id: str,
+                     utterance_index: int,
+                     utterance: str,
+                     sentence_index: int,
+                     sentence: str,
+                     result: Dict) -> Dict:
+    """
+    One flat record (see COLUMNS) from a sentence's step results
+
+    Handles both model label files and sentence_label_manual.json, where
+    step0 is a plain label, step1 lists categories (plus 'unsupported') and
+    step2-2 maps categories to 'e' (entailed) or 'c' (contradicted).
+    """
+    if isinstance(result.get("step0"), dict):
+        step0 = result["step0"].get("prediction", "")
+        related = [s["category"] for s in result.get("step1-1", []) if int(s["prediction"]) == 1]
+        step1_2 = result.get("step1-2")
+        unsupported = int(step1_2.get("prediction", 0)) if step1_2 is not None else MISSING
+        entailments = [{"profile": item.get("profile"), "entailment_prediction": item["entailment_prediction"]}
+                       for item in result.get("step2-2", []) if item.get("entailment_prediction", 0) != 0]
+    else:
+        step0 = result.get("step0", "")
+        related = [c for c in result.get("step1", []) if c != "unsupported"]
+        unsupported = int("unsupported" in result.get("step1", [])) if "step1" in result else MISSING
+        entailments = [{"profile": key, "entailment_prediction": 1 if label == "e" else -1}
+                       for key, label in result.get("step2-2", {}).items()]
+
+    step2_1 = result.get("step2-1")
+    return {
+        "hadm_id": str(hadm_id),
+        "utterance_index": utterance_index,
+        "utterance": utterance,
+        "sentence_index": sentence_index,
+        "sentence": sentence,
+        "sentence_id": result.get("sentence_id", ""),
+        "step0": step0,
+        "categories": ";".join(related),
+        "unsupported": unsupported,
+        "plausibility": int(step2_1.get("likelihood_rating", MISSING)) if step2_1 is not None else MISSING,
+        "num_entail": len(entailments),
+        "num_contradict": sum(1 for item in entailments if item["entailment_prediction"] == -1),
+        "step2_2": json.dumps(entailments, ensure_ascii=False),
+    }
+
+
+def iter_sentence_records(path: str) -> Iterator[Dict]:
+    """Yield flat sentence records from a label file, one at a time"""
+    last_hadm_id = last_utterance = None
+    utterance_index = sentence_index = -1
+    for hadm_id, utterance, sentence, result in iter_sentence_results(path):
+        if hadm_id != last_hadm_id:
+            last_hadm_id, last_utterance = hadm_id, None
+            utterance_index = -1
+        if utterance != last_utterance:
+            last_utterance = utterance
+            utterance_index += 1
+            sentence_index = -1
+        sentence_index += 1
+        yield flatten_sentence(hadm_id, utterance_index, utterance, sentence_index, sentence, result)
+
+
+def write_parquet(records: Iterator[Dict], out_path: str, batch_size: int = 10000) -> int:
+    """Stream records into a Parquet file in row groups; returns the record count"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, pa.string() if kind is str else pa.int64()) for name, kind in COLUMNS])
+    count = 0
+    with pq.ParquetWriter(out_path, schema) as writer:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+
+def write_npz(records: Iterator[Dict], out_path: str) -> int:
+    """Collect records column-wise into a compressed NPZ file; returns the record count"""
+    import numpy as np
+
+    columns = {name: [] for name, _ in COLUMNS}
+    for record in records:
+        for name in columns:
+            columns[name].append(record[name])
+
+    arrays = {name: np.array(values, dtype=np.str_ if kind is str else np.int64)
+              for (name, kind), values in zip(COLUMNS, columns.values())}
+    np.savez_compressed(out_path, **arrays)
+    return len(columns["hadm_id"])
+
+
+def write_columnar(records: Iterator[Dict], out_path: str) -> int:
+    """Write records as Parquet (.parquet) or NPZ (.npz), chosen by extension"""
+    if out_path.endswith('.parquet'):
+        return write_parquet(records, out_path)
+    if out_path.endswith('.npz'):
+        return write_npz(records, out_path)
+    raise ValueError(f"Unsupported output format: {out_path} (use .parquet or .npz)")
+
+
+def load_columnar(path: str):
+    """Read a file written by `write_columnar` back as a pandas DataFrame"""
+    import pandas as pd
+
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    import numpy as np
+    with np.load(path) as data:
+        return pd.DataFrame({name: data[name] for name, _ in COLUMNS})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream a sentence-level label file into flat records')
+    parser.add_argument('label_files', nargs='+', help='sentence_label_*.json files')
+    parser.add_argument('--out', nargs='*', help='Output .parquet/.npz per input file')
+    args = parser.parse_args()
+
+    if args.out and len(args.out) != len(args.label_files):
+        parser.error("--out needs one path per label file")
+
+    for index, path in enumerate(args.label_files):
+        stats = {"sentences": 0, "information": 0, "unsupported": 0, "contradicting": 0}
+
+        def counted(records: Iterator[Dict]) -> Iterator[Dict]:
+            for record in records:
+                stats["sentences"] += 1
+                stats["information"] += record["step0"] == "information"
+                stats["unsupported"] += record["unsupported"] == 1
+                stats["contradicting"] += record["num_contradict"] > 0
+                yield record
+
+        records = counted(iter_sentence_records(path))
+        if args.out:
+            write_columnar(records, args.out[index])
+            print(f"Wrote {args.out[index]}")
+        else:
+            for _ in records:
+                pass
+
+        print(f"{path}: {stats['sentences']} sentences, {stats['information']} informative, "
+              f"{stats['unsupported']} unsupported, {stats['contradicting']} with contradictions")
+
+
+if __name__ == "__main__":
+    main()
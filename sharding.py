@@ -0,0 +1,275 @@
+"""
+Sharded simulation runs - static hadm_id shards, a shared-filesystem work queue,
+and merging per-shard output back into the canonical llm_dialogue.jsonl
+"""
+
+import os
+import re
+import json
+import time
+import socket
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from checkpoint import dialogue_key
+
+
+# Per-shard output and manifest names inside a split directory
+SHARD_OUTPUT = "llm_dialogue.shard-{tag}.jsonl"
+SHARD_MANIFEST = "run_manifest.shard-{tag}.json"
+
+# Claims older than this are considered abandoned by a crashed worker
+DEFAULT_LEASE_SECONDS = 1800
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """'2/8' -> (2, 8); shards are numbered 0..N-1"""
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}: expected i/N, e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {spec!r}: need 0 <= i < N")
+    return index, count
+
+
+def shard_of(hadm_id, num_shards: int) -> int:
+    """Stable shard of a hadm_id (same on every machine and Python version)"""
+    digest = hashlib.sha256(str(hadm_id).encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % num_shards
+
+
+def worker_tag() -> str:
+    """Output tag for a queue worker: host and pid"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    Work queue over lock files in a shared directory
+
+    A worker claims a hadm_id by creating `<id>.claim` with O_EXCL, which
+    only one process can do (also over NFS). Finished dialogues get a
+    `<id>.done` marker so later workers skip them; failed ones release their
+    claim so another worker can retry. While a worker holds claims, a
+    heartbeat thread refreshes their mtimes every third of the lease, so a
+    claim older than `lease_seconds` means its worker died; it is taken over
+    so the item is not lost. Call `close` when done with the queue.
+    """
+
+    def __init__(self, directory: Path, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.owner = worker_tag()
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _path(self, hadm_id, suffix: str) -> Path:
+        return self.directory / f"{hadm_id}.{suffix}"
+
+    def is_done(self, hadm_id) -> bool:
+        return self._path(hadm_id, 'done').exists()
+
+    def claim(self, hadm_id) -> bool:
+        """Try to take an item; False if it is done or another worker holds it"""
+        if self.is_done(hadm_id):
+            return False
+        claim = self._path(hadm_id, 'claim')
+        for _ in range(2):
+            try:
+                fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._take_over(claim):
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"owner": self.owner, "claimed_at": time.time()}, f)
+            # Another worker may have finished it between the check and the claim
+            if self.is_done(hadm_id):
+                self.release(hadm_id)
+                return False
+            self._hold(claim)
+            return True
+        return False
+
+    def _hold(self, claim: Path):
+        """Keep a claim's lease alive until it is released"""
+        with self._held_lock:
+            self._held.add(claim)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name="work-queue-heartbeat", daemon=True)
+                self._heartbeat.start()
+
+    def _beat(self):
+        """Refresh the mtime of every held claim until `close`"""
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._held_lock:
+                held = list(self._held)
+            for claim in held:
+                try:
+                    os.utime(claim)
+                except FileNotFoundError:
+                    # Taken over after missing heartbeats (e.g. the process was suspended)
+                    with self._held_lock:
+                        if claim in self._held:
+                            self._held.discard(claim)
+                            print(f"Warning: lost claim {claim.name}; another worker may generate it too")
+
+    def _take_over(self, claim: Path) -> bool:
+        """Remove an expired claim; only one of several racing workers succeeds"""
+        try:
+            age = time.time() - claim.stat().st_mtime
+        except FileNotFoundError:
+            return True
+        if age < self.lease_seconds:
+            return False
+        stale = claim.with_name(f"{claim.name}.stale-{self.owner}")
+        try:
+            os.rename(claim, stale)
+        except FileNotFoundError:
+            return False
+        stale.unlink()
+        print(f"Taking over expired claim {claim.name}")
+        return True
+
+    def complete(self, hadm_id):
+        """Mark an item finished (after its dialogue has been written)"""
+        self._path(hadm_id, 'done').write_text(self.owner)
+        self.release(hadm_id)
+
+    def release(self, hadm_id):
+        """Give up a claim so another worker can retry the item"""
+        claim = self._path(hadm_id, 'claim')
+        with self._held_lock:
+            self._held.discard(claim)
+        try:
+            claim.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """Stop the heartbeat; claims still held expire after the lease"""
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+
+
+def _read_records(path: Path) -> List[Dict]:
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Truncated last line from a crashed shard
+                continue
+    return records
+
+
+def merge_shards(split_dir: Path, profile_order: List[str], remove_shards: bool = False) -> Dict:
+    """
+    Merge a split directory's shard outputs into llm_dialogue.jsonl
+
+    Records from an existing llm_dialogue.jsonl come first, then shards in
+    name order. Duplicate dialogues (same hadm_id, patient and doctor model)
+    are kept once; duplicates whose turns differ are reported as conflicts
+    and the first copy wins. Output follows `profile_order` (the split's
+    profile order, as a single-process run writes it). Shard manifests are
+    merged into run_manifest.json the same way.
+
+    Args:
+        split_dir: {split}_test/llm_simulation/{patient_model} directory
+        profile_order: hadm_ids of the split in profile order
+        remove_shards: Delete shard files after a successful merge
+
+    Returns:
+        Counts: dialogues, shards, duplicates, conflicts, misplaced, missing, unknown
+    """
+    split_dir = Path(split_dir)
+    output_file = split_dir / "llm_dialogue.jsonl"
+    shard_files = sorted(split_dir.glob(SHARD_OUTPUT.format(tag='*')))
+    sources = ([output_file] if output_file.exists() else []) + shard_files
+
+    merged = {}
+    duplicates = conflicts = misplaced = 0
+    for source in sources:
+        # A static shard file must only hold its own hadm_ids (catches runs with different N)
+        shard = re.match(r'llm_dialogue\.shard-(\d+)-of-(\d+)', source.name)
+        for record in _read_records(source):
+            key = dialogue_key(record)
+            if shard and shard_of(key[0], int(shard.group(2))) != int(shard.group(1)):
+                misplaced += 1
+                print(f"Warning: hadm_id {key[0]} in {source.name} does not belong to that shard")
+            if key not in merged:
+                merged[key] = record
+                continue
+            duplicates += 1
+            if merged[key].get('dialog_history') != record.get('dialog_history'):
+                conflicts += 1
+                print(f"Conflict: hadm_id {key[0]} differs between shards, keeping the first copy ({source.name})")
+
+    position = {str(hadm_id): index for index, hadm_id in enumerate(profile_order)}
+    unknown = sorted({key[0] for key in merged if key[0] not in position})
+    if unknown:
+        print(f"{len(unknown)} dialogues are not in this split's profiles: {', '.join(unknown[:5])}")
+    records = sorted(merged.values(), key=lambda r: (position.get(str(r.get('hadm_id')), len(position)),
+                                                     dialogue_key(r)))
+    found = {key[0] for key in merged}
+    missing = [hadm_id for hadm_id in position if hadm_id not in found]
+
+    tmp_path = output_file.with_name(output_file.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_file)
+
+    manifest_files = sorted(split_dir.glob(SHARD_MANIFEST.format(tag='*')))
+    _merge_manifests(split_dir / "run_manifest.json", manifest_files)
+
+    if remove_shards:
+        for path in shard_files + manifest_files:
+            path.unlink()
+
+    return {
+        "dialogues": len(records),
+        "shards": len(shard_files),
+        "duplicates": duplicates,
+        "conflicts": conflicts,
+        "misplaced": misplaced,
+        "missing": len(missing),
+        "unknown": len(unknown)
+    }
+
+
+def _merge_manifests(manifest_path: Path, shard_manifests: List[Path]):
+    """Union the dialogue entries of shard manifests into the split's manifest"""
+    if not shard_manifests:
+        return
+    paths = ([manifest_path] if manifest_path.exists() else []) + shard_manifests
+    merged = None
+    for path in paths:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if merged is None:
+            merged = data
+            continue
+        for field in ('config_hash', 'run_seed', 'doctor_model'):
+            if data.get(field) != merged.get(field):
+                print(f"Warning: {path.name} has a different {field} than {paths[0].name}")
+        for hadm_id, entry in data.get('dialogues', {}).items():
+            merged['dialogues'].setdefault(hadm_id, entry)
+
+    tmp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(merged, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
@@ -0,0 +1,214 @@
+"""
+Interview termination policies - decide when a doctor-patient dialogue is finished
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+# Marker the doctor is asked to append to its final message (completion_signal)
+COMPLETE_SIGNAL = "[INTERVIEW_COMPLETE]"
+
+SIGNAL_INSTRUCTION = (
+    "## ENDING THE INTERVIEW\n\n"
+    "When you have gathered enough information and have summarized your findings and "
+    f"explained next steps, end that final message with {COMPLETE_SIGNAL}. "
+    "Do not use it before then."
+)
+
+# Doctor phrases that close an interview (only counted in messages that ask nothing)
+CLOSING_PHRASES = [
+    "take care",
+    "goodbye",
+    "good-bye",
+    "get well soon",
+    "feel better soon",
+    "that concludes",
+    "that's all the questions",
+    "that is all the questions",
+    "i have no further questions",
+    "i don't have any more questions",
+]
+
+# Patient phrases that take leave
+FAREWELL_PHRASES = [
+    "goodbye",
+    "good-bye",
+    "bye",
+    "see you later",
+    "see you soon",
+]
+
+# Termination reasons recorded in dialogue output
+REASONS = ("max_turns", "doctor_signal", "closing", "farewell", "repeated_questions", "patient_disengaged")
+
+
+def _phrase_pattern(phrases: List[str]) -> Optional[re.Pattern]:
+    if not phrases:
+        return None
+    return re.compile(r"\b(?:" + "|".join(re.escape(p.lower()) for p in phrases) + r")\b")
+
+
+def _normalize(text: str) -> str:
+    return text.lower().replace("’", "'")
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", _normalize(text))
+
+
+def _questions(text: str) -> List[frozenset]:
+    """Word sets of each question sentence in a message"""
+    sentences = re.findall(r"[^.!?]*\?", text)
+    return [words for words in (frozenset(_words(s)) for s in sentences) if words]
+
+
+def _similar(a: frozenset, b: frozenset, threshold: float) -> bool:
+    return len(a & b) / len(a | b) >= threshold
+
+
+class TerminationPolicy:
+    """
+    Decides after each patient reply whether the interview is over
+
+    Modes:
+        max_turns: run until `max_turns` patient replies (original behaviour)
+        adaptive: also stop early, once `min_turns` replies are in, when
+            - the doctor gave the structured completion signal (`completion_signal`)
+            - the doctor's last message closes the interview (`closing_phrases`)
+              without asking another question
+            - the patient takes leave (`farewell_phrases`)
+            - the doctor's last `max_repeated_questions` messages only re-asked
+              questions it had already asked
+            - the patient's last `disengaged_turns` replies were at most
+              `disengaged_max_words` words long
+
+    Policies hold no per-dialogue state and can be shared between dialogues.
+    """
+
+    def __init__(self,
+                 mode: str = 'max_turns',
+                 min_turns: int = 4,
+                 completion_signal: bool = False,
+                 closing_phrases: Optional[List[str]] = None,
+                 farewell_phrases: Optional[List[str]] = None,
+                 max_repeated_questions: Optional[int] = 2,
+                 question_similarity: float = 0.8,
+                 disengaged_turns: Optional[int] = 3,
+                 disengaged_max_words: int = 2):
+        if mode not in ('max_turns', 'adaptive'):
+            raise ValueError(f"Unknown termination policy: {mode}")
+
+        self.mode = mode
+        self.min_turns = min_turns
+        self.completion_signal = completion_signal and mode == 'adaptive'
+        self.closing_phrases = CLOSING_PHRASES if closing_phrases is None else closing_phrases
+        self.farewell_phrases = FAREWELL_PHRASES if farewell_phrases is None else farewell_phrases
+        self.max_repeated_questions = max_repeated_questions
+        self.question_similarity = question_similarity
+        self.disengaged_turns = disengaged_turns
+        self.disengaged_max_words = disengaged_max_words
+
+        self._closing = _phrase_pattern(self.closing_phrases)
+        self._farewell = _phrase_pattern(self.farewell_phrases)
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict]) -> 'TerminationPolicy':
+        """Build a policy from the `termination:` section of config.yaml"""
+        config = config or {}
+        return cls(
+            mode=config.get('policy', 'max_turns'),
+            min_turns=config.get('min_turns', 4),
+            completion_signal=config.get('completion_signal', False),
+            closing_phrases=config.get('closing_phrases'),
+            farewell_phrases=config.get('farewell_phrases'),
+            max_repeated_questions=config.get('max_repeated_questions', 2),
+            question_similarity=config.get('question_similarity', 0.8),
+            disengaged_turns=config.get('disengaged_turns', 3),
+            disengaged_max_words=config.get('disengaged_max_words', 2)
+        )
+
+    def describe(self) -> Dict:
+        """Policy settings for output metadata"""
+        if self.mode == 'max_turns':
+            return {"policy": "max_turns"}
+        return {
+            "policy": self.mode,
+            "min_turns": self.min_turns,
+            "completion_signal": self.completion_signal,
+            "closing_phrases": self.closing_phrases,
+            "farewell_phrases": self.farewell_phrases,
+            "max_repeated_questions": self.max_repeated_questions,
+            "question_similarity": self.question_similarity,
+            "disengaged_turns": self.disengaged_turns,
+            "disengaged_max_words": self.disengaged_max_words
+        }
+
+    def check(self,
+              dialog_history: List[Dict[str, str]],
+              turn_number: int,
+              max_turns: int,
+              doctor_signaled: bool = False) -> Optional[str]:
+        """
+        Reason to end the interview now, or None to continue
+
+        Args:
+            dialog_history: Messages so far ({"role": "Doctor"/"Patient", "content": ...}),
+                ending with the patient's latest reply
+            turn_number: Patient replies so far
+            max_turns: Maximum patient replies
+            doctor_signaled: The doctor's last message carried the completion signal
+
+        Returns:
+            One of REASONS, or None
+        """
+        if turn_number >= max_turns:
+            return "max_turns"
+        if self.mode == 'max_turns' or turn_number < self.min_turns:
+            return None
+
+        if doctor_signaled:
+            return "doctor_signal"
+
+        doctor = [m['content'] for m in dialog_history if m['role'] == 'Doctor']
+        patient = [m['content'] for m in dialog_history if m['role'] == 'Patient']
+
+        if (self._closing is not None and doctor and '?' not in doctor[-1]
+                and self._closing.search(_normalize(doctor[-1]))):
+            return "closing"
+        if self._farewell is not None and patient and self._farewell.search(_normalize(patient[-1])):
+            return "farewell"
+        if self.max_repeated_questions and self._repeated_questions(doctor) >= self.max_repeated_questions:
+            return "repeated_questions"
+        if self.disengaged_turns and self._short_replies(patient) >= self.disengaged_turns:
+            return "patient_disengaged"
+        return None
+
+    def _repeated_questions(self, doctor_messages: List[str]) -> int:
+        """Trailing doctor messages whose questions were all asked before"""
+        asked = [_questions(message) for message in doctor_messages]
+        repeats = 0
+        for index in range(len(asked) - 1, 0, -1):
+            earlier = [q for questions in asked[:index] for q in questions]
+            if not asked[index] or not all(
+                    any(_similar(q, previous, self.question_similarity) for previous in earlier)
+                    for q in asked[index]):
+                break
+            repeats += 1
+        return repeats
+
+    def _short_replies(self, patient_messages: List[str]) -> int:
+        """Trailing patient replies of at most `disengaged_max_words` words"""
+        count = 0
+        for message in reversed(patient_messages):
+            if len(_words(message)) > self.disengaged_max_words:
+                break
+            count += 1
+        return count
+
+
+def strip_signal(text: str) -> Tuple[str, bool]:
+    """Remove the completion signal from a doctor message; returns (text, whether it was present)"""
+    if COMPLETE_SIGNAL not in text:
+        return text, False
+    return text.replace(COMPLETE_SIGNAL, "").rstrip(), True
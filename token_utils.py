@@ -0,0 +1,33 @@
+"""
+Token estimation helpers shared by the client and agents
+"""
+
+from typing import Dict, List
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # tiktoken is optional; fall back to a character-count estimate
+    _ENCODING = None
+
+
+# Rough average for English chat text with BPE tokenizers
+CHARS_PER_TOKEN = 4
+
+# Per-message framing overhead (role markers, separators)
+TOKENS_PER_MESSAGE = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count for a string (tiktoken if installed, else a character estimate)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """Token count for a chat message list, including per-message overhead"""
+    return sum(TOKENS_PER_MESSAGE + estimate_tokens(m.get('content') or '') for m in messages)
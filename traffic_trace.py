@@ -0,0 +1,198 @@
+"""
+Request/response traces for LLMClient - record live traffic and replay it offline
+A trace is an append-only JSONL file of requests and what they returned, with
+a sidecar index (<trace>.idx) of record offsets so replay can start without
+parsing every response.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class ReplayError(RuntimeError):
+    """The trace has no response for a request (or, in sequential order, a different one)"""
+
+
+def _index_line(key: str, offset: int, length: int) -> str:
+    return f"{key} {offset} {length}\n"
+
+
+class TraceRecorder:
+    """Appends every request and its response (or final error) to a trace file"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Trace file; an existing trace is appended to
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.path.with_name(self.path.name + '.idx')
+
+        # An index left behind by a crash is rebuilt so it covers every record
+        self.count = len(_load_index(self.path, self.index_path, repair=True)) if self.path.exists() else 0
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'ab')
+        self._index = open(self.index_path, 'a', encoding='utf-8')
+        self._start = time.time()
+
+    def record(self,
+               key: str,
+               model_id: str,
+               role: Optional[str],
+               request: Dict,
+               response: Optional[Dict] = None,
+               error: Optional[Exception] = None):
+        """
+        Append one request with its response fields, or the error it ended with
+
+        Args:
+            key: Request hash (ResponseCache.make_key of `request`)
+            model_id: Model the request was sent to
+            role: Calling agent, if known
+            request: Request description (model, messages, sampling params)
+            response: Completion fields (text, token counts, timings)
+            error: Exception the request finally failed with
+        """
+        record = {
+            "key": key,
+            "model_id": model_id,
+            "role": role,
+            "t": round(time.time() - self._start, 6),
+            "request": request
+        }
+        if error is not None:
+            record["error"] = str(error)
+        else:
+            record["response"] = response
+        line = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(line)
+            self._file.flush()
+            self._index.write(_index_line(key, offset, len(line)))
+            self._index.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            for f in (self._file, self._index):
+                if not f.closed:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    f.close()
+
+
+class TraceReplay:
+    """
+    Serves recorded responses without touching the network
+
+    Orders:
+        hash: each request gets the next unused record with the same request
+            hash, so concurrent runs replay deterministically
+        sequential: the Nth request gets the Nth record, and must have the same
+            hash; only reproducible when the recorded run made its calls in a
+            fixed order (concurrency 1)
+    """
+
+    def __init__(self, path: str, order: str = 'hash'):
+        if order not in ('hash', 'sequential'):
+            raise ValueError(f"Unknown replay order: {order}")
+
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"Trace file not found: {self.path}")
+        self.order = order
+        self.index_path = self.path.with_name(self.path.name + '.idx')
+
+        self._entries = _load_index(self.path, self.index_path)
+        self._by_key = defaultdict(deque)
+        for position, (key, _, _) in enumerate(self._entries):
+            self._by_key[key].append(position)
+        self._next = 0
+        self.served = 0
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'rb')
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def take(self, key: str) -> Dict:
+        """
+        The recorded entry for a request, consuming it
+
+        Raises:
+            ReplayError: No (matching) record is left for this request
+        """
+        with self._lock:
+            if self.order == 'sequential':
+                if self._next >= len(self._entries):
+                    raise ReplayError(f"Trace {self.path} has only {len(self._entries)} records")
+                position = self._next
+                if self._entries[position][0] != key:
+                    raise ReplayError(f"Request {position} differs from the one recorded at that position in {self.path}")
+                self._next += 1
+            else:
+                queue = self._by_key.get(key)
+                if not queue:
+                    raise ReplayError(f"No recorded response left for request {key[:12]} in {self.path}")
+                position = queue.popleft()
+
+            _, offset, length = self._entries[position]
+            self._file.seek(offset)
+            line = self._file.read(length)
+            self.served += 1
+        return json.loads(line)
+
+    def remaining(self) -> int:
+        """Records not served yet"""
+        with self._lock:
+            return len(self._entries) - self.served
+
+    def close(self):
+        self._file.close()
+
+
+def _load_index(path: Path, index_path: Path, repair: bool = False) -> List:
+    """
+    (key, offset, length) per record, rebuilding the index if it does not cover the trace
+
+    With `repair`, a truncated last record (crash mid-write) is cut from the
+    trace so appends start on a clean line; otherwise it is only skipped.
+    """
+    size = path.stat().st_size
+    entries = []
+    if index_path.exists():
+        with open(index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3:
+                    entries.append((parts[0], int(parts[1]), int(parts[2])))
+        end = entries[-1][1] + entries[-1][2] if entries else 0
+        if end == size:
+            return entries
+
+    # Scan the trace, stopping at a truncated last record
+    entries = []
+    with open(path, 'rb') as f:
+        offset = 0
+        for line in f:
+            try:
+                key = json.loads(line)["key"]
+            except (json.JSONDecodeError, KeyError):
+                break
+            entries.append((key, offset, len(line)))
+            offset += len(line)
+
+    if repair and offset != size:
+        with open(path, 'r+b') as f:
+            f.truncate(offset)
+    with open(index_path, 'w', encoding='utf-8') as f:
+        f.writelines(_index_line(*entry) for entry in entries)
+    return entries